@@ -0,0 +1,439 @@
+#!/usr/bin/env python3
+'''
+sshfdpass benchmark
+-------------------
+
+End-to-end benchmark of the ProxyUseFDPass path.
+
+Every invocation is driven the way ssh does it: sshfdpass is started as a new process with its stdout
+being one end of a unix socketpair, and the benchmark waits on the other end with recvmsg() for the
+passed file descriptor. The latency is measured from starting the process until the fd arrives.
+
+Everything runs offline, in a temporary HOME:
+* a local TCP listener stands in for the ssh servers
+* a small relay script stands in for the jumphost (`ssh -W`) of the command action
+* the config is generated with the requested number of rules (exact hosts, globs, networks and regexes)
+
+Scenarios:
+    tcp      direct tcp4 action to the listener
+    hostname the same, but the action connects to localhost by name
+    command  the command action, running the jumphost stand-in
+    test     an ipv4range test (method local) in front of the tcp4 action
+    glob     the host is only matched by a glob rule
+Modes:
+    cold     no compiled config, the config is parsed by every invocation
+    warm     the config is compiled with `sshfdpass compile` first (the rule store)
+    daemon   the invocations are served by sshfdpassd
+
+Every invocation writes its trace (see sshfdpass.common.trace), they are summarized as a per phase breakdown.
+The maximum resident set size of every invocation is collected with wait4().
+
+Examples:
+    python benchmarks/bench.py
+    python benchmarks/bench.py --rules 10,1000,100000 --scenarios tcp,glob --modes cold,warm -n 50
+    python benchmarks/bench.py --concurrency 200 --scenarios command --modes warm
+    python benchmarks/bench.py --json > baseline.json
+    python benchmarks/bench.py --compare baseline.json --threshold 1.25
+    python -m sshfdpass.bundle -o /tmp/sshfdpass.pyz && python benchmarks/bench.py --zipapp /tmp/sshfdpass.pyz
+
+With --compare the exit status is 1, if the median or the 90th percentile of any measurement is
+worse than the baseline's multiplied by the threshold, so it can be used to gate regressions.
+'''
+
+import os
+import sys
+import json
+import math
+import time
+import array
+import shutil
+import socket
+import argparse
+import tempfile
+import selectors
+import threading
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+LIB = os.path.join(os.path.dirname(HERE), 'lib')
+
+SCENARIOS = ('tcp', 'hostname', 'command', 'test', 'glob')
+MODES = ('cold', 'warm', 'daemon')
+
+RELAY = '''
+import os, sys, socket, select
+sock = socket.create_connection((sys.argv[1], int(sys.argv[2])))
+fds = { 0: sock.fileno(), sock.fileno(): 1 }
+while fds:
+    for fd in select.select(list(fds), [], [])[0]:
+        data = os.read(fd, 65536)
+        if not data:
+            sys.exit(0)
+        os.write(fds[fd], data)
+'''
+
+RUNNER = 'import sys, sshfdpass; sys.argv = ["sshfdpass"] + sys.argv[1:]; sys.exit(0 if sshfdpass.run() else 1)'
+
+
+class Listener():
+    '''Local TCP listener, standing in for the ssh servers'''
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(4096)
+        self.port = self.sock.getsockname()[1]
+        self.accepted = 0
+        thread = threading.Thread(target=self._serve)
+        thread.daemon = True
+        thread.start()
+
+    def _serve(self):
+        while True:
+            try:
+                conn, addr = self.sock.accept()
+            except OSError:
+                return
+            self.accepted += 1
+            conn.close()
+
+
+def generate_config(path, rules, port, relay, loglevel):
+    '''
+    Write a config with the given number of rules
+
+    The benchmarked hosts are bench-tcp, bench-hostname (connected by name, so it goes through the resolver cache),
+    bench-command, bench-test and anything under .bench.glob,
+    the rest of the rules are fillers: mostly exact hosts, with some globs, networks and regexes,
+    roughly as a big generated inventory would look like.
+    JSON is a subset of yaml, so the file is readable by every config loader.
+    '''
+    tcp = [ { 'action': 'tcp4', 'tcp4.host': '127.0.0.1' } ]
+    ruleset = {
+        'bench-tcp': tcp,
+        'bench-hostname': [ { 'action': 'tcp4', 'tcp4.host': 'localhost' } ],
+        'bench-command': [ { 'action': { 'command': [ sys.executable, relay, '127.0.0.1', str(port) ] } } ],
+        'bench-test': [ { 'test': { 'ipv4range': [ '127.0.0.0/8' ] }, 'action': 'tcp4', 'tcp4.host': '127.0.0.1' } ] + tcp,
+        '*.bench.glob': tcp,
+    }
+    for i in range(max(0, rules - len(ruleset))):
+        if i % 100 == 1:
+            key = '*.zone%d.example.com'%(i)
+        elif i % 100 == 2:
+            key = '10.%d.%d.0/24'%((i // 256) % 256, i % 256)
+        elif i % 1000 == 3:
+            key = '~^node%d-[0-9]+\\.example\\.net$'%(i)
+        else:
+            key = 'host%06d.example.com'%(i)
+        ruleset[key] = [ { 'action': 'tcp4', 'tcp4.host': '192.0.2.%d'%(i % 254 + 1) } ]
+    config = { 'settings': { 'logging': { 'level': loglevel } }, 'rules': ruleset }
+    with open(path, 'w') as conffd:
+        json.dump(config, conffd, indent=1)
+
+
+def scenario_host(scenario):
+    return 'web1.bench.glob' if scenario == 'glob' else 'bench-%s'%(scenario)
+
+
+class Bench():
+    def __init__(self, args):
+        self.args = args
+        self.home = tempfile.mkdtemp(prefix='sshfdpass-bench-')
+        os.mkdir(os.path.join(self.home, '.ssh'))
+        self.conffile = os.path.join(self.home, '.ssh', 'fdpass.conf')
+        self.tracefile = os.path.join(self.home, 'trace')
+        self.relay = os.path.join(self.home, 'relay.py')
+        with open(self.relay, 'w') as relayfd:
+            relayfd.write(RELAY)
+        self.listener = Listener()
+        self.env = dict(os.environ)
+        self.env.update(HOME=self.home, SSHFDPASS_SOCKET=os.path.join(self.home, 'fdpass.sock'),
+                SSHFDPASS_TRACE=self.tracefile)
+        self.env.pop('SSHFDPASS_LOGLEVEL', None)
+        if args.zipapp:
+            # The daemon and the compile command run from the archive as well
+            self.env['PYTHONPATH'] = os.path.abspath(args.zipapp)
+        elif not args.installed:
+            self.env['PYTHONPATH'] = os.pathsep.join([ LIB ] + [ path for path in [ os.environ.get('PYTHONPATH') ] if path ])
+        self.daemon = None
+
+    def close(self):
+        self.stop_daemon()
+        shutil.rmtree(self.home, ignore_errors=True)
+
+    def command(self, *args):
+        if self.args.zipapp:
+            return [ sys.executable, os.path.abspath(self.args.zipapp) ] + list(args)
+        return [ sys.executable, '-c', RUNNER ] + list(args)
+
+    def prepare(self, rules, mode):
+        self.stop_daemon()
+        # Generated in a separate process: the max rss survives exec(), so if this process grew
+        # by building a huge config, every invocation started from it would report at least that much
+        subprocess.check_call([ sys.executable, os.path.abspath(__file__), '--generate', self.conffile,
+            str(rules), str(self.listener.port), self.relay, self.args.loglevel ])
+        if os.path.exists(self.conffile + '.rules'):
+            os.unlink(self.conffile + '.rules')
+        if mode in ('warm', 'daemon'):
+            subprocess.check_call(self.command('compile'), env=self.env, stdout=subprocess.DEVNULL)
+        if mode == 'daemon':
+            self.start_daemon()
+
+    def start_daemon(self):
+        self.daemon = subprocess.Popen([ sys.executable, '-m', 'sshfdpass.daemon' ], env=self.env)
+        deadline = time.time() + 10
+        while not os.path.exists(self.env['SSHFDPASS_SOCKET']):
+            if time.time() > deadline or self.daemon.poll() is not None:
+                raise RuntimeError('sshfdpassd did not start')
+            time.sleep(0.01)
+
+    def stop_daemon(self):
+        if self.daemon is not None:
+            self.daemon.terminate()
+            self.daemon.wait()
+            self.daemon = None
+
+    def start(self, host, port):
+        '''Start an invocation like ssh does, returns the process and our end of the socketpair'''
+        ours, theirs = socket.socketpair()
+        proc = subprocess.Popen(self.command(host, str(port)), env=self.env, stdout=theirs,
+                stdin=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        theirs.close()
+        return proc, ours
+
+    @staticmethod
+    def receive(sock):
+        '''Receive the passed fd, returns it or None'''
+        fds = array.array('i')
+        try:
+            msg, ancdata, flags, addr = sock.recvmsg(1, socket.CMSG_LEN(fds.itemsize))
+        except OSError:
+            return None
+        for level, kind, data in ancdata:
+            if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+                fds.frombytes(data[:len(data) - (len(data) % fds.itemsize)])
+        return fds[0] if fds else None
+
+    @staticmethod
+    def finish(proc):
+        '''Reap the process, returns its exit status and max rss in KiB'''
+        pid, status, rusage = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status) if hasattr(os, 'waitstatus_to_exitcode') else status
+        maxrss = rusage.ru_maxrss
+        if sys.platform == 'darwin':
+            maxrss //= 1024
+        return proc.returncode, maxrss
+
+    def invoke(self, host, port):
+        begin = time.perf_counter()
+        proc, sock = self.start(host, port)
+        sock.settimeout(self.args.timeout)
+        fd = self.receive(sock)
+        latency = time.perf_counter() - begin
+        sock.close()
+        stderr = proc.stderr.read()
+        proc.stderr.close()
+        status, maxrss = self.finish(proc)
+        if fd is not None:
+            os.close(fd)
+        if fd is None or status != 0:
+            return dict(ok=False, error=stderr.decode('utf-8', 'replace')[-500:])
+        return dict(ok=True, latency=latency, maxrss=maxrss)
+
+    def concurrent(self, host, port, count):
+        '''Start count invocations at once, and collect their fds as they arrive'''
+        selector = selectors.DefaultSelector()
+        running = []
+        begin = time.perf_counter()
+        for i in range(count):
+            proc, sock = self.start(host, port)
+            sock.setblocking(False)
+            selector.register(sock, selectors.EVENT_READ, (proc, sock))
+            running.append((proc, sock))
+        results = dict()
+        deadline = time.time() + self.args.timeout
+        while len(results) < count and time.time() < deadline:
+            for key, events in selector.select(max(0, deadline - time.time())):
+                proc, sock = key.data
+                selector.unregister(sock)
+                results[proc.pid] = (self.receive(sock), time.perf_counter() - begin)
+        wall = time.perf_counter() - begin
+        ret = []
+        for proc, sock in running:
+            sock.close()
+            proc.stderr.close()
+            status, maxrss = self.finish(proc)
+            fd, latency = results.get(proc.pid, (None, None))
+            if fd is not None:
+                os.close(fd)
+            if fd is None or status != 0:
+                ret.append(dict(ok=False))
+            else:
+                ret.append(dict(ok=True, latency=latency, maxrss=maxrss))
+        selector.close()
+        return ret, wall
+
+    def traces(self):
+        '''Read and forget the traces of the invocations since the last call'''
+        records = []
+        if os.path.exists(self.tracefile):
+            with open(self.tracefile) as tracefd:
+                for line in tracefd:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        pass
+            os.unlink(self.tracefile)
+        return records
+
+    def measure(self, scenario, rules, mode):
+        host = scenario_host(scenario)
+        port = self.listener.port
+        if mode == 'cold':
+            self.prepare(rules, mode)
+            results = []
+            for i in range(self.args.iterations):
+                results.append(self.invoke(host, port))
+            wall = None
+        else:
+            self.prepare(rules, mode)
+            for i in range(self.args.warmup):
+                self.invoke(host, port)
+            self.traces()
+            if self.args.concurrency:
+                results, wall = self.concurrent(host, port, self.args.concurrency)
+            else:
+                results = [ self.invoke(host, port) for i in range(self.args.iterations) ]
+                wall = None
+        return summarize(scenario, rules, mode, results, self.traces(), wall, self.args.concurrency if wall is not None else 0)
+
+
+def percentile(values, pct):
+    '''Nearest rank percentile of sorted values'''
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, int(math.ceil(pct / 100.0 * len(values))) - 1))]
+
+
+def summarize(scenario, rules, mode, results, traces, wall=None, concurrency=0):
+    latencies = sorted(result['latency'] * 1000 for result in results if result['ok'])
+    rss = [ result['maxrss'] for result in results if result['ok'] ]
+    phases = dict()
+    for trace in traces:
+        if trace.get('host') != scenario_host(scenario):
+            continue
+        for record in trace.get('phases', []):
+            phases.setdefault(record.get('phase'), []).append(record.get('ms', 0))
+    ret = dict(scenario=scenario, rules=rules, mode=mode, concurrency=concurrency, count=len(results), failed=len(results) - len(latencies),
+            p50=percentile(latencies, 50), p90=percentile(latencies, 90), p99=percentile(latencies, 99),
+            min=latencies[0] if latencies else None, max=latencies[-1] if latencies else None,
+            maxrss=max(rss) if rss else None,
+            phases=dict((name, percentile(sorted(values), 50)) for name, values in phases.items()))
+    if wall is not None:
+        ret['wall'] = wall * 1000
+        ret['throughput'] = len(latencies) / wall if wall else None
+    errors = [ result['error'] for result in results if not result['ok'] and result.get('error') ]
+    if errors:
+        ret['error'] = errors[0]
+    return ret
+
+
+def fmt(value, spec='%.1f'):
+    return '-' if value is None else spec%(value)
+
+
+def report(results, out):
+    out.write('%-8s %7s %-6s %5s %4s %8s %8s %8s %8s %9s\n'%('scenario', 'rules', 'mode', 'n', 'fail', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms', 'rss KiB'))
+    for result in results:
+        out.write('%-8s %7d %-6s %5d %4d %8s %8s %8s %8s %9s\n'%(result['scenario'], result['rules'], result['mode'],
+            result['count'], result['failed'], fmt(result['p50']), fmt(result['p90']), fmt(result['p99']),
+            fmt(result['max']), fmt(result['maxrss'], '%d')))
+        if 'wall' in result:
+            out.write('    all %d invocations done in %.1f ms, %s invocations/s\n'%(result['count'], result['wall'], fmt(result['throughput'])))
+        if result['phases']:
+            out.write('    median phases (ms): %s\n'%(', '.join('%s %.2f'%(name, value)
+                for name, value in sorted(result['phases'].items(), key=lambda item: -item[1]))))
+        if result.get('error'):
+            out.write('    first error: %s\n'%(result['error'].strip().splitlines()[-1] if result['error'].strip() else ''))
+
+
+def compare(results, baseline, threshold, out):
+    '''Compare the results with a baseline, returns the number of regressions'''
+    def key(entry):
+        return entry['scenario'], entry['rules'], entry['mode'], entry.get('concurrency', 0)
+    known = dict((key(entry), entry) for entry in baseline)
+    regressions = 0
+    for result in results:
+        base = known.get(key(result))
+        if base is None:
+            continue
+        for metric in ('p50', 'p90'):
+            if result[metric] is None or base.get(metric) is None:
+                continue
+            if result[metric] > base[metric] * threshold:
+                regressions += 1
+                out.write('REGRESSION %s/%d/%s %s: %.1f ms, baseline %.1f ms\n'%(result['scenario'], result['rules'],
+                    result['mode'], metric, result[metric], base[metric]))
+        if result['failed'] > base.get('failed', 0):
+            regressions += 1
+            out.write('REGRESSION %s/%d/%s: %d failed invocations\n'%(result['scenario'], result['rules'], result['mode'], result['failed']))
+    return regressions
+
+
+def csv(value):
+    return [ item for item in value.split(',') if item ]
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ['--generate']:
+        path, rules, port, relay, loglevel = argv[1:]
+        generate_config(path, int(rules), int(port), relay, loglevel)
+        return 0
+    parser = argparse.ArgumentParser(description='End-to-end benchmark of sshfdpass')
+    parser.add_argument('--rules', type=csv, default=['10', '1000', '10000'], help='comma separated config sizes (default: 10,1000,10000)')
+    parser.add_argument('--scenarios', type=csv, default=list(SCENARIOS), help='comma separated: %s'%(','.join(SCENARIOS)))
+    parser.add_argument('--modes', type=csv, default=['cold', 'warm'], help='comma separated: %s (default: cold,warm)'%(','.join(MODES)))
+    parser.add_argument('-n', '--iterations', type=int, default=20, help='invocations per measurement (default: 20)')
+    parser.add_argument('--warmup', type=int, default=3, help='invocations before measuring warm modes (default: 3)')
+    parser.add_argument('--concurrency', type=int, default=0, help='start this many invocations at once in warm and daemon modes')
+    parser.add_argument('--timeout', type=float, default=60, help='seconds to wait for the fds (default: 60)')
+    parser.add_argument('--loglevel', default='warning', help='log level of the invocations (default: warning)')
+    parser.add_argument('--installed', action='store_true', help='benchmark the installed sshfdpass instead of ../lib')
+    parser.add_argument('--zipapp', metavar='ARCHIVE', help='benchmark an archive built by sshfdpass.bundle')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    parser.add_argument('--compare', metavar='BASELINE', help='compare with the JSON results of an earlier run')
+    parser.add_argument('--threshold', type=float, default=1.25, help='allowed slowdown ratio with --compare (default: 1.25)')
+    args = parser.parse_args(argv)
+    for scenario in args.scenarios:
+        if scenario not in SCENARIOS:
+            parser.error('unknown scenario: %s'%(scenario))
+    for mode in args.modes:
+        if mode not in MODES:
+            parser.error('unknown mode: %s'%(mode))
+    bench = Bench(args)
+    results = []
+    try:
+        for rules in [ int(rules) for rules in args.rules ]:
+            for mode in args.modes:
+                for scenario in args.scenarios:
+                    if mode == 'cold' and args.concurrency:
+                        continue
+                    results.append(bench.measure(scenario, rules, mode))
+                    if not args.json:
+                        report(results[-1:], sys.stderr)
+    finally:
+        bench.close()
+    if args.json:
+        json.dump(results, sys.stdout, indent=1, sort_keys=True)
+        sys.stdout.write('\n')
+    else:
+        report(results, sys.stdout)
+    if args.compare:
+        with open(args.compare) as basefd:
+            if compare(results, json.load(basefd), args.threshold, sys.stderr):
+                return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
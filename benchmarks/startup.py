@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+'''
+sshfdpass startup benchmark
+---------------------------
+
+Import time budgets of an invocation.
+
+The tcp and hostname scenarios of bench.py are run with `python -X importtime`, and the import times are checked:
+* the median of the import time of an invocation must be within --budget milliseconds.
+  It's the total import time, minus the median total import time of the bare interpreter (python -c pass),
+  so it's what sshfdpass adds, and it's less dependent on the machine.
+  The __main__ module of an archive is left out, because its self time is the whole invocation.
+* none of the modules listed in FORBIDDEN may be imported. A tcp action from a JSON or compiled config
+  doesn't need any of them, so importing one means a deferred import became eager again.
+  ctypes is needed only to discover the network fingerprint, which the invocations share
+  (see sshfdpass.common.netinfo), so one invocation of each scenario and mode runs first to warm it up, like in real use.
+  hashlib (and its OpenSSL backed _hashlib) alone costs several milliseconds, the digests of the hot path use zlib
+  (see sshfdpass.common.digest()), and the rule store is read without pickle.
+The slowest modules are reported by their median self time, to show where the time goes.
+
+Modes:
+    cold     JSON config, parsed by every invocation (PyYAML must not be imported)
+    warm     compiled config: the rule store
+
+Examples:
+    python benchmarks/startup.py
+    python benchmarks/startup.py --scenarios hostname
+    python benchmarks/startup.py --budget 25 -n 30
+    python -m sshfdpass.bundle -o /tmp/sshfdpass.pyz && python benchmarks/startup.py --zipapp /tmp/sshfdpass.pyz
+
+The exit status is 1, if any budget is exceeded, so it can be used to gate regressions.
+The budget depends on the machine, measure a baseline first. Compile the sources before measuring a source tree
+(python -m compileall lib), otherwise the modules without an up to date .pyc are compiled by every invocation.
+'''
+
+import os
+import sys
+import argparse
+
+from bench import Bench, csv, percentile, scenario_host
+
+MODES = ('cold', 'warm')
+
+SCENARIOS = ('tcp', 'hostname')
+
+# Modules an invocation of the tcp scenarios must not import
+_FORBIDDEN = ('yaml', 'pkgutil', 'inspect', 'importlib.metadata', 'argparse', 'ctypes', 'sshfdpass.common.routestats',
+        'sshfdpass.common.race', 'sshfdpass.common.pool', 'sshfdpass.actions.command', 'sshfdpass.actions.jump',
+        'sshfdpass.actions.socks5', 'sshfdpass.actions.httpconnect', 'sshfdpass.tests.ipv4range', 'sshfdpass.tests.tcpreach', 'encodings.idna',
+        'pickle', 'hashlib', '_hashlib')
+FORBIDDEN = {
+    'cold': _FORBIDDEN + ('mmap', 'sshfdpass.common.rulestore'),
+    'warm': _FORBIDDEN,
+}
+
+
+def parse_importtime(stderr):
+    '''Parse the -X importtime output, returns a dict of module -> self time in microseconds'''
+    modules = dict()
+    for line in stderr.decode('utf-8', 'replace').splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        module = fields[2].strip()
+        # The self time of __main__ is the whole invocation, not an import
+        if module != '__main__' and not module.endswith('.__main__'):
+            modules[module] = int(fields[0])
+    return modules
+
+
+class StartupBench(Bench):
+    def interpreter(self):
+        '''Median total import time of the bare interpreter in ms'''
+        import subprocess
+        totals = []
+        for i in range(self.args.iterations):
+            proc = subprocess.Popen([ sys.executable, '-X', 'importtime', '-c', 'pass' ], env=self.env, stderr=subprocess.PIPE)
+            stderr = proc.communicate()[1]
+            totals.append(sum(parse_importtime(stderr).values()) / 1000.0)
+        return percentile(sorted(totals), 50)
+
+    def command(self, *args):
+        command = Bench.command(self, *args)
+        if args[:1] == ('compile',):
+            return command
+        return command[:1] + [ '-X', 'importtime' ] + command[1:]
+
+    def invoke(self, host, port):
+        proc, sock = self.start(host, port)
+        sock.settimeout(self.args.timeout)
+        fd = self.receive(sock)
+        sock.close()
+        stderr = proc.stderr.read()
+        proc.stderr.close()
+        status, maxrss = self.finish(proc)
+        if fd is not None:
+            os.close(fd)
+        if fd is None or status != 0:
+            return dict(ok=False, error=stderr.decode('utf-8', 'replace')[-500:])
+        return dict(ok=True, modules=parse_importtime(stderr))
+
+    def measure(self, scenario, mode):
+        self.prepare(self.args.rules, mode)
+        self.invoke(scenario_host(scenario), self.listener.port)
+        results = [ self.invoke(scenario_host(scenario), self.listener.port) for i in range(self.args.iterations) ]
+        failed = [ result for result in results if not result['ok'] ]
+        if failed:
+            return dict(scenario=scenario, mode=mode, error=failed[0]['error'])
+        totals = sorted(sum(result['modules'].values()) / 1000.0 for result in results)
+        imported = set()
+        selftimes = dict()
+        for result in results:
+            imported.update(result['modules'])
+            for module, selftime in result['modules'].items():
+                selftimes.setdefault(module, []).append(selftime / 1000.0)
+        slowest = sorted(((percentile(sorted(times), 50), module) for module, times in selftimes.items()), reverse=True)
+        return dict(scenario=scenario, mode=mode, total=percentile(totals, 50), modules=len(imported),
+                forbidden=sorted(imported & set(FORBIDDEN[mode])), slowest=slowest[:self.args.top])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Import time budgets of sshfdpass')
+    parser.add_argument('--budget', type=float, default=40, help='allowed median import time in ms (default: 40)')
+    parser.add_argument('--scenarios', type=csv, default=list(SCENARIOS), help='comma separated: %s'%(','.join(SCENARIOS)))
+    parser.add_argument('--modes', type=csv, default=list(MODES), help='comma separated: %s'%(','.join(MODES)))
+    parser.add_argument('--rules', type=int, default=1000, help='config size (default: 1000)')
+    parser.add_argument('-n', '--iterations', type=int, default=20, help='invocations per scenario and mode (default: 20)')
+    parser.add_argument('--top', type=int, default=10, help='report this many of the slowest modules (default: 10)')
+    parser.add_argument('--timeout', type=float, default=60, help='seconds to wait for the fds (default: 60)')
+    parser.add_argument('--loglevel', default='warning', help='log level of the invocations (default: warning)')
+    parser.add_argument('--installed', action='store_true', help='check the installed sshfdpass instead of ../lib')
+    parser.add_argument('--zipapp', metavar='ARCHIVE', help='check an archive built by sshfdpass.bundle')
+    args = parser.parse_args(argv)
+    for mode in args.modes:
+        if mode not in MODES:
+            parser.error('unknown mode: %s'%(mode))
+    for scenario in args.scenarios:
+        if scenario not in SCENARIOS:
+            parser.error('unknown scenario: %s'%(scenario))
+    bench = StartupBench(args)
+    failures = 0
+    try:
+        interpreter = bench.interpreter()
+        sys.stdout.write('bare interpreter: %.1f ms\n'%(interpreter))
+        for scenario in args.scenarios:
+            for mode in args.modes:
+                result = bench.measure(scenario, mode)
+                name = '%s/%s'%(scenario, mode)
+                if 'error' in result:
+                    failures += 1
+                    sys.stdout.write('%-13s FAILED: %s\n'%(name, result['error'].strip().splitlines()[-1] if result['error'].strip() else ''))
+                    continue
+                spent = result['total'] - interpreter
+                verdict = 'ok' if spent <= args.budget else 'OVER BUDGET'
+                sys.stdout.write('%-13s import time %.1f ms (budget %.1f ms, total %.1f ms), %d modules: %s\n'%(name,
+                    spent, args.budget, result['total'], result['modules'], verdict))
+                if spent > args.budget:
+                    failures += 1
+                if result['forbidden']:
+                    failures += 1
+                    sys.stdout.write('              FORBIDDEN modules imported: %s\n'%(', '.join(result['forbidden'])))
+                sys.stdout.write('              slowest (median self ms): %s\n'%(', '.join('%s %.2f'%(module, ms) for ms, module in result['slowest'])))
+    finally:
+        bench.close()
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
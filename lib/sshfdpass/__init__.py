@@ -19,8 +19,17 @@ Configuration file must be in your home in .ssh/fdpass.conf
 Configuration format can be yaml or json.
 If yaml python module is provided on the system, it will try to parse the config as yaml.
 If there is no yaml around, then it fallbacks to interpret the config file as json.
+A config starting with { is parsed as json directly, so a json config never imports yaml.
 The content is simple: a dict where the package reads info under the following keys: settings, tests, rules
 
+Compiled config
+---------------
+    Running `sshfdpass compile` parses the config file once, and builds an indexed rule store next to it, .ssh/fdpass.conf.rules.
+    While it's up to date, later invocations load only its settings, tests and pattern rules instead of parsing the yaml again,
+    and the rules of exact host:port and host keys are read from it one by one, on demand, so a config with a huge number
+    of hosts doesn't slow down the startup. When the config changes, the store is refreshed automatically on the next run.
+    See sshfdpass.common.rulestore.
+
 Settings
 --------
     You can set defaults for the tests and actions, therefore the expectation here is a dict again, and this two keys will be considered.
@@ -35,12 +44,54 @@ Settings
     actions:
       tcp:
         aforder: 4,6
+    The engine key holds the settings of the rule evaluation itself:
+    engine:
+      concurrent: true   # evaluate the tests of the candidate rules in parallel
+      maxworkers: 8      # at most this many tests at the same time
+      deadline: 10       # seconds for the whole invocation; a test running out of time is false,
+                         # an action running out of time lets the next rule's action try
+      strategy: sequential  # or race: run the actions of the first racecount applicable rules at once
+      racecount: 2
+      stagger: 0.25      # seconds between starting the racing actions
+      speculative: false # start the first unconditional rule's action while the tests are evaluated
+      adaptive: false    # sort the applicable rules marked with interchangeable: yes by their latency (needs routes.enabled)
+      hosts:             # per host:port or host overrides of the engine settings
+        foo:
+          strategy: race
+    If an action fails, the next applicable rule's action is tried.
+    Tests and actions have their own timeout setting too (3 seconds for tests by default, no limit for actions),
+    which can be overridden per rule for actions, like tcp.timeout: 2
+    With the route statistics enabled, the outcome of every action is recorded per rule and destination.
+    A rule which keeps failing is tried only after the others for a while (circuit breaking),
+    see sshfdpass.common.routestats. The routes key holds its settings.
+    routes:
+      enabled: yes
+    The logging key configures the log: level, file, rotation and syslog/journald output, see sshfdpass.common.logging.
+    logging:
+      level: debug
+    The resolver key configures the persistent cache of the resolved destination addresses, see sshfdpass.common.resolver.
+    resolver:
+      ttl: 600
+    The testcache key enables and configures the persistent cache of the test results, see sshfdpass.common.testcache.
+    testcache:
+      enabled: yes
+      ttl: 120
+    Concurrent invocations evaluate the same test and resolve the same name only once,
+    the singleflight key holds its settings, see sshfdpass.common.singleflight.
+    The trace key enables the per invocation timing trace, see sshfdpass.common.trace and `sshfdpass --explain host port`.
+    trace:
+      enabled: yes
 
 Tests
 -----
-    This package already contain one test at this point. TODO: Add more tests
-    The one builtin test at the moment is ipv4range.
-    By default it tries to connect to 8.8.8.8's port 53, then find out the tcp socket's self address.
+    This package already contain some tests at this point. TODO: Add more tests
+    The builtin tests at the moment are ipv4range and its IPv6 sibling, ipv6range,
+    ifaddr (any interface address in the target networks), gateway (default gateway is one of the targets)
+    searchdomain (a dns search domain matches a target)
+    and tcpreach (the target host:port pairs can be connected directly, probed in parallel).
+    The connection opened by tcpreach is used by the tcp action of the rule, if it connects to the same host and port.
+    ipv4range tries to connect to 8.8.8.8's port 53 by default, then find out the tcp socket's self address.
+    With method: route or method: local it reads the source address or every local address from the kernel instead.
     Then you can built your own tests based on this one, like this:
     lan:
       ipv4range:
@@ -49,7 +100,6 @@ Tests
 
 Rules
 -----
-    Rule matching is quite simple at the moment. TODO: Improve rule matching, implement wildcard matching
     In the configuration the rules are simple: The key what the rule evaluator looks for in the rules dictionary is the hostname:port pair.
     ssh always calls this helper with %h %p as args. If it was an IP address we get an ip, if that was a hostname, we get an ip.
     We get this from ssh what it was originally. You might setup canonicalization or other overriding rules in your ssh config like this:
@@ -60,6 +110,8 @@ Rules
     In this case if you start your ssh as ssh somehostname, than the helper will be called with the "someotherhostname".
     
     After the host:port pair of rules the rules for host will be looked up in the rules dictionary.
+    Keys can also be port ranges (host:2200-2299), destination networks (10.1.0.0/16:22), globs (*.prod.example.com)
+    or regular expressions (~^web[0-9]+$), see sshfdpass.common.rules for the details and the order of precedence.
     And finally there is a hardcoded default rule: the unconditional tcp action.
 
     The right hand side of the rules is another dictionary. The rules can have optionally a test key.
@@ -94,6 +146,25 @@ Actions
 So far, I could not imagine free form action definition. If you have any idea how it could be useful, don't hesitate to share that with me.
 Until that, read all the action's documentation in their own module's page.
 Action execution in the rules however can be tricky.
+The builtin actions are tcp (and tcp4, tcp6), command, jump, and the proxy actions: socks5 and httpconnect.
+The proxy actions do the proxy handshake in-process, and pass the proxied socket itself to ssh, so unlike
+a command action running nc or connect-proxy, no relay process stays around copying the session.
+
+Plugins
+-------
+Tests and actions are plugins: modules in the sshfdpass.tests and sshfdpass.actions packages.
+They are imported and instantiated only when a rule refers to them.
+Third-party packages can provide their own tests and actions via the `sshfdpass.tests` and `sshfdpass.actions` entry point groups.
+
+Batch mode
+----------
+    `sshfdpass --batch [file]` reads host and port pairs (host port, host:port, [address]:port, or a host alone for port 22),
+    one per line, from the file or from the standard input, and writes the rule each one would use, as JSON lines:
+    {"host": "foo", "port": 22, "rule": "foo", "index": 1, "action": "tcp4", "actionargs": null, "params": {"host": "1.2.3.4"}}
+    The config is loaded and every distinct test is evaluated only once for all the hosts, so it's a cheap way to check
+    the routing decisions of a big config, eg. before and after a change.
+    With --verify, the selected actions are run as well (their connections are closed right away), --jobs at a time,
+    and the lines also tell if the connection worked, and how long it took. The lines are in the order of the input.
 
 Example
 -------
@@ -129,22 +200,45 @@ So far, a complete config example adding together the above examples:
 
 '''
 
+import sshfdpass.common.trace
+_imported = sshfdpass.common.trace.monotonic()
+
 import sys
-import pkgutil
+import functools
 
 import sshfdpass.actions as actions
 import sshfdpass.tests as tests
-import sshfdpass.common.config
 import sshfdpass.common
+import sshfdpass.common.deadline
+import sshfdpass.common.fdpass
+import sshfdpass.common.registry
+import sshfdpass.common.trace
 from sshfdpass.common.exceptions import *
 
 log = sshfdpass.common.log
 
 
 _settings={}
-_actions={}
-_tests={}
+_actions=sshfdpass.common.registry.Registry(actions, 'Action', lambda name: _settings.get('actions',{}).get(name,{}))
+_tests=sshfdpass.common.registry.Registry(tests, 'Test', lambda name: _settings.get('tests',{}).get(name,{}))
 _rules={}
+_usertests={}
+# sshfdpass.common.routestats, while the routes settings enable it
+_routestats=None
+
+
+def _import_engine():
+    '''Import the modules of the rule evaluation
+
+    They are imported only once the config is loaded, so an invocation served by the daemon (see run())
+    imports nothing else than the package itself, sshfdpass.daemon and sshfdpass.common.fdpass.
+    '''
+    import sshfdpass.common.config
+    import sshfdpass.common.parallel
+    import sshfdpass.common.resolver
+    import sshfdpass.common.rules
+    import sshfdpass.common.singleflight
+    import sshfdpass.common.testcache
 
 
 def load_config():
@@ -154,35 +248,136 @@ def load_config():
 
     Loads configuration. Don't do any sanitization on settings or rules.
     Other steps here:
-    * system provided builting tests are initialized
-    * system provided actions are initialized
-    * config-defined tests parsed and initialized
+    * system provided builtin tests and actions are registered, but not imported yet
+    * config-defined tests are registered
+
+    Tests and actions are only imported and instantiated on first use, see sshfdpass.common.registry.
+    The modules of the rule evaluation are imported here as well, see _import_engine().
 
     Does not expect params.
     Settings are loaded to the module global _settings var.
     Tests are loaded into the module global _tests var.
     Actions are loaded into the module global _actions var.
-    Rules are loaded into the module global _rules var.
+    Rules are loaded into the module global _rules var. If the config comes from a rule store,
+    _rules is a RuleIndex of the pattern keys, which looks up the exact keys in the store.
     '''
-    import sshfdpass.common.config
-    config = sshfdpass.common.config.read_config(settings=_settings, rules=_rules )
-    # Load test modules
-    for loader, module_name, is_pkg in pkgutil.walk_packages(tests.__path__):
-        if not is_pkg:
-            _tests.setdefault(module_name, loader.find_module(module_name).load_module(module_name).Test(**_settings.get('tests',{}).get(module_name,{})))
-    # Load action modules
-    for loader, module_name, is_pkg in pkgutil.walk_packages(actions.__path__):
-        if not is_pkg:
-            _actions.setdefault(module_name, loader.find_module(module_name).load_module(module_name).Action(**_settings.get('actions',{}).get(module_name,{})))
-    # Load tests from config
-    for usertest in config.get('tests',{}):
-        _tests.setdefault(usertest, tests.parse_test(config.get('tests',{}).get(usertest), _tests, **_settings.get('tests',{}).get(usertest,{})))
+    _import_engine()
+    global _rules
+    rules = dict()
+    config = sshfdpass.common.config.read_config(settings=_settings, rules=rules )
+    _rules = _ruleset(rules, config)
+    _apply_settings(_settings)
+    _register_tests(config.get('tests',{}))
+
+
+def _ruleset(rules, config):
+    '''The rules, or their index, if the config was loaded from a rule store
+
+    The index of a rule store only contains the patterns, its exact keys are looked up in the store.
+    The index cached for the previous rules is dropped.
+    '''
+    sshfdpass.common.rules.invalidate()
+    store = config.get('rulestore')
+    if store is not None:
+        return sshfdpass.common.rules.RuleIndex(rules, exact=store)
+    return rules
+
+
+def _apply_settings(settings):
+    '''Apply the logging, resolver, testcache, singleflight and routes sections of the settings
+
+    See sshfdpass.common.logging, sshfdpass.common.resolver, sshfdpass.common.testcache,
+    sshfdpass.common.singleflight and sshfdpass.common.routestats.
+    '''
+    logging = settings.get('logging')
+    log.configure(**(logging if isinstance(logging, dict) else {}))
+    resolver = settings.get('resolver')
+    sshfdpass.common.resolver.configure(**(resolver if isinstance(resolver, dict) else {}))
+    singleflight = settings.get('singleflight')
+    sshfdpass.common.singleflight.configure(**(singleflight if isinstance(singleflight, dict) else {}))
+    testcache = settings.get('testcache')
+    sshfdpass.common.testcache.configure(**(testcache if isinstance(testcache, dict) else {}))
+    global _routestats
+    routes = settings.get('routes')
+    routes = routes if isinstance(routes, dict) else {}
+    if sshfdpass.common.boolean(routes.get('enabled', False)):
+        from sshfdpass.common import routestats
+        routestats.configure(**routes)
+        _routestats = routestats
+    else:
+        _routestats = None
+
+
+def _register_tests(usertests):
+    '''Register the tests defined in the config'''
+    global _usertests
+    if not isinstance(usertests, dict):
+        usertests = dict()
+    for usertest in usertests:
+        _tests.register(usertest, functools.partial(tests.parse_test, usertests.get(usertest), _tests))
+    _usertests = usertests
+
+
+def _test_base(testdef):
+    '''Name of the test a user defined test is based on'''
+    if isinstance(testdef, dict) and len(testdef) == 1:
+        return list(testdef.keys())[0]
+    if isinstance(testdef, str):
+        return testdef
+    return None
+
+
+def reload_config():
+    '''Reload the configuration, keeping everything which is unchanged
+
+    Used by the daemon, when the config file changes.
+    Test and action instances, (and so their cached results) are only dropped,
+    if their settings or definition changed, or they are based on a changed test.
+    Settings and rules are replaced in one step, so a parallel evaluation
+    sees either the old or the new config.
+    '''
+    global _settings, _rules
+    _import_engine()
+    newsettings = dict()
+    newrules = dict()
+    config = sshfdpass.common.config.read_config(settings=newsettings, rules=newrules)
+    newtests = config.get('tests',{})
+    if not isinstance(newtests, dict):
+        newtests = dict()
+    changed = set()
+    for name in set(_settings.get('actions',{})) | set(newsettings.get('actions',{})):
+        if _settings.get('actions',{}).get(name) != newsettings.get('actions',{}).get(name):
+            _actions.pop(name, None)
+    for name in set(_settings.get('tests',{})) | set(newsettings.get('tests',{})):
+        if _settings.get('tests',{}).get(name) != newsettings.get('tests',{}).get(name):
+            changed.add(name)
+    for name in set(_usertests) | set(newtests):
+        if _usertests.get(name) != newtests.get(name):
+            changed.add(name)
+    # Tests based on changed tests have to be rebuilt as well
+    grown = True
+    while grown:
+        grown = False
+        for name in newtests:
+            if name not in changed and _test_base(newtests.get(name)) in changed:
+                changed.add(name)
+                grown = True
+    for name in changed:
+        _tests.pop(name, None)
+        _tests.factories.pop(name, None)
+    _settings = newsettings
+    _rules = _ruleset(newrules, config)
+    _apply_settings(_settings)
+    _register_tests(newtests)
+    log.info('config reloaded, rebuilt tests: %s', ', '.join(sorted(changed)))
 
 
 def get_my_rules(host, port, rules):
     '''Provide a list of rules should be applied in run()
 
-    Rule matching system is quite simple at the moment. Only host:port and host keys are looked upon in the dictionary.
+    The rules are looked up in a compiled index of the rules dict, see sshfdpass.common.rules
+    for the supported key patterns and their precedence. The index is built on the first call
+    for a given rules dict.
     Always add an unconditional tcp action to the end of the list as a fallback option.
     
     Parameters
@@ -191,22 +386,15 @@ def get_my_rules(host, port, rules):
         host as we got from the command line
     port: str
         port number as we got it from the command line
-    rules: dict
-        A dictionary with all the rules coming from the config.
+    rules: dict or sshfdpass.common.rules.RuleIndex
+        A dictionary with all the rules coming from the config, or its index.
 
     Returns
     -------
     list
-        A list of rules in the order of preference to evaluate.
+        A list of rules (RulePlan objects) in the order of preference to evaluate.
     '''
-    # For some yet unknown reason, this doesn't work on python2:
-    #return rules.get('%s:%s'%(host, port), []) + rules.get(host, []) + [ {'action': 'tcp'} ]
-    # So, I had to decompose this
-    ret = []
-    ret += rules.get('%s:%s'%(host, port), []) 
-    ret += rules.get(host, []) 
-    ret += [ {'action': 'tcp'} ]
-    return ret
+    return sshfdpass.common.rules.index(rules).match(host, port)
 
 def get_action_params(rule):
     '''Construct every aspect of the action to run based on the rule content
@@ -263,25 +451,497 @@ def get_action_params(rule):
             actionparams.setdefault(i[len(prefix):], rule.get(i))
     return myaction, actionargs, actionparams
 
+def compile_config():
+    '''Compile the config file into a rule store
+
+    This is what `sshfdpass compile` does.
+    '''
+    _import_engine()
+    conffile = sshfdpass.common.config.DEFAULT_CONFFILE
+    sshfdpass.common.config.load_config_file(conffile, force=True)
+    print('%s compiled into %s'%(conffile, sshfdpass.common.config.store_path(conffile)))
+    return True
+
+def _candidates(host, port):
+    '''The rules which might be selected, with their parsed tests
+
+    Returns
+    -------
+    list
+        A list of (rule, test) tuples, where test is None for unconditional rules.
+    '''
+    ret = []
+    with sshfdpass.common.trace.phase('rules') as record:
+        for rule in get_my_rules(host, port, _rules):
+            if 'test' in rule:
+                ret.append((rule, tests.parse_test(rule.get('test'), _tests)))
+            else:
+                ret.append((rule, None))
+        record['candidates'] = len(ret)
+    return ret
+
+def _first_unconditional(candidates):
+    '''Index of the first unconditional rule in the candidates'''
+    for i, (rule, test) in enumerate(candidates):
+        if test is None:
+            return i
+    return len(candidates) - 1
+
+def eligible_rules(host, port, deadline=None, candidates=None):
+    '''Evaluate the rules for host and port, and yield the ones which apply, in the order of priority
+
+    If settings.engine.concurrent is true (the default), every distinct test of the candidate
+    rules up to the first unconditional one is started at once in the background (at most
+    settings.engine.maxworkers at a time), and the rules are decided in their order of priority,
+    as soon as their test and every test of the higher priority rules has finished.
+    The still running tests of lower priority rules are abandoned.
+    The tests after the first unconditional rule are only evaluated when they are reached,
+    which happens if the actions of the earlier rules failed.
+
+    Every test is limited by the deadline and its own timeout. A test which runs out of time,
+    or raises an exception, is false.
+
+    candidates can be given, if the caller already has the result of _candidates().
+
+    Yields
+    ------
+    dict, str, args, params
+        The applicable rule, and the action parameters as get_action_params() returns them.
+    '''
+    deadline = deadline or sshfdpass.common.deadline.Deadline()
+    if candidates is None:
+        candidates = _candidates(host, port)
+    engine = _settings.get('engine',{})
+    tasks = dict()
+    reachable = candidates[:_first_unconditional(candidates) + 1]
+    distinct = dict((id(test), test) for rule, test in reachable if test is not None)
+    if len(distinct) > 1 and sshfdpass.common.boolean(engine.get('concurrent', True)):
+        log.debug('evaluating %d tests concurrently', len(distinct))
+        started = sshfdpass.common.parallel.start_all(
+                [ functools.partial(test.evaluate, deadline) for test in distinct.values() ],
+                engine.get('maxworkers', 8))
+        tasks = dict(zip(distinct.keys(), started))
+    for rule, test in candidates:
+        log.debug('Evaluating rule %s', sshfdpass.common.Redacted(rule))
+        action, actionargs, actionparams = rule.params
+        if test is None:
+            yield rule, action, actionargs, actionparams
+            continue
+        try:
+            if id(test) in tasks:
+                # The test should respect its timeout, but we don't wait for it longer in any case
+                if tasks[id(test)].wait(deadline.sub(test.timeout).remaining()):
+                    result = tasks[id(test)].result()
+                else:
+                    log.warning('test of rule %s did not finish in time, considered as false', sshfdpass.common.Redacted(rule))
+                    result = False
+            else:
+                result = test.evaluate(deadline)
+        except Exception as exc:
+            log.error('test of rule %s failed, considered as false: %s: %s', sshfdpass.common.Redacted(rule), type(exc).__name__, exc)
+            result = False
+        if result:
+            yield rule, action, actionargs, actionparams
+
+def select_rule(host, port, deadline=None):
+    '''Return the first rule which applies for host and port
+
+    Returns
+    -------
+    dict, str, args, params
+        The selected rule, and the action parameters as get_action_params() returns them.
+    '''
+    for selected in eligible_rules(host, port, deadline):
+        return selected
+
+def engine_options(host, port):
+    '''The engine settings for host and port
+
+    settings.engine.hosts can override the engine settings for a host:port or host.
+    '''
+    engine = _settings.get('engine',{})
+    options = dict(strategy='sequential', racecount=2, stagger=0.25, speculative=False, adaptive=False)
+    options.update(engine)
+    hosts = engine.get('hosts',{}) or {}
+    options.update(hosts.get('%s:%s'%(host, port), hosts.get(host, {})) or {})
+    return options
+
+def _action_connect(host, port, rule, action, actionargs, actionparams, pool=None, deadline=None):
+    with sshfdpass.common.trace.phase('action', action=action, rule=getattr(rule, 'key', None)):
+        begin = sshfdpass.common.deadline.monotonic()
+        try:
+            if pool is not None and rule.get('prewarm'):
+                key = (action, host, str(port), repr(actionargs), repr(sorted(actionparams.items())))
+                conn = pool.get(key, actionparams.get('host', host),
+                        functools.partial(_actions[action].connect, host, port, actionargs, actionparams),
+                        rule.get('prewarm'), deadline)
+            else:
+                conn = _actions[action].connect(host, port, actionargs, actionparams, deadline)
+        except (sshfdpassException, IOError, OSError) as exc:
+            _record_route(host, port, rule, error=exc)
+            raise
+        _record_route(host, port, rule, latency=sshfdpass.common.deadline.monotonic() - begin)
+    return conn
+
+def _record_route(host, port, rule, latency=None, error=None):
+    '''Queue the outcome of an action for the route statistics, if they are enabled'''
+    if _routestats is not None:
+        _routestats.record(host, port, rule, latency=latency, error=error)
+
+def flush_routes():
+    '''Write the queued outcomes of the actions into the route statistics
+
+    It's called after the connection was passed to ssh, so the stats file is not written before that.
+    '''
+    if _routestats is not None:
+        _routestats.flush()
+
+def routed(host, port, eligible, adaptive=False):
+    '''Reorder the eligible rules based on the statistics of their routes
+
+    Rules whose circuit is open (see sshfdpass.common.routestats) are moved behind every other rule,
+    so they are only tried if everything else failed.
+    With adaptive, consecutive rules marked as interchangeable are sorted by their average latency.
+    '''
+    if _routestats is None:
+        for selected in eligible:
+            yield selected
+        return
+    deferred = []
+    group = []
+    def flush():
+        for selected in _routestats.order(host, port, group) if group else []:
+            if _routestats.is_open(host, port, selected[0]):
+                deferred.append(selected)
+            else:
+                yield selected
+        del group[:]
+    for selected in eligible:
+        rule = selected[0]
+        if adaptive and sshfdpass.common.boolean(rule.get('interchangeable', False)):
+            group.append(selected)
+            continue
+        for item in flush():
+            yield item
+        if _routestats.is_open(host, port, rule):
+            log.info('circuit of rule %s is open, trying it last', sshfdpass.common.Redacted(rule))
+            deferred.append(selected)
+            continue
+        yield selected
+    for item in flush():
+        yield item
+    for selected in deferred:
+        yield selected
+
+def _selected(rule, action):
+    '''Record the rule whose action made the connection in the trace'''
+    sshfdpass.common.trace.annotate(rule=getattr(rule, 'key', None), action=action)
+
+def connect(host, port, pool=None, deadline=None):
+    '''Select the rule for host and port, and run its action
+
+    With the default sequential strategy, if the action fails (or runs out of time),
+    the next applicable rule's action is tried.
+    With the race strategy, the actions of the first engine.racecount applicable rules run at
+    the same time, started engine.stagger seconds apart, and the first working connection wins.
+    With engine.speculative, the action of the unconditional fallback rule is started right away,
+    while the tests are still evaluated. See sshfdpass.common.race for the details.
+    The applicable rules are reordered by routed() based on the statistics of their routes.
+
+    Parameters
+    ----------
+    pool: sshfdpass.common.pool.Pool or None
+        If given, and the selected rule has a prewarm key, the connection is taken from the pool.
+    deadline: sshfdpass.common.deadline.Deadline or None
+        Deadline of the whole invocation
+
+    Returns
+    -------
+        The socket-like object returned by the action. It's not passed to anywhere yet.
+    '''
+    deadline = deadline or sshfdpass.common.deadline.Deadline()
+    options = engine_options(host, port)
+    candidates = _candidates(host, port)
+    adaptive = sshfdpass.common.boolean(options.get('adaptive'))
+    if options.get('strategy') == 'race' or sshfdpass.common.boolean(options.get('speculative')):
+        fallback = None
+        if sshfdpass.common.boolean(options.get('speculative')):
+            rule = candidates[_first_unconditional(candidates)][0]
+            fallback = (rule,) + rule.params
+        connected = dict()
+        def attempt(selected):
+            conn = _action_connect(host, port, *selected, pool=pool, deadline=deadline)
+            connected[id(conn)] = selected
+            return conn
+        from sshfdpass.common import race
+        conn = race.race(
+                routed(host, port, eligible_rules(host, port, deadline, candidates), adaptive),
+                attempt,
+                fallback=fallback,
+                racecount=options.get('racecount') if options.get('strategy') == 'race' else 1,
+                stagger=options.get('stagger'),
+                deadline=deadline)
+        _selected(*connected.get(id(conn), (None, None))[:2])
+        return conn
+    lasterror = None
+    for rule, action, actionargs, actionparams in routed(host, port, eligible_rules(host, port, deadline, candidates), adaptive):
+        try:
+            conn = _action_connect(host, port, rule, action, actionargs, actionparams, pool, deadline)
+            _selected(rule, action)
+            return conn
+        except (sshfdpassException, IOError, OSError) as exc:
+            log.warning('action of rule %s failed (%s: %s), trying the next rule', sshfdpass.common.Redacted(rule), type(exc).__name__, exc)
+            lasterror = exc
+    raise(lasterror or sshfdpassActionError())
+
+def new_deadline(start=None):
+    '''The deadline of an invocation, based on settings.engine.deadline'''
+    return sshfdpass.common.deadline.Deadline(_settings.get('engine',{}).get('deadline'), start)
+
+def _new_trace(start, **info):
+    '''Start the trace of this invocation, including the time spent with importing sshfdpass'''
+    trace = sshfdpass.common.trace.activate(sshfdpass.common.trace.Trace(_imported, **info))
+    trace.add(dict(phase='import', start=0.0, ms=round((start - _imported) * 1000, 3)))
+    return trace
+
+def write_trace(trace):
+    '''Append trace to the trace file, if tracing is enabled, see sshfdpass.common.trace'''
+    path = sshfdpass.common.trace.tracefile(_settings.get('trace'))
+    if path:
+        try:
+            trace.write(path)
+        except (IOError, OSError) as exc:
+            log.warning('could not write the trace: %s', exc)
+
+def explain(host, port, start=None, out=None):
+    '''Evaluate the rules for host and port, and print how the rule was selected
+
+    This is what `sshfdpass --explain host port` does.
+    The tests are evaluated as usual, but the selected action is not run, and no fd is passed anywhere.
+    The candidate rules are listed in the order of precedence with the kind of their key and
+    the result of their test, followed by the time each phase took.
+    '''
+    out = out or sys.stdout
+    start = sshfdpass.common.deadline.monotonic() if start is None else start
+    trace = _new_trace(start, host=host, port=port)
+    with sshfdpass.common.trace.phase('config'):
+        load_config()
+    candidates = _candidates(host, port)
+    selected = None
+    with sshfdpass.common.trace.phase('evaluate'):
+        adaptive = sshfdpass.common.boolean(engine_options(host, port).get('adaptive'))
+        for selected in routed(host, port, eligible_rules(host, port, new_deadline(start), candidates), adaptive):
+            break
+    report = trace.report()
+    out.write('candidate rules for %s:%s, in the order of precedence:\n'%(host, port))
+    for i, (rule, test) in enumerate(candidates):
+        key = getattr(rule, 'key', None)
+        why = 'test %s'%(rule.get('test')) if test is not None else 'unconditional'
+        if selected is not None and rule is selected[0]:
+            verdict = 'applies'
+        elif _routestats is not None and _routestats.is_open(host, port, rule):
+            verdict = 'circuit open, tried last'
+        elif test is None:
+            # Either after the selected rule, or moved behind it by the adaptive ordering
+            verdict = 'not reached'
+        elif test.result is None:
+            verdict = 'not evaluated or timed out'
+        elif test.result:
+            verdict = 'test passed, ordered after the selected rule'
+        else:
+            verdict = 'does not apply'
+        out.write('  %d. %s (%s), %s: %s [%s]\n'%(i + 1, key if key is not None else '*', sshfdpass.common.rules.describe(key), why, verdict,
+            _routestats.describe(host, port, rule) if _routestats is not None else 'no route statistics'))
+    if selected is None:
+        out.write('no rule applies\n')
+    else:
+        rule, action, actionargs, actionparams = selected
+        out.write('selected: rule %d, action: %s %s, params: %s\n'%(
+            [ candidate[0] for candidate in candidates ].index(rule) + 1, action, actionargs, actionparams))
+    out.write('engine: %s\n'%(', '.join('%s=%s'%(name, value) for name, value in sorted(engine_options(host, port).items()) if name != 'hosts')))
+    out.write('timings (ms):\n')
+    for record in report['phases']:
+        details = ', '.join('%s=%s'%(name, value) for name, value in sorted(record.items()) if name not in ('phase', 'start', 'ms'))
+        out.write('  %10.3f %10.3f  %s%s\n'%(record['start'], record['ms'], record['phase'], ' (%s)'%(details) if details else ''))
+    out.write('  total: %.3f ms%s\n'%(report['total'], ', config: %s'%(report['config']) if 'config' in report else ''))
+    out.write('dry run, the action was not started\n')
+    write_trace(trace)
+    return selected is not None
+
+def _batch_pairs(lines):
+    '''Parse the input lines of the batch mode, yields (lineno, host, port, error) tuples'''
+    import sshfdpass.common.net
+    for lineno, line in enumerate(lines, 1):
+        line = line.split('#', 1)[0].strip()
+        if not line:
+            continue
+        fields = line.split()
+        try:
+            if len(fields) == 2:
+                host, port = fields[0], int(fields[1])
+            elif len(fields) == 1:
+                host, port = sshfdpass.common.net.hostport(fields[0], 22)
+            else:
+                raise(ValueError('expected host and port'))
+        except (ValueError, sshfdpassException) as exc:
+            yield lineno, line, None, 'invalid line: %s'%(_batch_error(exc))
+            continue
+        yield lineno, host, port, None
+
+def _batch_route(host, port, distinct):
+    '''The rule for host and port, like connect() would select it. distinct holds the test instances by their key'''
+    candidates = []
+    for rule, test in _candidates(host, port):
+        if test is not None:
+            # Inline tests are parsed again for every host, their first instance with the same settings is reused
+            test = distinct.setdefault(sshfdpass.common.testcache.test_key(test), test)
+        candidates.append((rule, test))
+    adaptive = sshfdpass.common.boolean(engine_options(host, port).get('adaptive'))
+    for selected in routed(host, port, eligible_rules(host, port, new_deadline(), candidates), adaptive):
+        return selected, [ candidate[0] for candidate in candidates ].index(selected[0]) + 1
+    return None, None
+
+def _batch_error(exc):
+    return '%s: %s'%(type(exc).__name__, exc) if str(exc) else type(exc).__name__
+
+def _batch_verify(host, port, selected):
+    '''Run the action of the selected rule, and close its connection'''
+    rule, action, actionargs, actionparams = selected
+    begin = sshfdpass.common.deadline.monotonic()
+    try:
+        conn = _actions[action].connect(host, port, actionargs, actionparams, new_deadline(begin))
+    except Exception as exc:
+        return dict(verified=False, error=_batch_error(exc))
+    ms = round((sshfdpass.common.deadline.monotonic() - begin) * 1000, 3)
+    # Terminates and reaps the child of a command or jump action as well
+    from sshfdpass.common import race
+    race.close(conn)
+    return dict(verified=True, ms=ms)
+
+def batch(lines, out=None, verify=False, jobs=8):
+    '''Write the rule of every host and port in lines as JSON lines, see Batch mode in the module's doc
+
+    This is what `sshfdpass --batch` does.
+
+    Parameters
+    ----------
+    lines: iterable
+        The input lines
+    out: file or None
+        Where to write the results, stdout if None
+    verify: bool
+        Run the selected actions as well, and report if they worked
+    jobs: int
+        Number of actions to run at the same time with verify
+
+    Returns
+    -------
+    bool
+        True if a rule was selected for every host (and every verified connection worked)
+    '''
+    import json
+    import threading
+    import collections
+    out = out or sys.stdout
+    load_config()
+    distinct = dict()
+    jobs = max(int(jobs), 1)
+    semaphore = threading.BoundedSemaphore(jobs)
+    pending = collections.deque()
+    ok = True
+    def emit(record, task):
+        if task is not None:
+            record.update(task.result())
+        out.write(json.dumps(record, default=str) + '\n')
+        out.flush()
+        return record.get('verified', True) and record.get('action') is not None
+    for lineno, host, port, error in _batch_pairs(lines):
+        task = None
+        if error is not None:
+            record = dict(line=lineno, input=host, error=error, action=None)
+        else:
+            record = dict(host=host, port=port)
+            try:
+                selected, index = _batch_route(host, port, distinct)
+            except Exception as exc:
+                # A broken rule or test fails only its own lines, not the whole batch
+                selected, index = None, None
+                record['error'] = _batch_error(exc)
+            if selected is None:
+                record.update(rule=None, action=None)
+            else:
+                rule, action, actionargs, actionparams = selected
+                record.update(rule=getattr(rule, 'key', None), index=index, action=action, actionargs=actionargs, params=actionparams)
+                if verify:
+                    task = sshfdpass.common.parallel.Task(_batch_verify, host, port, selected, _semaphore=semaphore)
+        pending.append((record, task))
+        # The results are written in the order of the input, as soon as the ones before them are ready
+        while pending and (pending[0][1] is None or pending[0][1].done or len(pending) > 2 * jobs):
+            ok = emit(*pending.popleft()) and ok
+    while pending:
+        ok = emit(*pending.popleft()) and ok
+    log.debug('%d distinct tests were used for the batch', len(distinct))
+    return ok
+
+def _batch_main(argv):
+    '''Command line of the batch mode'''
+    import argparse
+    parser = argparse.ArgumentParser(prog='sshfdpass --batch', description='Print the rule of many hosts as JSON lines')
+    parser.add_argument('file', nargs='?', help='host and port pairs, one per line (default: stdin)')
+    parser.add_argument('--verify', action='store_true', help='run the selected actions, and report if they worked')
+    parser.add_argument('-j', '--jobs', type=int, default=8, help='actions to run at the same time with --verify (default: 8)')
+    args = parser.parse_args(argv)
+    if args.file in (None, '-'):
+        return batch(sys.stdin, verify=args.verify, jobs=args.jobs)
+    with open(args.file) as lines:
+        return batch(lines, verify=args.verify, jobs=args.jobs)
+
 def run():
     '''CLI entry point
     
     This is the entry point for the cli. Does all the job:
-    calls load_config()
+    If the sshfdpassd daemon is running, it asks the daemon to do the job, and forwards the received fd to ssh.
+    Otherwise, or if the daemon fails, calls load_config()
     then evaluate the rules based on the list got from get_my_rules().
     If there is a test in the rule it will be evaluated.
     If the test evaluation were true or there were no test, we ran the action based on the params parsed by get_action_params().
     '''
+    start = sshfdpass.common.deadline.monotonic()
+    if sys.argv[1:] == ['compile']:
+        return compile_config()
+    if sys.argv[1:2] == ['--explain']:
+        if len(sys.argv) != 4:
+            sys.stderr.write('usage: sshfdpass --explain host port\n')
+            return False
+        return explain(sys.argv[2], sys.argv[3], start)
+    if sys.argv[1:2] == ['--batch']:
+        return _batch_main(sys.argv[2:])
     host = sys.argv[1]
     port = sys.argv[2]
-    log.message('info', 'sshfdpass is called with host: %s, port: %s'%(host,port))
-    load_config()
-    for rule in get_my_rules(host, port, _rules):
-        log.message('debug','Evaluating rule %s'%(str(rule)))
-        action, actionargs, actionparams = get_action_params(rule)
-        if 'test' in rule:
-            mytest = tests.parse_test(rule.get('test'), _tests)
-            if mytest.evaluate():
-                return _actions[action].execute(host, port, actionargs, actionparams)
-        else:
-            return _actions[action].execute(host, port, actionargs, actionparams)
+    log.info('sshfdpass is called with host: %s, port: %s', host, port)
+    trace = _new_trace(start, host=host, port=port)
+    try:
+        import sshfdpass.daemon as daemon
+        with sshfdpass.common.trace.phase('daemon') as record:
+            try:
+                record['used'] = daemon.client(host, port,
+                        deadline=sshfdpass.common.deadline.Deadline(daemon.CLIENT_TIMEOUT, start))
+            except sshfdpassDaemonError as exc:
+                # The daemon may run with an older config, or it hit a bug: try it ourselves
+                log.warning('daemon failed, connecting in-process: %s', exc)
+                record['used'] = False
+                record['error'] = str(exc)
+        if record['used']:
+            return True
+        with sshfdpass.common.trace.phase('config'):
+            load_config()
+        retsocket = connect(host, port, deadline=new_deadline(start))
+        with sshfdpass.common.trace.phase('sendfd'):
+            sshfdpass.common.fdpass.send_fd(sshfdpass.common.fdpass.stdout_socket(), retsocket.fileno())
+        return True
+    except Exception as exc:
+        trace.set(error='%s: %s'%(type(exc).__name__, exc))
+        raise
+    finally:
+        flush_routes()
+        write_trace(trace)
@@ -0,0 +1,6 @@
+'''Entry point of `python -m sshfdpass host port`, and of the archive built by sshfdpass.bundle'''
+
+import sys
+import sshfdpass
+
+sys.exit(0 if sshfdpass.run() else 1)
@@ -38,11 +38,18 @@ The most important method what a child class must override is the _execute().
 The _execute() should return an object which has a fileno() method.
 Therefore an opened tcp socket, or unix socket, or any kind of socket will do the job.
 The point is, that the parent class should be able to get its' fileno and pass it to the caller ssh process.
+connect() runs the action and returns that object, execute() also passes it to ssh.
+
+Every action has a timeout setting (eg. tcp.timeout: 2 in a rule). The effective timeout,
+limited by the deadline of the whole invocation as well, is passed to _execute() in kwargs['timeout'].
+Actions doing blocking operations should respect it, and raise sshfdpassTimeout (or let socket.timeout through)
+when they run out of time. A timed out action lets the next rule's action try.
 '''
 
 import socket
-import array
 import sshfdpass.common
+import sshfdpass.common.deadline
+import sshfdpass.common.fdpass
 from sshfdpass.common.exceptions import *
 
 log = sshfdpass.common.log
@@ -64,8 +71,15 @@ class AbstractAction():
     def _execute(self, host, port, actionarg=None, kwargs={}):
         return None
 
-    def execute(self, host, port, actionarg=None, kwargs={}):
-        log.message('executing action %s (%s, %s, %s, %s)'%(type(self), host, port, actionarg, kwargs))
+    def _deadline(self, kwargs, deadline=None):
+        timeout = self._get('timeout', kwargs)
+        deadline = deadline or sshfdpass.common.deadline.Deadline()
+        return deadline if timeout is None else deadline.sub(timeout)
+
+    def connect(self, host, port, actionarg=None, kwargs={}, deadline=None):
+        '''Run the action, and return the resulting socket-like object without passing it anywhere'''
+        log.debug('executing action %s (%s, %s, %s, %s)', type(self), host, port,
+                sshfdpass.common.Redacted(actionarg), sshfdpass.common.Redacted(kwargs))
         # We have to calculate the actual kwargs, and overwrite some of them
         # If we have defined keywords and actionarg is a dict, containing any key which is one of our keywords
         callkwargs = dict()
@@ -74,27 +88,25 @@ class AbstractAction():
             for i in actionarg:
                 if i in self._keywords():
                     callkwargs[i] = actionarg[i]
+        callkwargs['timeout'] = self._deadline(callkwargs, deadline).timeout()
         # Now we can call the actual execution safely
-        retsocket = self._execute(
-                self._get('host', kwargs, host),
-                int(self._get('port', kwargs, port)),
-                actionarg,
-                callkwargs
-                )
         try:
-            fileno = retsocket.fileno()
+            retsocket = self._execute(
+                    self._get('host', kwargs, host),
+                    int(self._get('port', kwargs, port)),
+                    actionarg,
+                    callkwargs
+                    )
+        except socket.timeout as exc:
+            raise(sshfdpassTimeout(str(exc)))
+        try:
+            retsocket.fileno()
         except AttributeError as exc:
             raise(sshfdpassActionError)
+        return retsocket
+
+    def execute(self, host, port, actionarg=None, kwargs={}, deadline=None):
+        retsocket = self.connect(host, port, actionarg, kwargs, deadline)
         # If we got to this point, that means, the descendant class did it's job, we can pass back the fd to the caller
-        fds = array.array("i", [fileno])
-        try:
-            scm = socket.SCM_RIGHTS
-        except AttributeError: # python2 compatibility
-            scm = 1
-        ancdata = [(socket.SOL_SOCKET, scm, fds)]
-        try:
-            s = socket.socket( fileno = 1)
-        except TypeError: # py2 compat hack
-            s = socket.fromfd( 1, socket.AF_UNIX, socket.SOCK_STREAM)
-        s.sendmsg([b'\0'], ancdata)
+        sshfdpass.common.fdpass.send_fd(sshfdpass.common.fdpass.stdout_socket(), retsocket.fileno())
         return True
@@ -1,12 +1,33 @@
-import os
+'''
+sshfdpass.actions.command
+-------------------------
+
+Run a command, and pass the other end of a socket pair connected to its stdin and stdout to ssh.
+The command and its arguments is the actionarg list, or the `command` and `args` settings.
+%h and %p in the arguments are replaced with the host and port.
+
+Settings
+--------
+spawn: str
+    How to start the command: posix_spawn, fork, or auto (posix_spawn if available). Default: auto
+setsid: bool
+    Start the command in its own session. Default: false
+setpgroup: bool
+    Start the command in its own process group. Default: false
+'''
+
 import socket
 import sshfdpass.actions
 import sshfdpass.common
+import sshfdpass.common.spawn
 from sshfdpass.common.exceptions import *
 
 log = sshfdpass.common.log
 
 class Action(sshfdpass.actions.AbstractAction):
+    def _defaults(self):
+        return dict(spawn='auto', setsid=False, setpgroup=False)
+
     def _execute(self, host, port, actionarg=None, kwargs={}):
         # If we don't have an actual actionarg, than we have to get my parameters
         # via the "default" method
@@ -33,21 +54,15 @@ class Action(sshfdpass.actions.AbstractAction):
         for arg in myargs:
             arglist.append(sshfdpass.common.argparse(arg,argparserules))
         # Just for debug reasons, log the actual command whaw we would run
-        log.message('command action called: %s(%s)'%(command, arglist))
-        # Since we have to pass back a socket's fd, we have to fork that child and bound it's stdin/out/err to ourself
+        log.debug('command action called: %s(%s)', command, arglist)
+        # Since we have to pass back a socket's fd, we have to spawn that child with it's stdin/out/err bound to the other half of a socket pair
         mysockpair = socket.socketpair()
-        childpid = os.fork()
-        # If I'm the parent, then I have to close the other half of the socket pair, and give back my half to the caller ssh process
-        if childpid:
+        setsid = sshfdpass.common.boolean(self._get('setsid', kwargs))
+        setpgroup = sshfdpass.common.boolean(self._get('setpgroup', kwargs))
+        try:
+            childpid = sshfdpass.common.spawn.spawn(command, arglist, mysockpair[1].fileno(),
+                    setsid=setsid, setpgroup=setpgroup, engine=self._get('spawn', kwargs))
+        finally:
             mysockpair[1].close()
-            return mysockpair[0]
-        # If I'm the child, then I should close the parent's socketpair half, and dup my half to stdin/out/err
-        # Then I can do my exec()
-        else:
-            mysockpair[0].close()
-            mysock = mysockpair[1]
-            os.dup2(mysock.fileno(), 0)
-            os.dup2(mysock.fileno(), 1)
-            os.dup2(mysock.fileno(), 2)
-            os.execvp(command, arglist)
-        return None
+        # Our half goes back to the caller ssh process
+        return sshfdpass.common.spawn.ChildSocket(mysockpair[0], childpid, pgroup=setsid or setpgroup)
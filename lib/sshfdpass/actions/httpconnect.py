@@ -0,0 +1,100 @@
+'''
+sshfdpass.actions.httpconnect
+-----------------------------
+
+Connect through an HTTP proxy with the CONNECT method (RFC 9110 section 9.3.6), without a relay process.
+The proxy is connected and the CONNECT request is done in-process, then the socket itself is passed to ssh,
+so the bytes of the session flow between ssh and the proxy directly, like with a plain tcp connection.
+The destination name is always resolved by the proxy.
+The response of the proxy is read exactly up to its end (see sshfdpass.common.net.recvuntil()),
+so the banner of the ssh server, if it's sent right after it, is left in the socket for ssh.
+The proxy is the actionarg (host:port, or [address]:port for IPv6 addresses), or the proxy setting.
+The proxy itself is connected like the tcp action does, so its settings (aforder, happyeyeballs, ...) apply here as well.
+
+Settings
+--------
+proxy: str
+    The proxy as host:port. Default port: 3128
+username: str
+    If set, the request is sent with basic Proxy-Authorization. Default: unset
+password: str
+    Password for the basic authorization. Default: empty
+headers: dict
+    Additional headers of the request, eg. User-Agent. Default: none
+
+Example:
+    rules:
+        '*.example.com':
+            - action:
+                httpconnect: proxy.example.com:8080
+              httpconnect.username: alice
+              httpconnect.password: secret
+'''
+
+import sshfdpass.common
+import sshfdpass.common.deadline
+import sshfdpass.common.net
+from sshfdpass.common.exceptions import *
+from sshfdpass.actions import tcp
+
+log = sshfdpass.common.log
+
+DEFAULT_PORT = 3128
+
+# A response longer than this is not a response to CONNECT
+MAX_RESPONSE = 65536
+
+class Action(tcp.Action):
+    def _defaults(self):
+        defaults = tcp.Action._defaults(self)
+        defaults.update(proxy=None, username=None, password='', headers=None)
+        return defaults
+
+    def _keywords(self):
+        return [ 'proxy', 'username', 'password', 'headers' ]
+
+    def _request(self, host, port, kwargs):
+        authority = '[%s]:%d'%(host, port) if ':' in host else '%s:%d'%(host, port)
+        lines = [ 'CONNECT %s HTTP/1.1'%(authority), 'Host: %s'%(authority) ]
+        username = self._get('username', kwargs)
+        if username:
+            import base64
+            credentials = '%s:%s'%(username, self._get('password', kwargs) or '')
+            lines.append('Proxy-Authorization: Basic %s'%(base64.b64encode(credentials.encode('utf-8')).decode('ascii')))
+        for name, value in (self._get('headers', kwargs) or {}).items():
+            lines.append('%s: %s'%(name, value))
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('utf-8')
+
+    @staticmethod
+    def _response(s):
+        '''Read the response header, returns the status code and the reason phrase'''
+        header = sshfdpass.common.net.recvuntil(s, b'\r\n\r\n', MAX_RESPONSE)
+        statusline = header.split(b'\r\n', 1)[0].decode('latin-1')
+        fields = statusline.split(' ', 2)
+        if len(fields) < 2 or not fields[0].startswith('HTTP/') or not fields[1].isdigit():
+            raise(sshfdpassActionError('not an HTTP response: %r'%(statusline)))
+        return int(fields[1]), fields[2] if len(fields) > 2 else ''
+
+    def _execute(self, host, port, actionarg=None, kwargs={}):
+        proxy = actionarg if isinstance(actionarg, str) else self._get('proxy', kwargs)
+        if not proxy:
+            raise(sshfdpassActionError('no http proxy given'))
+        proxyhost, proxyport = sshfdpass.common.net.hostport(proxy, DEFAULT_PORT)
+        deadline = sshfdpass.common.deadline.Deadline(kwargs.get('timeout'))
+        s = tcp.Action._execute(self, proxyhost, proxyport, None, kwargs)
+        if s is None:
+            raise(sshfdpassActionError('could not connect to the http proxy %s'%(proxy)))
+        try:
+            s.settimeout(deadline.timeout())
+            s.sendall(self._request(host, port, kwargs))
+            status, reason = self._response(s)
+            # Any 2xx means the tunnel is established, a body must not follow it
+            if status // 100 != 2:
+                log.error('http proxy %s refused to connect to %s:%s: %d %s', proxy, host, port, status, reason)
+                raise(sshfdpassActionError('http proxy: %d %s'%(status, reason)))
+            s.settimeout(None)
+        except Exception:
+            s.close()
+            raise
+        log.debug('connected to %s:%s through the http proxy %s', host, port, proxy)
+        return s
@@ -1,12 +1,130 @@
+'''
+sshfdpass.actions.jump
+----------------------
+
+Connect through one or more jumphosts with `ssh -W`.
+The actionarg is the jumphost, or a list of jumphosts, the last one is connected to directly,
+the others are passed with -J.
+
+Settings
+--------
+controlmaster: bool
+    If true, a ControlMaster connection is kept to the jumphost (chain), and the -W stream is
+    opened over the existing master, so only the first connection pays the key exchange and
+    authentication on the jumphost. The master is created on first use, and checked with
+    `ssh -O check` before every use: if it doesn't answer within a few seconds (eg. its connection
+    to the jumphost hung), it's asked to exit with `ssh -O exit`, its control socket is removed,
+    and a new master is started. Default: false
+controlpersist: str
+    ControlPersist value of the master: how long it stays around after the last connection. Default: 10m
+controlmaxage: int
+    If set, a master older than this many seconds won't get new connections, and a new one is started. Default: unset
+controldir: str
+    Directory of the control sockets. Default: ~/.ssh
+
+Example:
+    settings:
+        actions:
+            jump:
+                controlmaster: yes
+                controlpersist: 30m
+'''
+
+import os
+import time
+import fcntl
+import hashlib
+import subprocess
 import sshfdpass.common
 from sshfdpass.common.exceptions import *
 from sshfdpass.actions import command
 
 log = sshfdpass.common.log
 
+# Seconds to wait for the answer of a control master
+CHECK_TIMEOUT = 3
+
 class Action(command.Action):
+    def _defaults(self):
+        defaults = command.Action._defaults(self)
+        defaults.update(
+                controlmaster=False,
+                controlpersist='10m',
+                controlmaxage=None,
+                controldir=os.path.join(os.environ.get('HOME'), '.ssh'))
+        return defaults
+
+    def _controlpath(self, jumphosts, kwargs):
+        # The path of unix sockets is limited, so the jumphost chain is hashed into the name
+        digest = hashlib.sha1(','.join(jumphosts).encode('utf-8')).hexdigest()[:16]
+        return os.path.join(os.path.expanduser(self._get('controldir', kwargs)), 'fdpass-cm-%s'%(digest))
+
+    @staticmethod
+    def _control(controlpath, command, timeout=CHECK_TIMEOUT):
+        '''Send a control command (ssh -O) to the master, returns the exit status of ssh, or None if it timed out'''
+        try:
+            return subprocess.call(['ssh', '-o', 'ControlPath=%s'%(controlpath), '-O', command, 'fdpass-cm'],
+                    stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            return None
+
+    def _master_alive(self, controlpath, kwargs):
+        try:
+            st = os.stat(controlpath)
+        except (IOError, OSError):
+            return False
+        timeout = kwargs.get('timeout')
+        timeout = CHECK_TIMEOUT if timeout is None else min(CHECK_TIMEOUT, timeout)
+        # Accepting on the socket is not enough: the master must answer, which it can't, if it's stuck
+        status = self._control(controlpath, 'check', timeout)
+        if status != 0:
+            log.info('control master %s does not answer, replacing it', controlpath)
+            if status is None:
+                # The master is still there, it should not linger with its connection after its socket is gone
+                self._control(controlpath, 'exit', timeout)
+            try:
+                os.unlink(controlpath)
+            except (IOError, OSError):
+                pass
+            return False
+        maxage = self._get('controlmaxage', kwargs)
+        if maxage is not None and time.time() - st.st_mtime > float(maxage):
+            log.info('control master %s is too old, stopping it', controlpath)
+            # stop lets the already multiplexed sessions finish, but it won't accept new ones
+            self._control(controlpath, 'stop')
+            if os.path.exists(controlpath):
+                os.unlink(controlpath)
+            return False
+        return True
+
+    def _ensure_master(self, controlpath, jumphosts, kwargs):
+        if self._master_alive(controlpath, kwargs):
+            return
+        # Parallel invocations should not start a master each, so only one of them does it, the others wait for it
+        with open(controlpath + '.lock', 'w') as lockfd:
+            fcntl.flock(lockfd, fcntl.LOCK_EX)
+            if self._master_alive(controlpath, kwargs):
+                return
+            args = [ 'ssh', '-f', '-N',
+                    '-o', 'ControlMaster=yes',
+                    '-o', 'ControlPath=%s'%(controlpath),
+                    '-o', 'ControlPersist=%s'%(self._get('controlpersist', kwargs)) ]
+            if len(jumphosts) > 1:
+                args += [ '-J', ','.join(jumphosts[:-1]) ]
+            args.append(jumphosts[-1])
+            log.info('starting control master: %s', args)
+            # stdout is the channel to ssh, so the master must not inherit it
+            try:
+                ret = subprocess.call(args, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, timeout=kwargs.get('timeout'))
+            except subprocess.TimeoutExpired:
+                log.error('control master could not be started in time')
+                raise(sshfdpassTimeout)
+            if ret != 0:
+                log.error('control master could not be started: %s', ret)
+                raise(sshfdpassActionError)
+
     def _execute(self, host, port, actionarg=None, kwargs={}):
-        log.message('jump called: host: %s, port: %s, actionarg: %s, kwargs: %s'%(host, port, actionarg, kwargs))
+        log.debug('jump called: host: %s, port: %s, actionarg: %s, kwargs: %s', host, port, actionarg, sshfdpass.common.Redacted(kwargs))
         if isinstance(actionarg, str):
             _actionarg = [ actionarg ]
         else:
@@ -15,10 +133,14 @@ class Action(command.Action):
             self._get('host', kwargs, host),
             str(self._get('port', kwargs, port))) ]
         jumphost = _actionarg[-1:][0]
-        if len(_actionarg) > 1:
+        if sshfdpass.common.boolean(self._get('controlmaster', kwargs)):
+            controlpath = self._controlpath(_actionarg, kwargs)
+            self._ensure_master(controlpath, _actionarg, kwargs)
+            args += [ '-o', 'ControlMaster=no', '-o', 'ControlPath=%s'%(controlpath) ]
+        elif len(_actionarg) > 1:
             args.append('-J')
             args.append(','.join(_actionarg[:-1]))
         args.append(jumphost)
-        log.message('calling parent class with args: host: %s, port: %s, actionarg: %s, kwargs: %s'%(host, port, args, kwargs))
+        log.debug('calling parent class with args: host: %s, port: %s, actionarg: %s, kwargs: %s', host, port, args, sshfdpass.common.Redacted(kwargs))
         # TODO: tried to make it py2 compatible. Still not working.
         return super(type(self), self)._execute(host, port, args, kwargs)
@@ -0,0 +1,166 @@
+'''
+sshfdpass.actions.socks5
+------------------------
+
+Connect through a SOCKS5 proxy (RFC 1928), without a relay process.
+The proxy is connected and the CONNECT handshake is done in-process, then the socket itself is passed to ssh,
+so the bytes of the session flow between ssh and the proxy directly, like with a plain tcp connection,
+unlike with a command action running nc -X 5 or connect-proxy.
+The proxy is the actionarg (host:port, or [address]:port for IPv6 addresses), or the proxy setting.
+The proxy itself is connected like the tcp action does, so its settings (aforder, happyeyeballs, ...) apply here as well.
+
+Settings
+--------
+proxy: str
+    The proxy as host:port. Default port: 1080
+username: str
+    If set, username/password authentication (RFC 1929) is used. Default: unset
+password: str
+    Password for the username/password authentication. Default: empty
+remotedns: bool
+    If true, the destination name is sent to the proxy to resolve it, otherwise it's resolved locally,
+    and the proxy gets its address. Default: true
+pipeline: bool
+    If true, the greeting, the authentication and the CONNECT request are sent at once, offering only one
+    authentication method (username/password if there is a username, none otherwise), so the handshake takes one
+    round trip instead of two or three. Not every proxy copes with that, so it has to be turned on. Default: false
+
+Example:
+    rules:
+        internal.example.com:
+            - action:
+                socks5: proxy.example.com:1080
+              socks5.username: alice
+              socks5.password: secret
+'''
+
+import socket
+import struct
+import sshfdpass.common
+import sshfdpass.common.deadline
+import sshfdpass.common.net
+from sshfdpass.common.exceptions import *
+from sshfdpass.actions import tcp
+
+log = sshfdpass.common.log
+
+DEFAULT_PORT = 1080
+
+# Reply codes of RFC 1928 section 6
+REPLIES = {
+        1: 'general SOCKS server failure',
+        2: 'connection not allowed by ruleset',
+        3: 'network unreachable',
+        4: 'host unreachable',
+        5: 'connection refused',
+        6: 'TTL expired',
+        7: 'command not supported',
+        8: 'address type not supported',
+        }
+
+METHOD_NONE = 0
+METHOD_USERPASS = 2
+METHOD_UNACCEPTABLE = 0xff
+
+class Action(tcp.Action):
+    def _defaults(self):
+        defaults = tcp.Action._defaults(self)
+        defaults.update(proxy=None, username=None, password='', remotedns=True, pipeline=False)
+        return defaults
+
+    def _keywords(self):
+        return [ 'proxy', 'username', 'password', 'remotedns', 'pipeline' ]
+
+    @staticmethod
+    def _address(host, port):
+        '''ATYP, DST.ADDR and DST.PORT of a request'''
+        for family, atyp in ((socket.AF_INET, 1), (socket.AF_INET6, 4)):
+            try:
+                return struct.pack('!B', atyp) + socket.inet_pton(family, host) + struct.pack('!H', port)
+            except (socket.error, ValueError):
+                pass
+        try:
+            name = host.encode('ascii')
+        except UnicodeError:
+            name = host.encode('idna')
+        if len(name) > 255:
+            raise(sshfdpassActionError('hostname too long for socks5: %s'%(host)))
+        return struct.pack('!BB', 3, len(name)) + name + struct.pack('!H', port)
+
+    @staticmethod
+    def _userpass(username, password):
+        username = str(username).encode('utf-8')
+        password = str(password or '').encode('utf-8')
+        return struct.pack('!BB', 1, len(username)) + username + struct.pack('!B', len(password)) + password
+
+    @staticmethod
+    def _method(s, offered):
+        version, method = struct.unpack('!BB', sshfdpass.common.net.recvexact(s, 2))
+        if version != 5:
+            raise(sshfdpassActionError('not a socks5 proxy'))
+        if method == METHOD_UNACCEPTABLE or method not in offered:
+            raise(sshfdpassActionError('socks5 proxy accepts none of the authentication methods %s'%(offered)))
+        return method
+
+    @staticmethod
+    def _authenticated(s):
+        version, status = struct.unpack('!BB', sshfdpass.common.net.recvexact(s, 2))
+        if status != 0:
+            raise(sshfdpassActionError('socks5 authentication failed'))
+
+    @staticmethod
+    def _connected(s):
+        version, reply, reserved, atyp = struct.unpack('!BBBB', sshfdpass.common.net.recvexact(s, 4))
+        if reply != 0:
+            raise(sshfdpassActionError('socks5 proxy: %s'%(REPLIES.get(reply, 'error %d'%(reply)))))
+        # The bound address is not needed, but it must be read, it's followed by the data of the destination
+        if atyp == 1:
+            sshfdpass.common.net.recvexact(s, 4 + 2)
+        elif atyp == 4:
+            sshfdpass.common.net.recvexact(s, 16 + 2)
+        elif atyp == 3:
+            sshfdpass.common.net.recvexact(s, struct.unpack('!B', sshfdpass.common.net.recvexact(s, 1))[0] + 2)
+        else:
+            raise(sshfdpassActionError('socks5 proxy replied an unknown address type: %d'%(atyp)))
+
+    def _handshake(self, s, host, port, kwargs):
+        username = self._get('username', kwargs)
+        if not sshfdpass.common.boolean(self._get('remotedns', kwargs)):
+            addrinfos = sshfdpass.common.net.resolve(host, port, sshfdpass.common.net.aflist(self._get('aforder', kwargs)))
+            if not addrinfos:
+                raise(sshfdpassActionError('could not resolve %s'%(host)))
+            host = addrinfos[0][4][0]
+        request = struct.pack('!BBB', 5, 1, 0) + self._address(host, port)
+        if sshfdpass.common.boolean(self._get('pipeline', kwargs)):
+            offered = [ METHOD_USERPASS if username else METHOD_NONE ]
+            auth = self._userpass(username, self._get('password', kwargs)) if username else b''
+            s.sendall(struct.pack('!BB', 5, 1) + struct.pack('!B', offered[0]) + auth + request)
+            if self._method(s, offered) == METHOD_USERPASS:
+                self._authenticated(s)
+        else:
+            offered = [ METHOD_NONE, METHOD_USERPASS ] if username else [ METHOD_NONE ]
+            s.sendall(struct.pack('!BB', 5, len(offered)) + bytes(bytearray(offered)))
+            if self._method(s, offered) == METHOD_USERPASS:
+                s.sendall(self._userpass(username, self._get('password', kwargs)))
+                self._authenticated(s)
+            s.sendall(request)
+        self._connected(s)
+
+    def _execute(self, host, port, actionarg=None, kwargs={}):
+        proxy = actionarg if isinstance(actionarg, str) else self._get('proxy', kwargs)
+        if not proxy:
+            raise(sshfdpassActionError('no socks5 proxy given'))
+        proxyhost, proxyport = sshfdpass.common.net.hostport(proxy, DEFAULT_PORT)
+        deadline = sshfdpass.common.deadline.Deadline(kwargs.get('timeout'))
+        s = tcp.Action._execute(self, proxyhost, proxyport, None, kwargs)
+        if s is None:
+            raise(sshfdpassActionError('could not connect to the socks5 proxy %s'%(proxy)))
+        try:
+            s.settimeout(deadline.timeout())
+            self._handshake(s, host, port, kwargs)
+            s.settimeout(None)
+        except Exception:
+            s.close()
+            raise
+        log.debug('connected to %s:%s through the socks5 proxy %s', host, port, proxy)
+        return s
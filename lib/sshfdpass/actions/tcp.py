@@ -1,23 +1,85 @@
+'''
+sshfdpass.actions.tcp
+---------------------
+
+Connect to the given host and port via tcp.
+This is the default action, if no rule were matched.
+
+Settings
+--------
+aforder: str
+    Comma separated list of address families to try, in the order of preference. Default: 6,4
+happyeyeballs: bool
+    If true, the addresses of all the families in aforder are resolved,
+    and the connection attempts are raced against each other as described in RFC 8305.
+    The first connection to complete will be passed to ssh. Default: false
+attemptdelay: float
+    Seconds to wait before starting the next connection attempt in happyeyeballs mode. Default: 0.25
+timeout: float
+    Connect timeout in seconds for all the attempts together. Default: unset, only limited by the deadline of the invocation.
+    Without happyeyeballs the addresses are tried one by one, and each attempt gets an equal share
+    of the time left. An attempt which times out doesn't stop the next one.
+
+The destination is resolved with an explicit getaddrinfo() through the persistent cache
+of sshfdpass.common.resolver, then its addresses are tried in order.
+If a test (eg. tcpreach) already connected to the destination during the rule evaluation, that connection
+is used, without connecting again, see sshfdpass.common.net.take().
+
+Example:
+    settings:
+        actions:
+            tcp:
+                happyeyeballs: yes
+                attemptdelay: 0.1
+'''
+
 import socket
 import sshfdpass.actions
+import sshfdpass.common
+import sshfdpass.common.deadline
+import sshfdpass.common.net
+import sshfdpass.common.resolver
 from sshfdpass.common.exceptions import *
 
 class Action(sshfdpass.actions.AbstractAction):
     def _defaults(self):
-        return dict(aforder='6,4')
+        return dict(aforder='6,4', happyeyeballs=False, attemptdelay=0.25)
 
     def _execute(self, host, port, actionargs=None, kwargs={}):
-        aflist = self.settings.get('aforder').split(',')
+        aflist = sshfdpass.common.net.aflist(self._get('aforder', kwargs))
+        stashed = sshfdpass.common.net.take(host, port, aflist)
+        if stashed is not None:
+            return stashed
+        if sshfdpass.common.boolean(self._get('happyeyeballs', kwargs)):
+            return sshfdpass.common.net.race(
+                    sshfdpass.common.net.resolve(host, port, aflist),
+                    delay=float(self._get('attemptdelay', kwargs)),
+                    timeout=kwargs.get('timeout'))
+        addrinfos = []
         for af in aflist:
-            if af == '4':
-                s = socket.socket(socket.AF_INET, socket.SOCK_STREAM, 0)
-            elif af == '6':
-                s = socket.socket(socket.AF_INET6, socket.SOCK_STREAM, 0)
-            else:
-                raise(sshfdpassAFUnkown)
             try:
-                s.connect((host, port))
+                addrinfos += sshfdpass.common.resolver.getaddrinfo(host, port, af, socket.SOCK_STREAM)
             except socket.gaierror as exc:
                 continue
+        # Every address gets its share of the remaining time, so an unanswered one doesn't use up the
+        # whole budget, and the next address (or family) is still tried
+        deadline = sshfdpass.common.deadline.Deadline(kwargs.get('timeout'))
+        lasterror = None
+        for i, (family, socktype, proto, canonname, sockaddr) in enumerate(addrinfos):
+            remaining = deadline.remaining()
+            if remaining is not None and remaining <= 0:
+                break
+            s = socket.socket(family, socktype, proto)
+            try:
+                s.settimeout(None if remaining is None else remaining / (len(addrinfos) - i))
+                s.connect(sockaddr)
+                s.settimeout(None)
+            except socket.error as exc:
+                # socket.timeout included
+                s.close()
+                lasterror = exc
+                continue
             return s
+        if lasterror is not None:
+            raise(lasterror)
         return None
@@ -0,0 +1,104 @@
+'''
+sshfdpass.bundle
+----------------
+
+Single file build of sshfdpass, optimized for the startup time.
+
+    python -m sshfdpass.bundle [-o sshfdpass.pyz] [--python '/usr/bin/env python3']
+
+builds an executable zipapp (see the zipapp module of the standard library) of the package:
+* every module is stored with its precompiled bytecode. The .pyc files are unchecked hash based ones,
+  so they are used as they are, without comparing them with the sources, and nothing is compiled at runtime.
+  The sources are stored as well, for the tracebacks.
+* the builtin plugins are listed in sshfdpass._bundled, so the registry doesn't need pkgutil to find them
+* the archive is stored uncompressed, so the modules are read without zlib
+* its __main__ runs the sshfdpass entry point, so the archive can be used directly in the ssh config:
+      ProxyCommand ~/bin/sshfdpass.pyz %h %p
+      ProxyUseFDPass yes
+The bytecode belongs to the python version which built the archive. Another version still runs it, but it
+compiles the sources on every invocation (they can't be cached in the archive), so build it with the python
+which will run it.
+The daemon is in the archive as well: PYTHONPATH=~/bin/sshfdpass.pyz python3 -m sshfdpass.daemon
+'''
+
+import os
+import sys
+import shutil
+import tempfile
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_INTERPRETER = '/usr/bin/env python3'
+
+MAIN = '''import sshfdpass.__main__
+'''
+
+
+def _plugins():
+    '''The builtin plugins of the package, in the format of sshfdpass._bundled.MODULES'''
+    import sshfdpass.actions
+    import sshfdpass.tests
+    import sshfdpass.common.registry
+    return dict((package.__name__, sorted(sshfdpass.common.registry._modules(package)))
+            for package in (sshfdpass.actions, sshfdpass.tests))
+
+
+def _compile(path, displayname):
+    '''Compile path into the legacy location (next to the source), where zipimport looks for it'''
+    import py_compile
+    kwargs = dict()
+    if hasattr(py_compile, 'PycInvalidationMode'):
+        kwargs['invalidation_mode'] = py_compile.PycInvalidationMode.UNCHECKED_HASH
+    py_compile.compile(path, cfile=path + 'c', dfile=displayname, doraise=True, **kwargs)
+
+
+def build(output, interpreter=DEFAULT_INTERPRETER):
+    '''
+    Build the archive
+
+    Parameters
+    ----------
+    output: str
+        path of the archive to write
+    interpreter: str
+        the interpreter of the archive's #! line, None leaves it out
+
+    Returns
+    -------
+    int
+        The number of modules in the archive
+    '''
+    import zipapp
+    staging = tempfile.mkdtemp(prefix='sshfdpass-bundle-')
+    try:
+        target = os.path.join(staging, 'sshfdpass')
+        shutil.copytree(PACKAGE_DIR, target, ignore=shutil.ignore_patterns('__pycache__', '*.pyc', '*.pyo'))
+        with open(os.path.join(target, '_bundled.py'), 'w') as bundledfd:
+            bundledfd.write("'''Generated by sshfdpass.bundle: the builtin plugins in the archive'''\n\nMODULES = %r\n"%(_plugins()))
+        with open(os.path.join(staging, '__main__.py'), 'w') as mainfd:
+            mainfd.write(MAIN)
+        modules = 0
+        for dirpath, dirnames, filenames in os.walk(staging):
+            for filename in filenames:
+                if filename.endswith('.py'):
+                    path = os.path.join(dirpath, filename)
+                    _compile(path, os.path.join(os.path.basename(output), os.path.relpath(path, staging)))
+                    modules += 1
+        zipapp.create_archive(staging, output, interpreter=interpreter)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    return modules
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(prog='python -m sshfdpass.bundle', description='Build a single file zipapp of sshfdpass')
+    parser.add_argument('-o', '--output', default='sshfdpass.pyz', help='path of the archive (default: sshfdpass.pyz)')
+    parser.add_argument('--python', default=DEFAULT_INTERPRETER, help='interpreter of the #! line (default: %s)'%(DEFAULT_INTERPRETER))
+    args = parser.parse_args(argv)
+    modules = build(args.output, args.python or None)
+    sys.stdout.write('%s: %d modules, compiled for python %d.%d\n'%(args.output, modules, sys.version_info[0], sys.version_info[1]))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
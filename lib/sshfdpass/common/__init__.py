@@ -3,8 +3,6 @@
 from sshfdpass.common.exceptions import *
 from . import logging
 
-log = logging.Logger()
-
 def argparse(arg, rules):
     ret = ''
     status = 0
@@ -20,3 +18,46 @@ def argparse(arg, rules):
                 ret += rules.get(i,i)
         return ret
     raise(sshfdpassException)
+
+def boolean(value):
+    '''Interpret a setting as a boolean value
+
+    Config values might come from yaml, json or from a rule, so
+    besides real booleans the usual yes/no, true/false, on/off, 1/0 strings are accepted.
+    '''
+    if isinstance(value, str):
+        return value.strip().lower() in ('yes', 'true', 'on', '1')
+    return bool(value)
+
+def digest(data):
+    '''A short digest (16 hex digits) of the bytes data, to notice changes and to name files
+
+    It's made of the crc32 and adler32 checksums of zlib: importing hashlib would cost more than
+    the lookups of an invocation these digests serve. Not for anything where collisions are a concern.
+    '''
+    import zlib
+    return '%08x%08x'%(zlib.crc32(data) & 0xffffffff, zlib.adler32(data) & 0xffffffff)
+
+# Setting names (the part after the last dot, so socks5.password as well) never written to the log
+SECRET_KEYS = ('password', 'passphrase', 'secret', 'token', 'proxy-authorization', 'authorization')
+
+def redact(value):
+    '''A copy of value for the log, with the values of the SECRET_KEYS replaced, in nested dicts and lists too'''
+    if isinstance(value, dict):
+        return dict((key, '***' if str(key).rsplit('.', 1)[-1].lower() in SECRET_KEYS else redact(item))
+                for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return [ redact(item) for item in value ]
+    return value
+
+class Redacted():
+    '''Log argument standing for value, redacted only when the record is actually written'''
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return str(redact(self.value))
+
+    __repr__ = __str__
+
+log = logging.Logger()
@@ -1,5 +1,23 @@
+'''
+sshfdpass.common.config
+-----------------------
+
+Reading the configuration file.
+
+Parsing a big yaml config on every ssh invocation is expensive, so `sshfdpass compile` builds an
+indexed rule store (fdpass.conf.rules) next to the config, see sshfdpass.common.rulestore.
+While it's up to date, only its settings, tests and pattern rules are loaded, and the rules of the
+actual host are read from it on demand.
+If the source changes, the next invocation parses the config again and refreshes the
+already existing store, so once compiled, the store always follows the config.
+Removing the store file turns the feature off.
+
+A config starting with { is parsed as json first, so a json config never imports PyYAML.
+'''
+
 import os
 import sshfdpass.common
+import sshfdpass.common.trace
 log = sshfdpass.common.log
 
 try:
@@ -7,28 +25,109 @@ try:
 except NameError:
     No_Module = ImportError
 
-def read_config(conffile=os.path.join(os.environ.get('HOME'), '.ssh/fdpass.conf'), settings={}, rules={}):
+
+DEFAULT_CONFFILE = os.path.join(os.environ.get('HOME'), '.ssh/fdpass.conf')
+
+
+def store_path(conffile):
+    '''Location of the rule store belonging to conffile, see sshfdpass.common.rulestore'''
+    return conffile + '.rules'
+
+
+def parse_config(data):
+    '''Parse the raw content of the config file
+
+    A config which looks like a json object is parsed as json, without importing yaml.
+    Otherwise, if yaml python module is provided on the system, it will try to parse the config as yaml.
+    If there is no yaml, it will be interpreted as json.
+    '''
+    if isinstance(data, bytes):
+        data = data.decode('utf-8')
+    if data.lstrip().startswith('{'):
+        import json
+        try:
+            return _as_dict(json.loads(data))
+        except ValueError:
+            # Not json, but it can still be a yaml flow mapping
+            pass
     try:
         import yaml
-        confloader = yaml.safe_load
+        config = yaml.safe_load(data)
     except No_Module:
         import json
-        confloader = json.load
-    try:
-        with open(conffile, 'r') as conffd:
-            config = confloader(conffd)
-    except FileNotFoundError:
+        config = json.loads(data) if data.strip() else None
+    return _as_dict(config)
+
+
+def _as_dict(config):
+    if not isinstance(config, dict):
         config = dict()
+    return config
+
+
+def normalize(config):
+    '''Make sure that the settings and the rules of config are dicts, returns config'''
     if isinstance(config.get('settings'),dict):
-        log.message('debug','Settings loaded')
-        settings.update(config.get('settings'))
+        log.debug('Settings loaded')
     else:
-        log.message('warning','settings is not dict, so I replace it with an empty dict')
+        log.warning('settings is not dict, so I replace it with an empty dict')
         config['settings'] = dict()
     if isinstance(config.get('rules'),dict):
-        log.message('debug', 'rules loaded')
-        rules.update(config.get('rules'))
+        log.debug('rules loaded')
     else:
-        log.message('warning', 'rules is not a dict or empty, so I fill it up with an empty dict')
+        log.warning('rules is not a dict or empty, so I fill it up with an empty dict')
         config['rules'] = dict()
     return config
+
+
+def load_config_file(conffile=DEFAULT_CONFFILE, force=False):
+    '''Return the parsed config, preferring a fresh rule store
+
+    Parameters
+    ----------
+    conffile: str
+        path of the config file
+    force: bool
+        Parse the source, and write a rule store even if there were none before.
+
+    Returns
+    -------
+    dict
+        The raw config. If it was loaded from the rule store, the rules only contain
+        the pattern keys, and the store itself is under the rulestore key.
+    '''
+    try:
+        stat = os.stat(conffile)
+    except (IOError, OSError):
+        return normalize(dict())
+    if not force and os.path.exists(store_path(conffile)):
+        from sshfdpass.common import rulestore
+        store = rulestore.open_store(conffile, stat)
+        if store is not None:
+            log.debug('using rule store %s', store.path)
+            sshfdpass.common.trace.annotate(config='rulestore')
+            config = dict(store.meta.get('config'))
+            config['rulestore'] = store
+            return config
+    with open(conffile, 'rb') as conffd:
+        data = conffd.read()
+    config = normalize(parse_config(data))
+    sshfdpass.common.trace.annotate(config='parsed')
+    if force or os.path.exists(store_path(conffile)):
+        from sshfdpass.common import rulestore
+        try:
+            rulestore.build(conffile, config, stat)
+        except (IOError, OSError, TypeError, ValueError) as exc:
+            # TypeError and ValueError: the config has values which can't be stored as JSON
+            log.warning('could not write the rule store: %s', exc)
+    return config
+
+
+def read_config(conffile=DEFAULT_CONFFILE, settings={}, rules={}):
+    config = load_config_file(conffile)
+    # A parsed config is normalized already, a rule store might be older than that
+    if 'rulestore' in config:
+        normalize(config)
+    settings.update(config['settings'])
+    rules.update(config['rules'])
+    return config
@@ -0,0 +1,70 @@
+'''
+sshfdpass.common.deadline
+-------------------------
+
+Time budgets.
+
+A Deadline is a point in time, by which something has to be finished.
+The whole invocation has one (settings.engine.deadline), and every test and action
+gets a sub-deadline of it, limited by its own timeout setting.
+'''
+
+import time
+from sshfdpass.common.exceptions import *
+
+try:
+    monotonic = time.monotonic
+except AttributeError: # python2 compatibility
+    monotonic = time.time
+
+
+class Deadline():
+    '''
+    A point in time by which the work has to be done
+
+    Parameters
+    ----------
+    seconds: float or None
+        Time budget from start. None means no deadline.
+    start: float or None
+        The monotonic start time, now by default.
+
+    Methods
+    -------
+    remaining(self):
+        Seconds left, None if there is no deadline.
+    expired(self):
+        True if there is no time left.
+    timeout(self):
+        Seconds left, to be used as a timeout. Raises sshfdpassTimeout if there is no time left.
+    sub(self, seconds):
+        A new Deadline, which ends seconds from now, but not later than this one.
+    '''
+    def __init__(self, seconds=None, start=None):
+        if seconds is None:
+            self.end = None
+        else:
+            self.end = (monotonic() if start is None else start) + float(seconds)
+
+    def remaining(self):
+        if self.end is None:
+            return None
+        return max(self.end - monotonic(), 0)
+
+    def expired(self):
+        return self.end is not None and monotonic() >= self.end
+
+    def timeout(self):
+        remaining = self.remaining()
+        if remaining is not None and remaining <= 0:
+            raise(sshfdpassTimeout)
+        return remaining
+
+    def sub(self, seconds):
+        ret = Deadline(seconds)
+        if self.end is not None and (ret.end is None or self.end < ret.end):
+            ret.end = self.end
+        return ret
+
+    def __repr__(self):
+        return 'Deadline(remaining=%s)'%(self.remaining())
@@ -32,3 +32,9 @@ class sshfdpassAFUnkown(sshfdpassException):
 
 class sshfdpassActionError(sshfdpassException):
     '''An action on execution must return a true value, otherwise it's considered as an error'''
+
+class sshfdpassDaemonError(sshfdpassException):
+    '''The sshfdpassd daemon was reachable, but it could not provide a connection'''
+
+class sshfdpassTimeout(sshfdpassException):
+    '''A test or an action ran out of its time budget'''
@@ -0,0 +1,49 @@
+'''
+sshfdpass.common.fdpass
+-----------------------
+
+Helpers to pass file descriptors over unix sockets with SCM_RIGHTS.
+This is how the connected socket gets to ssh (ProxyUseFDPass), and how the
+daemon hands the socket over to the client.
+'''
+
+import array
+import socket
+
+try:
+    SCM_RIGHTS = socket.SCM_RIGHTS
+except AttributeError: # python2 compatibility
+    SCM_RIGHTS = 1
+
+
+def send_fd(sock, fd, data=b'\0'):
+    '''Send fd over the unix socket sock, along with data'''
+    fds = array.array("i", [fd])
+    ancdata = [(socket.SOL_SOCKET, SCM_RIGHTS, fds)]
+    return sock.sendmsg([data], ancdata)
+
+
+def recv_fd(sock, bufsize=4096):
+    '''Receive a message and at most one fd from the unix socket sock
+
+    Returns
+    -------
+    bytes, int or None
+        The received data, and the received fd, or None if no fd arrived
+    '''
+    fds = array.array("i")
+    msg, ancdata, flags, addr = sock.recvmsg(bufsize, socket.CMSG_LEN(fds.itemsize))
+    for level, kind, data in ancdata:
+        if level == socket.SOL_SOCKET and kind == SCM_RIGHTS:
+            fds.frombytes(data[:len(data) - (len(data) % fds.itemsize)])
+    if len(fds) > 0:
+        return msg, fds[0]
+    return msg, None
+
+
+def stdout_socket():
+    '''The socket ssh gave us as stdout, where the fd should be passed to'''
+    try:
+        return socket.socket( fileno = 1)
+    except TypeError: # py2 compat hack
+        return socket.fromfd( 1, socket.AF_UNIX, socket.SOCK_STREAM)
@@ -0,0 +1,112 @@
+'''
+sshfdpass.common.iprange
+------------------------
+
+IP address and cidr network helpers.
+
+A PrefixSet compiles a list of networks once into sorted, merged integer intervals per
+address family, so checking an address against thousands of networks is a binary search,
+instead of parsing and comparing every network on every check.
+'''
+
+import socket
+import bisect
+import sshfdpass.common
+
+log = sshfdpass.common.log
+
+WIDTH = {
+        socket.AF_INET: 32,
+        socket.AF_INET6: 128,
+        }
+
+
+def parse_ip(address):
+    '''Convert an ip address to (family, int), or None if it's not an ip address'''
+    for family in (socket.AF_INET, socket.AF_INET6):
+        try:
+            packed = socket.inet_pton(family, address)
+        except (socket.error, ValueError, OSError):
+            continue
+        return family, int.from_bytes(packed, 'big')
+    return None
+
+
+def parse_network(network):
+    '''Convert a cidr network to (family, prefixlen, int of the network), or None'''
+    if network.count('/') != 1:
+        return None
+    address, bits = network.split('/')
+    parsed = parse_ip(address)
+    if parsed is None or not bits.isdigit():
+        return None
+    family, addr = parsed
+    width = WIDTH[family]
+    bits = int(bits)
+    if bits > width:
+        return None
+    mask = ((1 << bits) - 1) << (width - bits)
+    return family, bits, addr & mask
+
+
+class PrefixSet():
+    '''
+    A set of networks, compiled for fast lookups
+
+    Parameters
+    ----------
+    networks: list
+        Networks in cidr notation. A plain address means a single host network.
+        Invalid entries are logged and skipped.
+
+    Methods
+    -------
+    __contains__(self, address):
+        True if the address (a string, or a (family, int) tuple) is in any of the networks.
+    match_any(self, addresses):
+        True if any of the addresses is in any of the networks.
+    '''
+    def __init__(self, networks):
+        intervals = dict()
+        for network in networks:
+            network = str(network)
+            if '/' not in network:
+                parsed = parse_ip(network)
+                parsed = parsed and (parsed[0], WIDTH[parsed[0]], parsed[1])
+            else:
+                parsed = parse_network(network)
+            if not parsed:
+                log.warning('invalid network: %s', network)
+                continue
+            family, bits, addr = parsed
+            intervals.setdefault(family, []).append((addr, addr | ((1 << (WIDTH[family] - bits)) - 1)))
+        self.starts = dict()
+        self.ends = dict()
+        for family, ranges in intervals.items():
+            ranges.sort()
+            merged = [ list(ranges[0]) ]
+            for start, end in ranges[1:]:
+                if start <= merged[-1][1] + 1:
+                    merged[-1][1] = max(merged[-1][1], end)
+                else:
+                    merged.append([start, end])
+            self.starts[family] = [ start for start, end in merged ]
+            self.ends[family] = [ end for start, end in merged ]
+
+    def __contains__(self, address):
+        if not isinstance(address, tuple):
+            address = parse_ip(str(address))
+            if address is None:
+                return False
+        family, addr = address
+        starts = self.starts.get(family)
+        if not starts:
+            return False
+        i = bisect.bisect_right(starts, addr) - 1
+        return i >= 0 and addr <= self.ends[family][i]
+
+    def match_any(self, addresses):
+        for address in addresses:
+            if address in self:
+                return True
+        return False
@@ -0,0 +1,138 @@
+'''
+sshfdpass.common.jsonfile
+-------------------------
+
+A JSON document in a file, shared by concurrent invocations and the daemon.
+
+The persistent caches (sshfdpass.common.resolver, sshfdpass.common.testcache, sshfdpass.common.routestats)
+keep their content in such a file:
+* load() reads the file with a single open(), fstat() and read(), and only if it changed since the last
+  time (its mtime, size and inode), otherwise it returns the document already in memory
+* update() is a read-modify-write under an exclusive flock() of a lock file next to it,
+  so concurrent invocations don't lose each other's changes
+* the file is replaced atomically with a rename, so load() needs no lock
+
+The document is a dict, stored with a version number. A file with another version (or an unreadable one)
+is treated as an empty document.
+A document can belong to a state, eg. the network (see sshfdpass.common.netinfo.fingerprint()):
+then it's emptied as soon as the state changes.
+'''
+
+import os
+import json
+import threading
+import sshfdpass.common
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+log = sshfdpass.common.log
+
+
+class JSONFile():
+    '''
+    JSONFile
+
+    Parameters
+    ----------
+    path: str
+        Path of the file, None for a document kept only in memory
+    version: int
+        Version of the document's layout
+    name: str
+        What the file is, for the log messages
+    keyed: callable or None
+        Returns the state the document belongs to. The document is emptied when it changes.
+
+    Methods
+    -------
+    load(self):
+        The document, reloaded if the file changed.
+    update(self, func):
+        Call func with the current document under the lock of the file, then write the document.
+        Returns what func returned.
+    '''
+    def __init__(self, path, version, name='cache', keyed=None):
+        self.path = path
+        self.version = version
+        self.name = name
+        self.keyed = keyed
+        self.data = dict()
+        self._stamp = None
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _stat(stat):
+        return (stat.st_mtime, stat.st_size, stat.st_ino)
+
+    def load(self):
+        with self._lock:
+            if self.path is not None:
+                self._read()
+            if self.keyed is not None:
+                state = self.keyed()
+                if self.data.get('state') != state:
+                    if len(self.data) > 1:
+                        log.info('%s belongs to another state, dropping it', self.name)
+                    self.data.clear()
+                    self.data['state'] = state
+            return self.data
+
+    def _read(self):
+        try:
+            fd = os.open(self.path, os.O_RDONLY)
+        except OSError:
+            if self._stamp is not None:
+                self._stamp = None
+                self.data = dict()
+            return
+        try:
+            stat = os.fstat(fd)
+            if self._stat(stat) != self._stamp:
+                self._stamp = self._stat(stat)
+                data = json.loads(os.read(fd, stat.st_size).decode('utf-8'))
+                self.data = data.get('data', {}) if data.get('version') == self.version else dict()
+        except (IOError, OSError, ValueError, AttributeError) as exc:
+            log.warning('%s %s is unreadable: %s', self.name, self.path, exc)
+            self.data = dict()
+        finally:
+            os.close(fd)
+
+    def _save(self):
+        tmpfile = '%s.%d.tmp'%(self.path, os.getpid())
+        try:
+            data = json.dumps(dict(version=self.version, data=self.data), separators=(',', ':'), default=str)
+            fd = os.open(tmpfile, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            try:
+                os.write(fd, data.encode('utf-8'))
+            finally:
+                os.close(fd)
+            os.rename(tmpfile, self.path)
+            self._stamp = self._stat(os.stat(self.path))
+        except (IOError, OSError) as exc:
+            log.warning('could not write the %s: %s', self.name, exc)
+            try:
+                os.unlink(tmpfile)
+            except OSError:
+                pass
+
+    def update(self, func):
+        with self._lock:
+            if self.path is None:
+                return func(self.load())
+            try:
+                lockfd = os.open(self.path + '.lock', os.O_WRONLY | os.O_CREAT, 0o600)
+            except OSError as exc:
+                log.warning('could not lock the %s: %s', self.name, exc)
+                lockfd = None
+            try:
+                if lockfd is not None and fcntl is not None:
+                    fcntl.flock(lockfd, fcntl.LOCK_EX)
+                ret = func(self.load())
+                self._save()
+                return ret
+            finally:
+                if lockfd is not None:
+                    os.close(lockfd)
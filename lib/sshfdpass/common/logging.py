@@ -1,9 +1,121 @@
+'''
+sshfdpass.common.logging
+------------------------
+
+The logging backend of sshfdpass.
+
+sshfdpass is started by ssh for every connection, and a lot of ssh processes might run at the same time
+(think of ansible with many forks), so the logger is built around these constraints:
+* The level is checked before anything is formatted. Callers pass the format and its arguments separately:
+      log.debug('evaluating rule %s', rule)
+  and the disabled level methods are replaced with a no-op, so a debug call costs a single function call.
+* The logfile is only opened when the first record is written, with O_APPEND,
+  and every record is written with a single write() call, so the lines of concurrent invocations don't interleave.
+* The logfile is rotated when it grows over maxsize. The rotation is serialized with flock(),
+  the other processes notice it on their next write, and reopen the file.
+* Records can be sent to syslog (/dev/log) or to journald as well.
+
+The settings are in the logging section of the settings:
+    settings:
+        logging:
+            level: info         # debug, info, warning or error
+            file: ~/.ssh/fdpass.log  # empty to disable the logfile
+            maxsize: 1048576    # rotate the logfile over this size, 0 to never rotate
+            backups: 3          # number of rotated logfiles to keep
+            syslog: no
+            journald: no
+            facility: user      # syslog facility
+            ident: sshfdpass
+The SSHFDPASS_LOGLEVEL environment variable overrides the level, e.g. for a single debug run:
+    SSHFDPASS_LOGLEVEL=debug ssh somehost
+The old message(level, *lines) interface is still available, but it can't avoid the formatting by the caller.
+'''
+
 import os
+import time
+import socket
+import threading
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+LEVELS = dict(debug=10, info=20, warning=30, error=40)
+DEFAULT_LEVEL = 'info'
+DEFAULT_LOGFILE = '~/.ssh/fdpass.log'
+ENVIRONMENT = 'SSHFDPASS_LOGLEVEL'
+
+SYSLOG_SOCKETS = ('/dev/log', '/var/run/syslog', '/var/run/log')
+JOURNALD_SOCKET = '/run/systemd/journal/socket'
+SYSLOG_SEVERITY = dict(debug=7, info=6, warning=4, error=3)
+SYSLOG_FACILITY = dict(user=1, daemon=3, auth=4, local0=16, local1=17, local2=18, local3=19,
+        local4=20, local5=21, local6=22, local7=23)
+
+def _discard(*args):
+    pass
+
+def journald_field(name, value):
+    '''Encode a field in the native journald protocol'''
+    value = value.encode('utf-8', 'replace')
+    if b'\n' in value:
+        # Multiline values are sent with their length instead of the = separator
+        import struct
+        return name.encode('ascii') + b'\n' + struct.pack('<Q', len(value)) + value + b'\n'
+    return name.encode('ascii') + b'=' + value + b'\n'
 
 class Logger():
+    '''
+    Logger
+    ------
+
+    Methods:
+    debug(fmt, *args), info(fmt, *args), warning(fmt, *args), error(fmt, *args):
+        Log a record if the level is enabled. fmt is only formatted with args in that case.
+    message(*message):
+        The compatible interface: with more than one parameter the first one is the level,
+        the others are the lines to log. A single parameter is logged as debug.
+    enabled(level):
+        True, if records of level are logged.
+    configure(**settings):
+        Applies the logging settings, see the module's doc.
+    '''
     def __init__(self):
-        self.logfile=open(os.path.join(os.environ.get('HOME'),'.ssh/fdpass.log'),'a+')
-    def message(self,*message):
+        self._lock = threading.Lock()
+        self._fd = None
+        self._sockets = dict()
+        self.configure()
+
+    def configure(self, level=DEFAULT_LEVEL, file=DEFAULT_LOGFILE, maxsize=1024*1024, backups=3,
+            syslog=False, journald=False, facility='user', ident='sshfdpass', **kwargs):
+        from sshfdpass.common import boolean
+        level = os.environ.get(ENVIRONMENT) or level or DEFAULT_LEVEL
+        self.level = LEVELS.get(str(level).lower(), LEVELS[DEFAULT_LEVEL])
+        path = os.path.expanduser(file) if file else None
+        with self._lock:
+            if path != getattr(self, 'path', None):
+                self._close()
+            self.path = path
+        self.maxsize = int(maxsize or 0)
+        self.backups = int(backups or 0)
+        self.syslog = boolean(syslog)
+        self.journald = boolean(journald)
+        self.facility = SYSLOG_FACILITY.get(facility, 1)
+        self.ident = ident
+        for name in LEVELS:
+            if self.enabled(name):
+                setattr(self, name, self._make_method(name))
+            else:
+                setattr(self, name, _discard)
+
+    def enabled(self, level):
+        return LEVELS.get(level, LEVELS['debug']) >= self.level
+
+    def _make_method(self, level):
+        def method(fmt, *args):
+            self._emit(level, [ fmt%args if args else fmt ])
+        return method
+
+    def message(self, *message):
         # Message start index number
         start = 0
         if len(message) > 1:
@@ -12,7 +124,105 @@ class Logger():
             start = 1
         else:
             level = 'debug'
-        for i in message[start:]:
-            self.logfile.write('%s: %s\n' % ( level, i))
+        if self.enabled(level):
+            self._emit(level, [ str(i) for i in message[start:] ])
+
+    def _emit(self, level, lines):
+        try:
+            if self.path:
+                stamp = time.strftime('%Y-%m-%d %H:%M:%S')
+                pid = os.getpid()
+                self._write(''.join([ '%s [%d] %s: %s\n'%(stamp, pid, level, line) for line in lines ]).encode('utf-8', 'replace'))
+            if self.syslog:
+                for line in lines:
+                    self._syslog(level, line)
+            if self.journald:
+                for line in lines:
+                    self._journald(level, line)
+        except Exception:
+            # Logging must never break a connection
+            pass
+
+    def _open(self):
+        with self._lock:
+            if self._fd is None:
+                self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+            return self._fd
+
+    def _close(self):
+        if self._fd is not None:
+            try:
+                os.close(self._fd)
+            except OSError:
+                pass
+            self._fd = None
+
+    def _write(self, data):
+        fd = self._fd if self._fd is not None else self._open()
+        os.write(fd, data)
+        if self.maxsize and os.fstat(fd).st_size >= self.maxsize:
+            self._rotate(fd)
+
+    def _rotate(self, fd):
+        '''
+        Rotates the logfile, if nobody else did it yet.
+
+        The exclusive flock() on the logfile serializes the concurrent rotations.
+        If the file behind the path is not the one we write into, somebody else rotated it already,
+        so we only need to reopen the path.
+        '''
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            try:
+                current = os.stat(self.path)
+            except OSError:
+                current = None
+            if current is not None and current.st_ino == os.fstat(fd).st_ino and current.st_size >= self.maxsize:
+                if self.backups:
+                    for i in range(self.backups - 1, 0, -1):
+                        if os.path.exists('%s.%d'%(self.path, i)):
+                            os.rename('%s.%d'%(self.path, i), '%s.%d'%(self.path, i + 1))
+                    os.rename(self.path, '%s.1'%(self.path))
+                else:
+                    os.unlink(self.path)
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        with self._lock:
+            if self._fd == fd:
+                self._close()
+
+    def _socket(self, name, paths):
+        '''A datagram socket connected to the first existing path, or None'''
+        with self._lock:
+            if name not in self._sockets:
+                self._sockets[name] = None
+                for path in paths:
+                    sock = None
+                    try:
+                        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+                        sock.connect(path)
+                        self._sockets[name] = sock
+                        break
+                    except (OSError, AttributeError):
+                        if sock is not None:
+                            sock.close()
+            return self._sockets[name]
+
+    def _syslog(self, level, line):
+        sock = self._socket('syslog', SYSLOG_SOCKETS)
+        if sock is not None:
+            priority = self.facility * 8 + SYSLOG_SEVERITY.get(level, 7)
+            sock.send(('<%d>%s %s[%d]: %s'%(priority, time.strftime('%b %d %H:%M:%S'), self.ident, os.getpid(), line)).encode('utf-8', 'replace'))
+
+    def _journald(self, level, line):
+        sock = self._socket('journald', (JOURNALD_SOCKET,))
+        if sock is not None:
+            sock.send(journald_field('PRIORITY', str(SYSLOG_SEVERITY.get(level, 7)))
+                    + journald_field('SYSLOG_IDENTIFIER', self.ident)
+                    + journald_field('SYSLOG_PID', str(os.getpid()))
+                    + journald_field('MESSAGE', line))
+
     def __del__(self):
-        self.logfile.close()
+        self._close()
@@ -0,0 +1,399 @@
+'''
+sshfdpass.common.net
+--------------------
+
+Networking helpers shared by the tcp-family actions.
+
+The main piece here is an RFC 8305 (Happy Eyeballs v2) style connection racer:
+All the addresses of the destination are resolved for every requested address family,
+then the address list is interleaved (preferred family first, then alternating),
+and the connection attempts are started one after the other in a non-blocking way,
+with a short delay between them.
+The first connection which completes wins, every other attempt is closed.
+This way a dead IPv6 path costs only the attempt delay instead of the kernel's SYN timeout.
+
+probe() checks the reachability of several destinations at once: every address of every destination is connected
+in parallel, in a non-blocking way, in one selector loop. It's used by the tcpreach test.
+
+A connection opened by a probe is not wasted: it can be put into the stash, and the tcp-family actions
+take() the connection of their destination from there, instead of doing the handshake again.
+A stashed connection is kept for STASH_TTL seconds at most, then it's closed.
+
+recvexact() and recvuntil() read a handshake (eg. of a proxy) without reading past its end,
+so the first bytes of the connection after it (eg. the banner of the ssh server) are left in the socket for ssh.
+'''
+
+import errno
+import socket
+import threading
+
+try:
+    import selectors
+except ImportError: # python2 compatibility
+    selectors = None
+
+import sshfdpass.common
+import sshfdpass.common.resolver
+from sshfdpass.common.exceptions import *
+from sshfdpass.common.deadline import monotonic
+
+log = sshfdpass.common.log
+
+AFMAP = {
+        '4': socket.AF_INET,
+        '6': socket.AF_INET6,
+        }
+
+# Errno values meaning that a non-blocking connect is still in progress
+_INPROGRESS = (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY)
+
+# Seconds a stashed connection is kept for an action
+STASH_TTL = 10
+
+
+def hostport(address, port=None):
+    '''Split host:port, [address]:port or a host alone (which means port) into a (host, port) tuple'''
+    address = str(address).strip()
+    if address.startswith('['):
+        host, sep, rest = address[1:].partition(']')
+        if rest.startswith(':'):
+            port = rest[1:]
+    elif address.count(':') == 1:
+        host, sep, port = address.partition(':')
+    else:
+        host = address
+    if port is None:
+        raise(sshfdpassException) # no port given
+    return (host, int(port))
+
+
+def recvexact(s, size):
+    '''Read exactly size bytes from s, raises sshfdpassActionError if the connection is closed before'''
+    data = b''
+    while len(data) < size:
+        chunk = s.recv(size - len(data))
+        if not chunk:
+            raise(sshfdpassActionError('connection closed after %d of %d bytes'%(len(data), size)))
+        data += chunk
+    return data
+
+
+def recvuntil(s, delimiter, limit=65536):
+    '''Read from s up to and including delimiter, but not a byte more
+
+    The received data is peeked first (MSG_PEEK), and only the part up to the delimiter is read,
+    so it takes one or two system calls per segment, not one per byte.
+    Raises sshfdpassActionError, if the connection is closed, or there is no delimiter in the first limit bytes.
+    '''
+    data = b''
+    while True:
+        peeked = s.recv(max(limit - len(data), len(delimiter)), socket.MSG_PEEK)
+        if not peeked:
+            raise(sshfdpassActionError('connection closed before %r'%(delimiter)))
+        # The delimiter may be split between the data already read and the peeked one
+        tail = len(data) - min(len(data), len(delimiter) - 1)
+        found = (data[tail:] + peeked).find(delimiter)
+        if found >= 0:
+            return data + recvexact(s, tail - len(data) + found + len(delimiter))
+        if len(data) + len(peeked) >= limit:
+            raise(sshfdpassActionError('no %r in the first %d bytes'%(delimiter, limit)))
+        data += recvexact(s, len(peeked))
+
+
+def aflist(aforder):
+    '''Convert an aforder setting (eg. "6,4" or 4) into a list of address families'''
+    ret = []
+    for af in str(aforder).split(','):
+        af = af.strip()
+        if af not in AFMAP:
+            raise(sshfdpassAFUnkown)
+        ret.append(AFMAP[af])
+    return ret
+
+
+def interleave(groups):
+    '''Interleave address lists as described in RFC 8305 section 4.
+
+    Parameters
+    ----------
+    groups: list
+        List of lists, one list of addrinfo tuples per address family, in the order of preference.
+
+    Returns
+    -------
+    list
+        One list of addrinfo tuples, taking one element from every family in turn.
+    '''
+    ret = []
+    groups = [ list(group) for group in groups if group ]
+    while groups:
+        for group in groups:
+            ret.append(group.pop(0))
+        groups = [ group for group in groups if group ]
+    return ret
+
+
+def resolve(host, port, families):
+    '''Resolve host and port for every given address family
+
+    Families which can not be resolved are silently skipped.
+    The lookups go through the persistent cache of sshfdpass.common.resolver.
+
+    Returns
+    -------
+    list
+        Interleaved list of addrinfo tuples
+    '''
+    groups = []
+    for family in families:
+        try:
+            groups.append(sshfdpass.common.resolver.getaddrinfo(host, port, family, socket.SOCK_STREAM))
+        except socket.gaierror as exc:
+            log.debug('resolving %s for family %s failed: %s', host, family, exc)
+    return interleave(groups)
+
+
+def race(addrinfos, delay=0.25, timeout=None):
+    '''Start staggered non-blocking connects, and return the first connected socket
+
+    Parameters
+    ----------
+    addrinfos: list
+        List of addrinfo tuples in the order the connection attempts should be started
+    delay: float
+        Connection attempt delay: seconds to wait before starting the next attempt,
+        while the previous ones are still in progress. A failed attempt starts the next one immediately.
+    timeout: float or None
+        Overall timeout for the whole race.
+
+    Returns
+    -------
+    socket or None
+        The winner socket, in blocking mode, or None if every attempt failed.
+
+    Raises
+    ------
+    sshfdpassTimeout
+        If no attempt succeeded within timeout.
+    '''
+    if selectors is None:
+        raise(sshfdpassException) # Happy eyeballs needs the selectors module
+    pending = list(addrinfos)
+    inflight = []
+    winner = None
+    timedout = False
+    start = monotonic()
+    nextstart = start
+    sel = selectors.DefaultSelector()
+    try:
+        while winner is None and (pending or inflight):
+            now = monotonic()
+            if timeout is not None and now - start >= timeout:
+                log.debug('connection race timed out')
+                timedout = True
+                break
+            if pending and (not inflight or now >= nextstart):
+                family, socktype, proto, canonname, sockaddr = pending.pop(0)
+                s = socket.socket(family, socktype, proto)
+                s.setblocking(False)
+                err = s.connect_ex(sockaddr)
+                if err == 0:
+                    winner = s
+                elif err in _INPROGRESS:
+                    log.debug('connection attempt to %s started', sockaddr)
+                    sel.register(s, selectors.EVENT_WRITE, sockaddr)
+                    inflight.append(s)
+                    nextstart = now + delay
+                else:
+                    log.debug('connection attempt to %s failed: %s', sockaddr, errno.errorcode.get(err, err))
+                    s.close()
+                continue
+            waits = []
+            if pending:
+                waits.append(nextstart - now)
+            if timeout is not None:
+                waits.append(start + timeout - now)
+            wait = max(min(waits), 0) if waits else None
+            for key, events in sel.select(wait):
+                s = key.fileobj
+                sel.unregister(s)
+                inflight.remove(s)
+                err = s.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if err == 0:
+                    log.debug('connection to %s won the race', key.data)
+                    winner = s
+                    break
+                log.debug('connection attempt to %s failed: %s', key.data, errno.errorcode.get(err, err))
+                s.close()
+                nextstart = monotonic()
+    finally:
+        for s in inflight:
+            if s is not winner:
+                s.close()
+        sel.close()
+    if winner is not None:
+        winner.setblocking(True)
+    elif timedout:
+        raise(sshfdpassTimeout)
+    return winner
+
+
+def probe(targets, families, timeout=None, stop=None):
+    '''Connect every address of every target in parallel, to find out which targets are reachable
+
+    Parameters
+    ----------
+    targets: list
+        List of (host, port) tuples
+    families: list
+        Address families to resolve the hosts for
+    timeout: float or None
+        Seconds to wait for the connections at most
+    stop: callable or None
+        Called with the results so far, every time a target turns out to be reachable or unreachable.
+        If it returns true, the probes still in progress are abandoned.
+
+    Returns
+    -------
+    dict
+        (host, port) -> the connected socket (in blocking mode) if the target is reachable,
+        False if it's unreachable, None if it's undecided (timed out or abandoned).
+        The caller owns the sockets: it has to close or stash() them.
+    '''
+    if selectors is None:
+        raise(sshfdpassException) # Parallel probes need the selectors module
+    results = dict((target, None) for target in targets)
+    inflight = dict() # socket -> (target, sockaddr)
+    sel = selectors.DefaultSelector()
+
+    def decided(target, result):
+        results[target] = result
+        for s, (other, sockaddr) in list(inflight.items()):
+            if other == target:
+                sel.unregister(s)
+                del inflight[s]
+                s.close()
+
+    def remaining(target):
+        return any(other == target for other, sockaddr in inflight.values())
+
+    try:
+        start = monotonic()
+        for target in targets:
+            if results[target] is not None:
+                continue
+            for family, socktype, proto, canonname, sockaddr in resolve(target[0], target[1], families):
+                if results[target] is not None:
+                    break
+                s = socket.socket(family, socktype, proto)
+                s.setblocking(False)
+                err = s.connect_ex(sockaddr)
+                if err == 0:
+                    log.debug('probe of %s:%s connected to %s', target[0], target[1], sockaddr)
+                    decided(target, s)
+                elif err in _INPROGRESS:
+                    sel.register(s, selectors.EVENT_WRITE)
+                    inflight[s] = (target, sockaddr)
+                else:
+                    log.debug('probe of %s:%s to %s failed: %s', target[0], target[1], sockaddr, errno.errorcode.get(err, err))
+                    s.close()
+            if results[target] is None and not remaining(target):
+                decided(target, False)
+            if results[target] is not None and stop is not None and stop(results):
+                return results
+        while inflight:
+            wait = None
+            if timeout is not None:
+                wait = start + timeout - monotonic()
+                if wait <= 0:
+                    log.debug('probes timed out')
+                    break
+            for key, events in sel.select(wait):
+                s = key.fileobj
+                if s not in inflight:
+                    continue # closed meanwhile, because its target is decided
+                target, sockaddr = inflight.pop(s)
+                sel.unregister(s)
+                err = s.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if err == 0:
+                    log.debug('probe of %s:%s connected to %s', target[0], target[1], sockaddr)
+                    decided(target, s)
+                else:
+                    log.debug('probe of %s:%s to %s failed: %s', target[0], target[1], sockaddr, errno.errorcode.get(err, err))
+                    s.close()
+                    if remaining(target):
+                        continue
+                    decided(target, False)
+                if stop is not None and stop(results):
+                    return results
+    finally:
+        for s in inflight:
+            s.close()
+        sel.close()
+        for result in results.values():
+            if result:
+                result.setblocking(True)
+    return results
+
+
+class Stash():
+    '''
+    Stash
+    -----
+
+    Connections opened in advance (eg. by a probe), waiting for the action connecting to the same destination.
+
+    Methods
+    -------
+    put(self, host, port, s, ttl=STASH_TTL):
+        Keep the connected socket s for the action connecting to host and port, at most for ttl seconds.
+    take(self, host, port, families=None):
+        The stashed connection of host and port, if there is one of the given address families, or None.
+        The caller owns it.
+    clear(self):
+        Close every stashed connection.
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sockets = dict()
+
+    @staticmethod
+    def _key(host, port):
+        return (str(host).lower(), int(port))
+
+    def _expire(self):
+        now = monotonic()
+        for key, (s, expires) in list(self._sockets.items()):
+            if expires <= now:
+                log.debug('closing the unused stashed connection of %s:%s', *key)
+                del self._sockets[key]
+                s.close()
+
+    def put(self, host, port, s, ttl=STASH_TTL):
+        with self._lock:
+            self._expire()
+            key = self._key(host, port)
+            if key in self._sockets:
+                self._sockets.pop(key)[0].close()
+            self._sockets[key] = (s, monotonic() + ttl)
+
+    def take(self, host, port, families=None):
+        with self._lock:
+            self._expire()
+            key = self._key(host, port)
+            if key not in self._sockets or (families is not None and self._sockets[key][0].family not in families):
+                return None
+            log.debug('using the stashed connection of %s:%s', *key)
+            return self._sockets.pop(key)[0]
+
+    def clear(self):
+        with self._lock:
+            for s, expires in self._sockets.values():
+                s.close()
+            self._sockets = dict()
+
+
+_stash = Stash()
+
+stash = _stash.put
+take = _stash.take
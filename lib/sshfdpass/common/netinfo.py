@@ -0,0 +1,250 @@
+'''
+sshfdpass.common.netinfo
+------------------------
+
+Probe-free discovery of the local network state.
+
+Everything here is read from the kernel, without sending a single packet:
+* interface addresses: getifaddrs() via ctypes, or a connected (but silent) UDP socket as a fallback
+* default gateways: /proc/net/route and /proc/net/ipv6_route (Linux only)
+* dns search domains and servers: /etc/resolv.conf
+* the source address the kernel would use towards a destination: a connected UDP socket (no packet is sent)
+
+fingerprint() combines all of these into a short, stable hash of the current network,
+so caches can be keyed on it, and invalidated when the network changes (eg. Wi-Fi or VPN switch).
+The results are cached for a few seconds within the process.
+
+Discovering the addresses costs more than the rest of a short invocation (ctypes has to be imported),
+so the fingerprint is shared between the invocations in ~/.ssh/fdpass.net: it's reused for FINGERPRINT_TTL
+seconds, as long as the kernel's routing tables, IPv6 addresses and /etc/resolv.conf are unchanged.
+These are plain file reads, and practically every network change touches at least one of them.
+'''
+
+import os
+import sys
+import socket
+import struct
+import threading
+import time
+import sshfdpass.common
+import sshfdpass.common.jsonfile
+
+log = sshfdpass.common.log
+
+RESOLV_CONF = '/etc/resolv.conf'
+
+# Seconds to reuse the discovered state within one process (eg. the daemon)
+CACHE_TTL = 2
+
+# The fingerprint shared by the invocations, and the seconds it's reused for
+FINGERPRINT_FILE = '~/.ssh/fdpass.net'
+FINGERPRINT_TTL = 60
+
+# Files which change with practically every network change, see fingerprint()
+STATE_FILES = ('/proc/net/route', '/proc/net/ipv6_route', '/proc/net/if_inet6', RESOLV_CONF)
+
+# Columns of the STATE_FILES which change with the traffic, not with the network (RefCnt and Use)
+VOLATILE_COLUMNS = { '/proc/net/route': (4, 5), '/proc/net/ipv6_route': (6, 7) }
+
+_cache = dict()
+_lock = threading.Lock()
+_fingerprints = None
+
+
+def _cached(name, func):
+    with _lock:
+        entry = _cache.get(name)
+        if entry is not None and time.time() - entry[0] < CACHE_TTL:
+            return entry[1]
+    value = func()
+    with _lock:
+        _cache[name] = (time.time(), value)
+    return value
+
+
+def _getifaddrs():
+    '''Interface addresses via the libc getifaddrs(), list of (interface, address)'''
+    import ctypes
+
+    class ifaddrs(ctypes.Structure):
+        pass
+    ifaddrs._fields_ = [
+            ('ifa_next', ctypes.POINTER(ifaddrs)),
+            ('ifa_name', ctypes.c_char_p),
+            ('ifa_flags', ctypes.c_uint),
+            ('ifa_addr', ctypes.c_void_p),
+            ('ifa_netmask', ctypes.c_void_p),
+            ]
+    # The symbols of the running process include libc's. ctypes.util.find_library() runs external
+    # commands (and imports subprocess and tempfile), so it's only the fallback.
+    libc = ctypes.CDLL(None, use_errno=True)
+    if not hasattr(libc, 'getifaddrs'):
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    libc.getifaddrs.argtypes = [ ctypes.POINTER(ctypes.POINTER(ifaddrs)) ]
+    libc.freeifaddrs.argtypes = [ ctypes.POINTER(ifaddrs) ]
+    head = ctypes.POINTER(ifaddrs)()
+    if libc.getifaddrs(ctypes.byref(head)) != 0:
+        raise OSError(ctypes.get_errno(), 'getifaddrs failed')
+    # BSD style sockaddr starts with a length byte, linux style with a 16 bit family
+    bsd = not sys.platform.startswith('linux')
+    ret = []
+    try:
+        entry = head
+        while entry:
+            ifa = entry.contents
+            if ifa.ifa_addr:
+                raw = ctypes.string_at(ifa.ifa_addr, 24)
+                family = raw[1] if bsd else struct.unpack('=H', raw[0:2])[0]
+                name = ifa.ifa_name.decode('utf-8', 'replace')
+                if family == socket.AF_INET:
+                    ret.append((name, socket.inet_ntop(socket.AF_INET, raw[4:8])))
+                elif family == socket.AF_INET6:
+                    ret.append((name, socket.inet_ntop(socket.AF_INET6, raw[8:24])))
+            entry = ifa.ifa_next
+    finally:
+        libc.freeifaddrs(head)
+    return ret
+
+
+def route_source(dsthost, family=socket.AF_INET, dstport=53):
+    '''The local address the kernel would use towards dsthost, or None
+
+    A UDP socket is connected, which only does a route lookup, no packet is sent.
+    '''
+    s = socket.socket(family, socket.SOCK_DGRAM)
+    try:
+        s.connect((dsthost, dstport))
+        return s.getsockname()[0]
+    except (IOError, OSError):
+        return None
+    finally:
+        s.close()
+
+
+def _discover_addresses():
+    try:
+        return _getifaddrs()
+    except Exception as exc:
+        log.info('getifaddrs is not usable (%s), falling back to route lookups', exc)
+    ret = []
+    for family, dsthost in ((socket.AF_INET, '192.0.2.1'), (socket.AF_INET6, '2001:db8::1')):
+        address = route_source(dsthost, family)
+        if address is not None:
+            ret.append(('', address))
+    return ret
+
+
+def interfaces():
+    '''List of (interface name, address) of every local address'''
+    return _cached('interfaces', _discover_addresses)
+
+
+def addresses(family=None):
+    '''List of every local address, optionally only of one address family'''
+    ret = []
+    for name, address in interfaces():
+        if family is None or (':' in address) == (family == socket.AF_INET6):
+            ret.append(address.split('%')[0])
+    return ret
+
+
+def _hex_to_ipv4(value):
+    return socket.inet_ntop(socket.AF_INET, struct.pack('=I', int(value, 16)))
+
+
+def _discover_gateways():
+    ret = []
+    try:
+        with open('/proc/net/route') as routes:
+            for line in routes.readlines()[1:]:
+                fields = line.split()
+                # Iface Destination Gateway Flags RefCnt Use Metric Mask ...
+                if len(fields) > 7 and fields[1] == '00000000' and fields[7] == '00000000' and fields[2] != '00000000':
+                    ret.append(_hex_to_ipv4(fields[2]))
+    except (IOError, OSError):
+        pass
+    try:
+        with open('/proc/net/ipv6_route') as routes:
+            for line in routes:
+                fields = line.split()
+                # dest prefixlen src srcprefixlen nexthop metric refcnt use flags iface
+                if len(fields) > 4 and fields[0] == '0' * 32 and fields[1] == '00' and fields[4] != '0' * 32:
+                    ret.append(socket.inet_ntop(socket.AF_INET6, bytes.fromhex(fields[4])))
+    except (IOError, OSError):
+        pass
+    return sorted(set(ret))
+
+
+def gateways():
+    '''List of the default gateways (IPv4 and IPv6)'''
+    return _cached('gateways', _discover_gateways)
+
+
+def _discover_resolvconf():
+    ret = dict(search=[], nameserver=[])
+    try:
+        with open(RESOLV_CONF) as resolvconf:
+            for line in resolvconf:
+                fields = line.split()
+                if len(fields) > 1 and fields[0] in ('search', 'domain'):
+                    ret['search'] += [ domain.rstrip('.').lower() for domain in fields[1:] ]
+                elif len(fields) > 1 and fields[0] == 'nameserver':
+                    ret['nameserver'].append(fields[1])
+    except (IOError, OSError):
+        pass
+    return ret
+
+
+def searchdomains():
+    '''List of the dns search domains'''
+    return _cached('resolvconf', _discover_resolvconf)['search']
+
+
+def nameservers():
+    '''List of the configured dns servers'''
+    return _cached('resolvconf', _discover_resolvconf)['nameserver']
+
+
+def _discover_fingerprint():
+    state = repr((sorted(addresses()), gateways(), searchdomains(), nameservers()))
+    return sshfdpass.common.digest(state.encode('utf-8'))
+
+
+def _quickstate():
+    '''A digest of the content of the STATE_FILES without their VOLATILE_COLUMNS, without any discovery'''
+    state = []
+    for path in STATE_FILES:
+        volatile = VOLATILE_COLUMNS.get(path, ())
+        try:
+            with open(path, 'rb') as statefd:
+                if volatile:
+                    for line in statefd:
+                        state.append(b' '.join(field for i, field in enumerate(line.split()) if i not in volatile) + b'\n')
+                else:
+                    state.append(statefd.read())
+        except (IOError, OSError):
+            pass
+        state.append(b'\0')
+    return sshfdpass.common.digest(b''.join(state))
+
+
+def _shared_fingerprint():
+    '''The fingerprint from FINGERPRINT_FILE, if it's recent and the quick state is unchanged, otherwise discovered'''
+    global _fingerprints
+    path = os.path.expanduser(FINGERPRINT_FILE)
+    if _fingerprints is None or _fingerprints.path != path:
+        _fingerprints = sshfdpass.common.jsonfile.JSONFile(path, 1, 'network fingerprint')
+    quick = _quickstate()
+    data = _fingerprints.load()
+    if data.get('quick') == quick and 0 <= time.time() - data.get('time', 0) < FINGERPRINT_TTL:
+        return data['fingerprint']
+    value = _discover_fingerprint()
+    log.debug('network fingerprint: %s', value)
+    _fingerprints.update(lambda data: data.update(quick=quick, time=time.time(), fingerprint=value))
+    return value
+
+
+def fingerprint():
+    '''A short hash of the current network state: addresses, default gateways, search domains and dns servers'''
+    return _cached('fingerprint', _shared_fingerprint)
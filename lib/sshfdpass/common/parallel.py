@@ -0,0 +1,79 @@
+'''
+sshfdpass.common.parallel
+-------------------------
+
+Minimal helpers to run blocking work (test probes, connects) in the background.
+
+The work runs in daemon threads, so a still running probe never keeps the process alive,
+after the decision is made and the fd is passed to ssh. Python threads can't be cancelled,
+so abandoned tasks simply run to completion (or die with the process).
+Tasks inherit the active trace (see sshfdpass.common.trace) of the thread which started them.
+'''
+
+import threading
+import sshfdpass.common.trace
+from sshfdpass.common.deadline import monotonic
+
+
+class Task():
+    '''
+    Run func(*args, **kwargs) in a daemon thread
+
+    The special _semaphore keyword limits the number of parallel tasks,
+    the _callback keyword is called with the task when it finished.
+
+    Methods
+    -------
+    wait(self, timeout=None):
+        Wait for the task to finish. Returns True if it finished.
+    result(self):
+        The return value of func, or raises the exception it raised. Waits for the task if needed.
+    '''
+    def __init__(self, func, *args, **kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.semaphore = kwargs.pop('_semaphore', None)
+        self.callback = kwargs.pop('_callback', None)
+        self.value = None
+        self.exception = None
+        self.finished = threading.Event()
+        # The task belongs to the trace of the thread which started it
+        self.trace = sshfdpass.common.trace.current()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        sshfdpass.common.trace.activate(self.trace)
+        try:
+            if self.semaphore is not None:
+                with self.semaphore:
+                    self.value = self.func(*self.args, **self.kwargs)
+            else:
+                self.value = self.func(*self.args, **self.kwargs)
+        except BaseException as exc:
+            self.exception = exc
+        finally:
+            self.finished.set()
+            if self.callback is not None:
+                self.callback(self)
+
+    @property
+    def done(self):
+        return self.finished.is_set()
+
+    def wait(self, timeout=None):
+        return self.finished.wait(timeout)
+
+    def result(self):
+        self.finished.wait()
+        if self.exception is not None:
+            raise(self.exception)
+        return self.value
+
+
+def start_all(funcs, maxworkers=None):
+    '''Start a Task for every callable in funcs, running at most maxworkers at the same time'''
+    semaphore = threading.BoundedSemaphore(maxworkers) if maxworkers else None
+    return [ Task(func, _semaphore=semaphore) for func in funcs ]
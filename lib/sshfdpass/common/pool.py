@@ -0,0 +1,196 @@
+'''
+sshfdpass.common.pool
+---------------------
+
+Pool of pre-warmed connections for the daemon.
+
+For hot destinations even a fast tcp connect pays a full handshake at the moment ssh starts.
+If a rule has a `prewarm` key, the daemon keeps a few already connected, idle sockets to its
+destination, and hands one out on the next request for it, through the usual fd passing path.
+Sockets are replaced before they get older than `maxidle` seconds, so they won't hit the
+server side timeouts (LoginGraceTime of sshd is 120 seconds by default).
+A destination is kept warm for `keep` seconds after its last request.
+The pool also keeps the sockets of actions running a command (spawn.ChildSocket): their child
+is terminated when the socket is dropped instead of being handed out.
+
+The prewarm key of a rule can be a number (the pool size), a boolean, or a dict overriding
+any of the pool settings for that rule:
+    rules:
+        bastion:
+            - action: tcp
+              prewarm: 2
+        ci:
+            - action: tcp
+              prewarm:
+                size: 4
+                maxidle: 30
+
+Global defaults, with the per-host cap of pooled sockets (for all rules and ports of a host)
+and the interval of the maintenance:
+    settings:
+        pool:
+            size: 1
+            maxidle: 60
+            keep: 3600
+            perhost: 8
+            interval: 5
+'''
+
+import socket
+import threading
+import time
+import sshfdpass.common
+
+log = sshfdpass.common.log
+
+
+def alive(sock):
+    '''Check if an idle pooled socket is still connected, without consuming any data'''
+    sock = getattr(sock, 'sock', sock) # The socket of a spawn.ChildSocket
+    try:
+        return sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) != b''
+    except (BlockingIOError, InterruptedError):
+        return True
+    except (IOError, OSError):
+        return False
+
+
+def discard(sock):
+    '''Close a pooled socket that is not handed out, and terminate the child behind it if any'''
+    try:
+        if hasattr(sock, 'terminate'):
+            sock.terminate()
+        else:
+            sock.close()
+    except Exception as exc:
+        log.warning('closing a pooled connection failed: %s', exc)
+
+
+class Pool():
+    '''
+    Pre-warmed connection pool
+
+    Attributes
+    ----------
+    settings: dict
+        Default pool settings, see the module doc
+    stats: dict
+        hit, miss, created, expired and failed counters
+
+    Methods
+    -------
+    get(self, key, host, factory, prewarm, deadline=None):
+        Return a pooled connection for key, or create one with factory(deadline).
+        Also records the demand, so the pool will keep the destination warm.
+        The sockets of the pool are created with factory(), without a deadline.
+    refill(self):
+        Drop the expired and dead sockets, and connect new ones where needed.
+    run(self):
+        Maintenance loop, call it in a separate thread.
+    clear(self):
+        Close every pooled socket, and forget every destination.
+    '''
+    def __init__(self, **settings):
+        self.settings = dict(size=1, maxidle=60, keep=3600, perhost=8, interval=5)
+        self.settings.update(settings)
+        self.stats = dict(hit=0, miss=0, created=0, expired=0, failed=0)
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.entries = dict()
+        self.wanted = dict()
+
+    def _options(self, prewarm):
+        options = dict(self.settings)
+        if isinstance(prewarm, dict):
+            options.update(prewarm)
+        elif not isinstance(prewarm, bool) and isinstance(prewarm, int):
+            options['size'] = prewarm
+        return options
+
+    def get(self, key, host, factory, prewarm=True, deadline=None):
+        with self.lock:
+            self.wanted[key] = dict(host=host, factory=factory, options=self._options(prewarm), lastused=time.time())
+            entries = self.entries.get(key, [])
+            while entries:
+                sock, created = entries.pop(0)
+                if time.time() - created < float(self.wanted[key]['options']['maxidle']) and alive(sock):
+                    self.stats['hit'] += 1
+                    self.wakeup.set()
+                    log.debug('pool hit for %s', key)
+                    return sock
+                self.stats['expired'] += 1
+                discard(sock)
+            self.stats['miss'] += 1
+        self.wakeup.set()
+        log.debug('pool miss for %s', key)
+        return factory(deadline)
+
+    def _hostcount(self, host):
+        return sum(len(self.entries.get(key, [])) for key, want in self.wanted.items() if want['host'] == host)
+
+    def refill(self):
+        tocreate = []
+        planned = dict()
+        with self.lock:
+            now = time.time()
+            for key, want in list(self.wanted.items()):
+                options = want['options']
+                keep = []
+                for sock, created in self.entries.get(key, []):
+                    if now - created < float(options['maxidle']) and alive(sock):
+                        keep.append((sock, created))
+                    else:
+                        self.stats['expired'] += 1
+                        discard(sock)
+                self.entries[key] = keep
+                if now - want['lastused'] > float(options['keep']):
+                    log.debug('destination %s is not hot anymore', key)
+                    for sock, created in self.entries.pop(key):
+                        discard(sock)
+                    del(self.wanted[key])
+                    continue
+                missing = min(
+                        int(options['size']) - len(keep),
+                        int(options['perhost']) - self._hostcount(want['host']) - planned.get(want['host'], 0))
+                missing = max(missing, 0)
+                planned[want['host']] = planned.get(want['host'], 0) + missing
+                tocreate += [ (key, want['factory']) ] * missing
+        # Connecting happens outside of the lock, so requests are not blocked meanwhile
+        for key, factory in tocreate:
+            try:
+                sock = factory()
+            except Exception as exc:
+                log.warning('prewarming %s failed: %s', key, exc)
+                self.stats['failed'] += 1
+                continue
+            with self.lock:
+                if key in self.wanted:
+                    self.entries.setdefault(key, []).append((sock, time.time()))
+                    self.stats['created'] += 1
+                else:
+                    discard(sock)
+
+    def clear(self):
+        with self.lock:
+            for entries in self.entries.values():
+                for sock, created in entries:
+                    discard(sock)
+            self.entries = dict()
+            self.wanted = dict()
+
+    def report(self):
+        '''Counters and the number of pooled sockets'''
+        with self.lock:
+            ret = dict(self.stats)
+            ret['pooled'] = sum(len(entries) for entries in self.entries.values())
+            ret['destinations'] = len(self.wanted)
+            return ret
+
+    def run(self):
+        while True:
+            self.wakeup.wait(float(self.settings['interval']))
+            self.wakeup.clear()
+            try:
+                self.refill()
+            except Exception as exc:
+                log.error('pool maintenance failed: %s', exc)
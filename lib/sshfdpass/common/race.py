@@ -0,0 +1,173 @@
+'''
+sshfdpass.common.race
+---------------------
+
+Racing the actions of several rules.
+
+race() gets the applicable rules one by one from an iterator (which may block while the
+tests are evaluated), and starts their actions in the background:
+* with racecount 1, the next action is only started if the previous one failed (sequential fall-through)
+* with a bigger racecount, up to racecount actions run at the same time, started at least
+  stagger seconds apart (a failure starts the next one immediately), and the first working
+  connection wins.
+If a fallback item is given, its action is started right away, while the tests are still running.
+In sequential mode its connection is only used when the fallback rule is reached in order,
+in race mode it's just an early racer.
+
+Every connection which is not the winner is torn down: sockets are closed, spawned children are terminated.
+'''
+
+import threading
+import sshfdpass.common
+import sshfdpass.common.parallel
+from sshfdpass.common.deadline import monotonic
+from sshfdpass.common.exceptions import *
+
+try:
+    import queue
+except ImportError: # python2 compatibility
+    import Queue as queue
+
+log = sshfdpass.common.log
+
+
+def close(conn):
+    '''Tear down a connection which is not needed'''
+    try:
+        if hasattr(conn, 'terminate'):
+            conn.terminate()
+        else:
+            conn.close()
+    except (IOError, OSError):
+        pass
+
+
+def discard(task):
+    '''Tear down the connection of a task, now or whenever it finishes'''
+    def cleanup():
+        try:
+            conn = task.result()
+        except Exception:
+            return
+        if conn is not None:
+            close(conn)
+    if task.done:
+        cleanup()
+    else:
+        sshfdpass.common.parallel.Task(cleanup)
+
+
+def race(eligible, connect, fallback=None, racecount=1, stagger=0.25, deadline=None):
+    '''Run the actions of the eligible items, and return the first working connection
+
+    Parameters
+    ----------
+    eligible: iterator
+        Yields the applicable items in the order of priority. Iterated in a background thread.
+    connect: callable
+        Called with an item, returns a connection or raises an exception.
+    fallback: item or None
+        Item to start speculatively, before it's yielded by eligible.
+    racecount: int
+        Number of actions running at the same time.
+    stagger: float
+        Minimum seconds between starting two actions in race mode.
+    deadline: sshfdpass.common.deadline.Deadline or None
+
+    Returns
+    -------
+        The winner connection.
+
+    Raises
+    ------
+        The last error of the failed actions, or sshfdpassTimeout if the deadline passed.
+    '''
+    events = queue.Queue()
+    stop = threading.Event()
+    racecount = max(int(racecount), 1)
+    stagger = float(stagger)
+
+    def decide():
+        try:
+            for item in eligible:
+                if stop.is_set():
+                    return
+                events.put(('eligible', item))
+        except Exception as exc:
+            events.put(('error', exc))
+        events.put(('exhausted', None))
+
+    def launch(item):
+        return sshfdpass.common.parallel.Task(connect, item, _callback=lambda task: events.put(('done', task)))
+
+    pending = []
+    active = []
+    exhausted = False
+    lastlaunch = None
+    lasterror = None
+    winner = None
+    speculative = None
+    specaccepted = racecount > 1
+    if fallback is not None:
+        log.debug('starting the fallback speculatively')
+        speculative = launch(fallback)
+    sshfdpass.common.parallel.Task(decide)
+    try:
+        while winner is None:
+            now = monotonic()
+            while pending and len(active) < racecount and (not active or lastlaunch is None or now - lastlaunch >= stagger):
+                item = pending.pop(0)
+                if speculative is not None and item == fallback:
+                    specaccepted = True
+                    if speculative.done and speculative.exception is None:
+                        winner = speculative
+                        break
+                    continue
+                active.append(launch(item))
+                lastlaunch = now
+            if winner is not None:
+                break
+            specrunning = speculative is not None and specaccepted and not speculative.done
+            if exhausted and not pending and not active and not specrunning:
+                break
+            waits = []
+            if pending and active and len(active) < racecount:
+                waits.append(stagger - (now - lastlaunch))
+            if deadline is not None and deadline.remaining() is not None:
+                waits.append(deadline.remaining())
+            try:
+                kind, value = events.get(timeout=max(min(waits), 0) if waits else None)
+            except queue.Empty:
+                if deadline is not None and deadline.expired():
+                    log.warning('ran out of time while racing the actions')
+                    lasterror = sshfdpassTimeout()
+                    break
+                continue
+            if kind == 'eligible':
+                pending.append(value)
+            elif kind == 'exhausted':
+                exhausted = True
+            elif kind == 'error':
+                lasterror = value
+                exhausted = True
+            elif kind == 'done':
+                if value in active:
+                    active.remove(value)
+                if value.exception is not None:
+                    log.warning('action failed: %s: %s', type(value.exception).__name__, value.exception)
+                    lasterror = value.exception
+                    # A failure lets the next one start immediately
+                    lastlaunch = None
+                    continue
+                if value is speculative and not specaccepted:
+                    log.debug('speculative fallback is ready, waiting for the higher priority rules')
+                    continue
+                winner = value
+    finally:
+        stop.set()
+        for task in active + ([ speculative ] if speculative is not None else []):
+            if task is not winner:
+                discard(task)
+    if winner is None:
+        raise(lasterror or sshfdpassActionError())
+    return winner.result()
@@ -0,0 +1,158 @@
+'''
+sshfdpass.common.registry
+-------------------------
+
+Lazy plugin registry for tests and actions.
+
+A typical ssh invocation uses one action and maybe a test or two, so importing and
+instantiating every plugin on every run is a waste. The Registry is a dict which knows
+the names of every available plugin, but imports and instantiates one only when it's
+actually looked up, with its settings applied at that point.
+
+Plugins are found in this order:
+* builtin modules of the package (eg. sshfdpass.actions.tcp), found without importing them.
+  It's a plain directory listing. In an archive built by sshfdpass.bundle the list is recorded at build time,
+  pkgutil (and the inspect module it pulls in) is only used, if neither is possible.
+* factories registered at runtime (user-defined tests from the config)
+* third-party plugins, advertised via the entry point group with the package's name
+  (eg. sshfdpass.actions). An entry point can refer to a module having the usual
+  Test/Action class, or to the class itself.
+'''
+
+import os
+import threading
+import sshfdpass.common
+import sshfdpass.common.trace
+
+log = sshfdpass.common.log
+
+
+def entry_points(group):
+    '''Return the dict of entry points (name -> entry point) registered for group'''
+    try:
+        import importlib.metadata as metadata
+    except ImportError:
+        try:
+            import pkg_resources
+        except ImportError:
+            return dict()
+        return dict((ep.name, ep) for ep in pkg_resources.iter_entry_points(group))
+    eps = metadata.entry_points()
+    if hasattr(eps, 'select'):
+        eps = eps.select(group=group)
+    else:
+        eps = eps.get(group, [])
+    return dict((ep.name, ep) for ep in eps)
+
+
+def _modules(package):
+    '''Names of the modules (but not the subpackages) of package'''
+    names = set()
+    for directory in package.__path__:
+        if os.path.isdir(directory):
+            for filename in os.listdir(directory):
+                name, ext = os.path.splitext(filename)
+                if ext in ('.py', '.pyc') and name and '.' not in name and name != '__init__':
+                    names.add(name)
+            continue
+        try:
+            # Recorded by sshfdpass.bundle in the archive
+            from sshfdpass._bundled import MODULES
+            names.update(MODULES[package.__name__])
+        except (ImportError, KeyError):
+            import pkgutil
+            names.update(name for loader, name, is_pkg in pkgutil.iter_modules([directory]) if not is_pkg)
+    return names
+
+
+class Registry(dict):
+    '''
+    A dict of plugin instances, which are loaded on first access.
+
+    Attributes
+    ----------
+    package: module
+        The package which contains the builtin plugins
+    classname: str
+        Name of the plugin class inside a plugin module (Test or Action)
+    settings: callable
+        Called with the plugin's name, returns the kwargs to instantiate the plugin with
+
+    Methods
+    -------
+    register(name, factory)
+        Register a factory for a plugin name, eg. for user-defined tests.
+        The factory is called with the plugin's settings as kwargs.
+    names()
+        Set of every known plugin name
+    '''
+    def __init__(self, package, classname, settings=None):
+        dict.__init__(self)
+        self.package = package
+        self.classname = classname
+        self.settings = settings or (lambda name: {})
+        self.factories = dict()
+        self._lock = threading.RLock()
+        self._builtins = None
+        self._entrypoints = None
+
+    @property
+    def group(self):
+        return self.package.__name__
+
+    @property
+    def builtins(self):
+        if self._builtins is None:
+            with sshfdpass.common.trace.phase('plugins', package=self.group):
+                self._builtins = _modules(self.package)
+        return self._builtins
+
+    @property
+    def entrypoints(self):
+        if self._entrypoints is None:
+            self._entrypoints = entry_points(self.group)
+        return self._entrypoints
+
+    def register(self, name, factory):
+        self.factories[name] = factory
+
+    def names(self):
+        return set(self.keys()) | self.builtins | set(self.factories) | set(self.entrypoints)
+
+    def reset(self):
+        '''Forget the instances, so they will be built again with the current settings'''
+        with self._lock:
+            self.clear()
+
+    def _factory(self, name):
+        if name in self.builtins:
+            import importlib
+            module = importlib.import_module('%s.%s'%(self.group, name))
+            return getattr(module, self.classname)
+        if name in self.factories:
+            return self.factories[name]
+        if name in self.entrypoints:
+            plugin = self.entrypoints[name].load()
+            return getattr(plugin, self.classname, plugin)
+        return None
+
+    def __contains__(self, name):
+        return dict.__contains__(self, name) or name in self.builtins or name in self.factories or name in self.entrypoints
+
+    def __missing__(self, name):
+        with self._lock:
+            if dict.__contains__(self, name):
+                return dict.__getitem__(self, name)
+            if name not in self:
+                raise KeyError(name)
+            log.debug('loading %s %s', self.classname, name)
+            with sshfdpass.common.trace.phase('load', kind=self.group.rsplit('.', 1)[-1], plugin=name):
+                instance = self._factory(name)(**self.settings(name))
+            self[name] = instance
+            return instance
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
@@ -0,0 +1,208 @@
+'''
+sshfdpass.common.resolver
+-------------------------
+
+Persistent name resolution cache.
+
+Without it, every ssh invocation pays the resolver round trips of the destination (one per address family),
+which is painful over a VPN with split DNS. The results of getaddrinfo() are kept in a per-user cache file,
+shared by every invocation and the daemon:
+* positive results are reused for ttl seconds. getaddrinfo() doesn't tell the DNS TTL, so it's a setting.
+* names which don't exist (EAI_NONAME, ie. NXDOMAIN) are remembered for negttl seconds.
+  Temporary failures are never cached, and if the resolution fails temporarily, an expired entry
+  is still used for up to maxstale seconds.
+* the whole cache is dropped when the network changes (see sshfdpass.common.netinfo.fingerprint()),
+  eg. after connecting to a VPN, which might have its own view of the names.
+* with refresh enabled, an entry older than refresh * ttl is returned from the cache, and resolved
+  again in the background, so the frequently used names never expire. This is most useful in the daemon.
+IP addresses are never cached, they are converted without any lookup.
+
+The cache file is read with a single read, updated under a lock and replaced atomically with a rename,
+see sshfdpass.common.jsonfile.
+Concurrent invocations missing the same name resolve it only once, see sshfdpass.common.singleflight.
+
+Settings
+--------
+    settings:
+        resolver:
+            cache: yes          # set to no to always call getaddrinfo()
+            file: ~/.ssh/fdpass.dns
+            ttl: 300
+            negttl: 30
+            maxstale: 3600
+            refresh: 0.8        # fraction of the ttl, 0 disables the background refresh
+
+Only the names connected to directly are resolved here (the tcp actions and their host overrides).
+The destination of a jump action is resolved by the jumphost, and the jumphost itself by ssh,
+according to its own config, so those names are passed to ssh as they are.
+'''
+
+import os
+import time
+import socket
+import threading
+import sshfdpass.common
+import sshfdpass.common.iprange
+import sshfdpass.common.jsonfile
+import sshfdpass.common.netinfo
+import sshfdpass.common.parallel
+import sshfdpass.common.singleflight
+
+log = sshfdpass.common.log
+
+DEFAULT_CACHEFILE = '~/.ssh/fdpass.dns'
+CACHE_VERSION = 2
+
+# getaddrinfo() errors meaning the name does not exist
+_NONEXISTENT = tuple(getattr(socket, name) for name in ('EAI_NONAME', 'EAI_NODATA') if hasattr(socket, name))
+
+
+def _hostname(host):
+    '''ASCII names are passed to getaddrinfo() as bytes, so it doesn't need to load the idna codec'''
+    try:
+        return host.encode('ascii')
+    except (UnicodeError, AttributeError):
+        return host
+
+
+def _encode(addrinfos):
+    return [ [ int(family), int(socktype), proto, canonname, list(sockaddr) ]
+            for family, socktype, proto, canonname, sockaddr in addrinfos ]
+
+
+def _decode(entries):
+    return [ (socket.AddressFamily(family) if hasattr(socket, 'AddressFamily') else family,
+        socket.SocketKind(socktype) if hasattr(socket, 'SocketKind') else socktype,
+        proto, canonname, tuple(sockaddr)) for family, socktype, proto, canonname, sockaddr in entries ]
+
+
+class Resolver():
+    '''
+    Resolver
+    --------
+
+    Methods
+    -------
+    configure(self, **settings):
+        Apply the resolver settings, see the module's doc.
+    getaddrinfo(self, host, port, family=0, socktype=socket.SOCK_STREAM):
+        Same as socket.getaddrinfo(), but served from the cache, if possible. Raises socket.gaierror.
+    clear(self):
+        Forget every cached name.
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._file = sshfdpass.common.jsonfile.JSONFile(None, CACHE_VERSION, 'resolver cache',
+                keyed=sshfdpass.common.netinfo.fingerprint)
+        self._refreshing = set()
+        self.configure()
+
+    def configure(self, cache=True, file=DEFAULT_CACHEFILE, ttl=300, negttl=30, maxstale=3600, refresh=0.8, **kwargs):
+        self.enabled = sshfdpass.common.boolean(cache) and bool(file)
+        path = os.path.expanduser(file) if file else None
+        if path != self._file.path:
+            self._file = sshfdpass.common.jsonfile.JSONFile(path, CACHE_VERSION, 'resolver cache',
+                    keyed=sshfdpass.common.netinfo.fingerprint)
+        self.path = path
+        self.ttl = float(ttl)
+        self.negttl = float(negttl)
+        self.maxstale = float(maxstale or 0)
+        self.refresh = float(refresh or 0)
+
+    def _entry(self, key):
+        return self._file.load().get('entries', {}).get(key)
+
+    def _store(self, key, addrinfos, error=None):
+        def store(data):
+            now = time.time()
+            entries = data.setdefault('entries', {})
+            if error is None:
+                entries[key] = dict(resolved=now, expires=now + self.ttl, addrs=_encode(addrinfos))
+            else:
+                entries[key] = dict(resolved=now, expires=now + self.negttl, error=list(error.args))
+            # Expired entries are only kept while they can be served stale
+            for name, entry in list(entries.items()):
+                if entry.get('expires', 0) + self.maxstale < now:
+                    del entries[name]
+        self._file.update(store)
+
+    def _resolve(self, key, host, port, family, socktype):
+        '''The actual lookup, its result is stored in the cache. Returns the addrinfos, or raises socket.gaierror'''
+        try:
+            addrinfos = socket.getaddrinfo(_hostname(host), port, family, socktype)
+        except socket.gaierror as exc:
+            if exc.args and exc.args[0] in _NONEXISTENT:
+                self._store(key, None, exc)
+            raise
+        self._store(key, addrinfos)
+        return addrinfos
+
+    def _fresh(self, key, port):
+        '''The addrinfos of key from the cache, or None if they are not there
+
+        Raises socket.gaierror for a name cached as nonexistent.
+        '''
+        entry = self._entry(key)
+        if entry is None or entry.get('expires', 0) <= time.time():
+            return None
+        if 'error' in entry:
+            raise(socket.gaierror(*entry['error']))
+        return self._with_port(_decode(entry['addrs']), port)
+
+    def _background(self, key, host, port, family, socktype):
+        '''Resolve key again in the background, unless it's already being resolved (by any invocation)'''
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        def refresh():
+            try:
+                sshfdpass.common.singleflight.first('dns:' + key, lambda: self._resolve(key, host, port, family, socktype))
+            except (socket.gaierror, socket.error) as exc:
+                log.debug('background refresh of %s failed: %s', host, exc)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+        sshfdpass.common.parallel.Task(refresh)
+
+    def getaddrinfo(self, host, port, family=0, socktype=socket.SOCK_STREAM):
+        if not self.enabled or sshfdpass.common.iprange.parse_ip(host) is not None:
+            return socket.getaddrinfo(_hostname(host), port, family, socktype)
+        # The port doesn't change the result of the lookup, the cached addresses get the requested one
+        key = '%s|%d|%d'%(host.lower(), int(family), int(socktype))
+        now = time.time()
+        entry = self._entry(key)
+        if entry is not None and entry.get('expires', 0) > now:
+            if 'error' in entry:
+                log.debug('%s is cached as nonexistent', host)
+                raise(socket.gaierror(*entry['error']))
+            if self.refresh and now - entry.get('resolved', 0) > self.refresh * self.ttl:
+                self._background(key, host, port, family, socktype)
+            log.debug('%s resolved from the cache', host)
+            return self._with_port(_decode(entry['addrs']), port)
+        try:
+            # Concurrent invocations resolve the same name only once, see sshfdpass.common.singleflight
+            return sshfdpass.common.singleflight.run('dns:' + key, lambda: self._fresh(key, port),
+                    lambda: self._resolve(key, host, port, family, socktype))
+        except socket.gaierror as exc:
+            if entry is not None and 'addrs' in entry and exc.args and exc.args[0] not in _NONEXISTENT \
+                    and entry.get('expires', 0) + self.maxstale > now:
+                log.info('resolving %s failed (%s), using the expired cache entry', host, exc)
+                return self._with_port(_decode(entry['addrs']), port)
+            raise
+
+    @staticmethod
+    def _with_port(addrinfos, port):
+        port = int(port)
+        return [ (family, socktype, proto, canonname, (sockaddr[0], port) + tuple(sockaddr[2:]))
+                for family, socktype, proto, canonname, sockaddr in addrinfos ]
+
+    def clear(self):
+        self._file.update(lambda data: data.pop('entries', None))
+
+
+_resolver = Resolver()
+
+configure = _resolver.configure
+getaddrinfo = _resolver.getaddrinfo
+clear = _resolver.clear
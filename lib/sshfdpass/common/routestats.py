@@ -0,0 +1,192 @@
+'''
+sshfdpass.common.routestats
+---------------------------
+
+Persistent statistics of the routes, with circuit breaking. They are off by default, see the settings.
+
+A route is a rule used for a destination (host and port). For every route the outcome of its actions
+is recorded: the connect latency as an exponentially weighted moving average, the number of successes
+and failures, and the number of consecutive failures.
+
+Circuit breaker:
+    After `failures` consecutive failures the circuit of the route opens for `cooldown` seconds.
+    While it's open, the route is moved behind every other applicable route, so it's only tried if all of them fail.
+    After the cooldown the next attempt is let through: if it succeeds, the circuit closes,
+    if it fails, the circuit opens again with the double cooldown (at most maxcooldown).
+
+Adaptive ordering:
+    With engine.adaptive enabled, consecutive applicable rules marked with `interchangeable: yes` are
+    reordered by their average latency towards the destination, the fastest first.
+    Routes without statistics go first, so every route gets measured.
+
+The statistics are kept in ~/.ssh/fdpass.routes. It's read without locking (it's always replaced atomically
+with a rename), and updated under an exclusive flock() of a lock file next to it, so concurrent invocations
+don't lose each other's updates, see sshfdpass.common.jsonfile.
+record() only queues the outcome of an attempt, flush() writes the queued ones at once, after the connection
+was passed to ssh. At most maxroutes routes are kept, the least recently used ones are forgotten first.
+
+Settings
+--------
+    settings:
+        routes:
+            enabled: no     # set to yes to record the routes, needed by engine.adaptive and the circuit breaker
+            file: ~/.ssh/fdpass.routes
+            failures: 3
+            cooldown: 60
+            maxcooldown: 900
+            alpha: 0.3      # weight of the newest sample in the average latency
+            maxage: 2592000 # routes unused for this many seconds are forgotten
+            maxroutes: 1000
+'''
+
+import os
+import json
+import time
+import hashlib
+import threading
+import sshfdpass.common
+import sshfdpass.common.jsonfile
+
+log = sshfdpass.common.log
+
+DEFAULT_STATSFILE = '~/.ssh/fdpass.routes'
+STATS_VERSION = 2
+
+
+def route_id(host, port, rule):
+    '''Stable identifier of a rule used for host and port'''
+    content = json.dumps([ str(host), str(port), getattr(rule, 'key', None), rule ], sort_keys=True, default=str)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()[:16]
+
+
+class RouteStats():
+    '''
+    RouteStats
+    ----------
+
+    Methods
+    -------
+    configure(self, **settings):
+        Apply the routes settings, see the module's doc.
+    record(self, host, port, rule, latency=None, error=None):
+        Queue the outcome of an attempt: the latency of a success, or the error of a failure.
+    flush(self):
+        Write the queued outcomes into the stats file.
+    get(self, host, port, rule):
+        The statistics of a route as a dict, or None.
+    is_open(self, host, port, rule):
+        True, if the circuit of the route is open.
+    order(self, host, port, items):
+        Sort the (rule, ...) items by the average latency of their routes.
+    describe(self, host, port, rule):
+        Human readable summary of a route's statistics.
+    '''
+    def __init__(self):
+        self._file = sshfdpass.common.jsonfile.JSONFile(None, STATS_VERSION, 'route statistics')
+        self._lock = threading.Lock()
+        self._pending = []
+        self.configure()
+
+    def configure(self, enabled=False, file=DEFAULT_STATSFILE, failures=3, cooldown=60, maxcooldown=900,
+            alpha=0.3, maxage=30*24*3600, maxroutes=1000, **kwargs):
+        self.enabled = sshfdpass.common.boolean(enabled) and bool(file)
+        path = os.path.expanduser(file) if file else None
+        if path != self._file.path:
+            self._file = sshfdpass.common.jsonfile.JSONFile(path, STATS_VERSION, 'route statistics')
+        self.path = path
+        self.failures = int(failures)
+        self.cooldown = float(cooldown)
+        self.maxcooldown = float(maxcooldown)
+        self.alpha = float(alpha)
+        self.maxage = float(maxage)
+        self.maxroutes = int(maxroutes)
+
+    def _update(self, updates):
+        '''Read-modify-write the stats of the routes, under the lock of the stats file'''
+        def store(data):
+            now = time.time()
+            routes = data.setdefault('routes', {})
+            for routeid, update in updates:
+                update(routes.setdefault(routeid, dict(ok=0, failed=0, consecutive=0)), now)
+            for name, route in list(routes.items()):
+                if route.get('used', now) + self.maxage < now:
+                    del routes[name]
+            if len(routes) > self.maxroutes:
+                for name in sorted(routes, key=lambda name: routes[name].get('used', 0))[:len(routes) - self.maxroutes]:
+                    del routes[name]
+        self._file.update(store)
+
+    def record(self, host, port, rule, latency=None, error=None):
+        if not self.enabled:
+            return
+        def update(route, now):
+            route['used'] = now
+            route['label'] = '%s:%s %s'%(host, port, getattr(rule, 'key', None))
+            if error is None:
+                route['ok'] += 1
+                route['consecutive'] = 0
+                route.pop('open', None)
+                route.pop('cooldown', None)
+                if latency is not None:
+                    ms = latency * 1000
+                    route['ewma'] = ms if route.get('ewma') is None else self.alpha * ms + (1 - self.alpha) * route['ewma']
+            else:
+                route['failed'] += 1
+                route['consecutive'] += 1
+                route['error'] = str(error)
+                if route['consecutive'] >= self.failures:
+                    # A failure after a cooldown doubles the next one
+                    cooldown = min(self.maxcooldown, route['cooldown'] * 2) if route.get('cooldown') else self.cooldown
+                    route['cooldown'] = cooldown
+                    route['open'] = now + cooldown
+                    log.warning('route %s failed %d times in a row, skipping it for %d seconds', route['label'], route['consecutive'], cooldown)
+        with self._lock:
+            self._pending.append((route_id(host, port, rule), update))
+
+    def flush(self):
+        with self._lock:
+            updates = self._pending
+            self._pending = []
+        if not updates or not self.enabled:
+            return
+        try:
+            self._update(updates)
+        except (IOError, OSError) as exc:
+            log.warning('could not update the route statistics: %s', exc)
+
+    def get(self, host, port, rule):
+        if not self.enabled:
+            return None
+        return self._file.load().get('routes', {}).get(route_id(host, port, rule))
+
+    def is_open(self, host, port, rule):
+        route = self.get(host, port, rule)
+        return route is not None and route.get('open', 0) > time.time()
+
+    def order(self, host, port, items):
+        def latency(item):
+            route = self.get(host, port, item[0]) or {}
+            return route.get('ewma') or 0
+        return sorted(items, key=latency)
+
+    def describe(self, host, port, rule):
+        route = self.get(host, port, rule)
+        if route is None:
+            return 'no statistics'
+        ret = '%d ok, %d failed'%(route.get('ok', 0), route.get('failed', 0))
+        if route.get('ewma') is not None:
+            ret += ', average %.1f ms'%(route['ewma'])
+        if route.get('open', 0) > time.time():
+            ret += ', circuit open for %d s'%(route['open'] - time.time())
+        return ret
+
+
+_stats = RouteStats()
+
+configure = _stats.configure
+record = _stats.record
+flush = _stats.flush
+get = _stats.get
+is_open = _stats.is_open
+order = _stats.order
+describe = _stats.describe
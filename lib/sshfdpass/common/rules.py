@@ -0,0 +1,321 @@
+r'''
+sshfdpass.common.rules
+----------------------
+
+Compiled rule index.
+
+The keys of the rules dict can be:
+* an exact host:port or host, as before, eg. `foo:22` or `foo`
+* a host with a port range: `foo:2200-2299`. A range of a single port (`foo:22-22`) is the same as `foo:22`.
+* a destination network in cidr notation, with an optional port or port range:
+  `10.1.0.0/16`, `10.1.0.0/16:22`, `2001:db8::/32` or `[2001:db8::/32]:22`.
+  These match only if ssh was called with an ip address.
+* a glob pattern on the hostname, with an optional port or port range: `*.prod.example.com`, `db?.example.com:5432`
+* a regular expression, if the key starts with ~: `~^(web|app)[0-9]+\.example\.com$`
+  The expression has to match the whole host, or the whole host:port.
+
+Every key matching the host and port contributes its rules, in this order of precedence:
+1. exact host:port
+2. host with a matching port range
+3. exact host
+4. cidr networks, the longest prefix first. With the same prefix, the one with port restriction comes first.
+5. globs of the form *.some.domain, the longest domain first
+6. other globs, in the order of the config
+7. regular expressions, in the order of the config
+8. the unconditional tcp fallback
+
+The index is built once per config. Exact keys are dict lookups, cidr keys are looked up per prefix length,
+*.domain globs are stored in a trie of the reversed domain labels, so matching them doesn't depend on the number of rules.
+Other globs are prefiltered by one combined expression. The regular expressions are prefiltered the same way,
+but only if none of them has groups or inline flags, which would change their meaning in a combined expression
+(or make it invalid), otherwise they are matched one by one.
+
+Every rule is wrapped into a RulePlan, which caches the result of get_action_params(), so the
+action's parameters are only collected once per rule.
+'''
+
+import re
+import socket
+import fnmatch
+import sshfdpass.common
+from sshfdpass.common.iprange import parse_ip, parse_network
+
+log = sshfdpass.common.log
+
+_GLOBCHARS = re.compile(r'[*?\[]')
+
+
+class RulePlan(dict):
+    '''
+    A rule, which remembers its parsed action parameters
+
+    It's still a dict with the rule's content, so it can be used everywhere where a rule can be.
+
+    Parameters
+    ----------
+    rule: dict
+        The rule from the config
+    key: str or None
+        The key of the rules dict, which the rule belongs to. None for the default rule.
+
+    Attributes
+    ----------
+    params: tuple
+        The action, the actionargs and the actionparams, as get_action_params() returns them.
+        Computed on first access.
+    key: str or None
+        The key of the rule
+    '''
+    _params = None
+
+    def __init__(self, rule=(), key=None):
+        dict.__init__(self, rule)
+        self.key = key
+
+    @property
+    def params(self):
+        if self._params is None:
+            import sshfdpass
+            self._params = sshfdpass.get_action_params(self)
+        return self._params
+
+
+DEFAULT_RULE = RulePlan(dict(action='tcp'))
+
+
+def parse_portspec(portspec):
+    '''Convert a port spec into a (low, high) tuple, None for any port, or False if it's not a port spec'''
+    if portspec in (None, '', '*'):
+        return None
+    if portspec.isdigit():
+        return int(portspec), int(portspec)
+    if portspec.count('-') == 1:
+        low, high = portspec.split('-')
+        if low.isdigit() and high.isdigit():
+            return int(low), int(high)
+    return False
+
+
+def split_key(key):
+    '''Split a rule key into host pattern and port spec'''
+    if key.startswith('['):
+        if ']' in key:
+            host, rest = key[1:].split(']', 1)
+            if rest == '':
+                return host, None
+            if rest.startswith(':'):
+                return host, rest[1:]
+        return key, None
+    if key.count(':') == 1:
+        host, portspec = key.split(':')
+        if parse_portspec(portspec) is not False:
+            return host, portspec
+    return key, None
+
+
+def _single_port(portspec):
+    '''The port of portspec in its canonical form, if it's a single port, otherwise None'''
+    ports = parse_portspec(portspec)
+    if ports and ports[0] == ports[1]:
+        return str(ports[0])
+    return None
+
+
+def canonical_key(key):
+    '''The key, with a single port range (foo:22-22) or a port with leading zeros converted to host:port'''
+    if key.startswith('~'):
+        return key
+    host, portspec = split_key(key)
+    port = _single_port(portspec)
+    if port is None or port == portspec or parse_network(host) is not None or _GLOBCHARS.search(host):
+        return key
+    return '[%s]:%s'%(host, port) if ':' in host else '%s:%s'%(host, port)
+
+
+def describe(key):
+    '''Human readable kind of a rule key, see the order of precedence in the module's doc'''
+    if key is None:
+        return 'default rule'
+    if key.startswith('~'):
+        return 'regular expression'
+    host, portspec = split_key(key)
+    ports = parse_portspec(portspec)
+    if parse_network(host) is not None:
+        return 'network'
+    if _GLOBCHARS.search(host):
+        if host.startswith('*.') and not _GLOBCHARS.search(host[2:]):
+            return 'domain glob'
+        return 'glob'
+    if portspec is not None and _single_port(portspec) is None:
+        return 'port range'
+    if portspec is not None:
+        return 'exact host:port'
+    return 'exact host'
+
+
+def _portmatch(ports, port):
+    return ports is None or ports[0] <= port <= ports[1]
+
+
+_PLAIN_FLAGS = re.compile('').flags
+
+
+def _combined(regexes):
+    '''One expression matching whatever any of regexes matches, or None if they can't be combined safely
+
+    Groups would be renumbered (breaking backreferences) or redefined (named groups),
+    and inline flags are either global (invalid in the middle of an expression) or would apply to every alternative.
+    '''
+    for regex in regexes:
+        if regex.groups or regex.flags != _PLAIN_FLAGS or '(?' in regex.pattern:
+            return None
+    try:
+        return re.compile('|'.join('(?:%s)'%(regex.pattern) for regex in regexes))
+    except re.error:
+        return None
+
+
+class RuleIndex():
+    '''
+    Compiled index of the rules
+
+    Parameters
+    ----------
+    rules: dict
+        The rules from the config: key -> list of rules
+    exact: mapping or None
+        If given, exact keys are looked up here instead of in rules. This is used
+        when the exact keys live in an external store, and rules only contains the patterns.
+
+    Methods
+    -------
+    match(self, host, port):
+        List of RulePlans to evaluate for host and port, in the order of precedence.
+    '''
+    def __init__(self, rules, exact=None):
+        self.exact = dict()
+        self.external = exact
+        self.ranges = dict()
+        self.networks = dict()
+        self.suffixes = dict()
+        self.globs = []
+        self.regexes = []
+        self._globfilter = None
+        self._regexfilter = None
+        for key, rulelist in rules.items():
+            self._add(canonical_key(str(key)), [ RulePlan(rule, str(key)) for rule in (rulelist or []) ])
+        if self.globs:
+            self._globfilter = re.compile('|'.join('(?:%s)'%(glob.pattern) for glob, ports, plans in self.globs))
+        if self.regexes:
+            self._regexfilter = _combined([ regex for regex, plans in self.regexes ])
+
+    def _add(self, key, plans):
+        if key.startswith('~'):
+            try:
+                self.regexes.append((re.compile(key[1:]), plans))
+            except re.error as exc:
+                log.warning('invalid regular expression in rule key %s: %s', key, exc)
+            return
+        host, portspec = split_key(key)
+        ports = parse_portspec(portspec)
+        network = parse_network(host)
+        if network is not None:
+            family, bits, addr = network
+            entries = self.networks.setdefault((family, bits), dict()).setdefault(addr, [])
+            entries.append((ports, plans))
+            # Entries with port restriction go first
+            entries.sort(key=lambda entry: entry[0] is None)
+        elif _GLOBCHARS.search(host):
+            if host.startswith('*.') and not _GLOBCHARS.search(host[2:]):
+                node = self.suffixes
+                for label in reversed(host[2:].split('.')):
+                    node = node.setdefault(label, dict())
+                node.setdefault(None, []).append((ports, plans))
+            else:
+                self.globs.append((re.compile(fnmatch.translate(host)), ports, plans))
+        elif portspec is not None and _single_port(portspec) is None:
+            self.ranges.setdefault(host, []).append((ports, plans))
+        elif self.external is None:
+            self.exact.setdefault(key, []).extend(plans)
+
+    def _exact(self, key):
+        if self.external is not None:
+            # The plans of the external keys are built on first use, and kept, like the others
+            plans = self.exact.get(key)
+            if plans is None:
+                plans = [ plan if isinstance(plan, RulePlan) else RulePlan(plan, key) for plan in (self.external.get(key, []) or []) ]
+                self.exact[key] = plans
+            return plans
+        return self.exact.get(key, [])
+
+    def match(self, host, port):
+        port = str(port)
+        portnum = int(port) if port.isdigit() else -1
+        ret = []
+        ret += self._exact('%s:%s'%(host, port))
+        for ports, plans in self.ranges.get(host, []):
+            if _portmatch(ports, portnum):
+                ret += plans
+        ret += self._exact(host)
+        if self.networks:
+            parsed = parse_ip(host)
+            if parsed is not None:
+                family, addr = parsed
+                width = 32 if family == socket.AF_INET else 128
+                for bits in range(width, -1, -1):
+                    table = self.networks.get((family, bits))
+                    if table is None:
+                        continue
+                    mask = ((1 << bits) - 1) << (width - bits)
+                    for ports, plans in table.get(addr & mask, []):
+                        if _portmatch(ports, portnum):
+                            ret += plans
+        if self.suffixes:
+            labels = host.split('.')
+            node = self.suffixes
+            found = []
+            # At least one label has to remain for the *
+            for label in reversed(labels[1:]):
+                node = node.get(label)
+                if node is None:
+                    break
+                found.append(node.get(None, []))
+            for entries in reversed(found):
+                for ports, plans in entries:
+                    if _portmatch(ports, portnum):
+                        ret += plans
+        if self._globfilter is not None and self._globfilter.match(host):
+            for glob, ports, plans in self.globs:
+                if glob.match(host) and _portmatch(ports, portnum):
+                    ret += plans
+        if self.regexes:
+            hostport = '%s:%s'%(host, port)
+            if self._regexfilter is None or self._regexfilter.fullmatch(host) or self._regexfilter.fullmatch(hostport):
+                for regex, plans in self.regexes:
+                    if regex.fullmatch(host) or regex.fullmatch(hostport):
+                        ret += plans
+        ret.append(DEFAULT_RULE)
+        return ret
+
+
+_cache = [ None, None ]
+
+
+def index(rules):
+    '''Return the RuleIndex of rules, building it only once for the same rules dict
+
+    The rules dict must not be changed in place after it was indexed: a new config means a new dict,
+    and the loading of the config calls invalidate() as well.
+    '''
+    if isinstance(rules, RuleIndex):
+        return rules
+    cached_rules, cached_index = _cache
+    if cached_rules is not rules:
+        cached_index = RuleIndex(rules)
+        _cache[:] = [ rules, cached_index ]
+    return cached_index
+
+
+def invalidate():
+    '''Forget the cached index, see index()'''
+    _cache[:] = [ None, None ]
@@ -0,0 +1,223 @@
+'''
+sshfdpass.common.rulestore
+--------------------------
+
+Indexed on-disk rule store for very big configs.
+
+With tens of thousands of hosts in the config, even loading an already parsed config means
+materializing every rule on every invocation, while only the rules of one host are needed.
+`sshfdpass compile` builds a rule store next to the config (fdpass.conf.rules):
+a hash table on disk, which is mmap()-ed, so a lookup touches only a couple of pages of the file:
+* the exact keys (host:port and host) are stored as separate records, looked up by their hash
+* everything else (settings, tests, and the pattern keys: globs, regular expressions, networks,
+  port ranges) is stored in one special record, loaded on every invocation
+So the startup time and the memory usage only depend on the number of pattern keys, not on the number of hosts.
+
+File layout (all integers little endian):
+    header:  magic (8 bytes), version (u32), reserved (u32), number of buckets (u64), reserved (u64)
+    buckets: hash of the key (u64), offset of the record (u64), length of the record (u32), padding (u32)
+             An offset of 0 marks an empty bucket. Collisions are resolved with linear probing.
+    records: [key, value] JSON arrays, utf-8 encoded. A record whose rules were merged from a port range of one port
+             (see sshfdpass.common.rules.canonical_key()) has a third element: the original key of every rule.
+The file is written to a temporary file and renamed into place, so a reader never sees a partial store,
+and the already mapped old store stays valid until it's closed.
+
+The store records the mtime and size of the config it was built from, and it's only used while they match.
+The content is not hashed on every run, because that would cost reading the whole config.
+Reading the store needs json and mmap only: the invocations import json anyway, unlike pickle or hashlib,
+so the keys are hashed with FNV-1a in python, which is fast enough for the couple of keys an invocation looks up.
+A config which can't be represented in JSON is not compiled.
+'''
+
+import os
+import json
+import mmap
+import struct
+import sshfdpass.common
+import sshfdpass.common.config
+
+log = sshfdpass.common.log
+
+MAGIC = b'SFPRULES'
+STORE_VERSION = 2
+# Key of the record holding everything which is not an exact rule key
+META_KEY = '\0config'
+
+_HEADER = struct.Struct('<8sIIQQ')
+_BUCKET = struct.Struct('<QQI4x')
+
+
+store_path = sshfdpass.common.config.store_path
+
+
+_FNV_OFFSET = 0xcbf29ce484222325
+_FNV_PRIME = 0x100000001b3
+_MASK = 0xffffffffffffffff
+
+
+def _hash(key):
+    '''64 bit FNV-1a hash of key'''
+    value = _FNV_OFFSET
+    for byte in bytearray(key.encode('utf-8')):
+        value = ((value ^ byte) * _FNV_PRIME) & _MASK
+    # 0 is reserved for the empty buckets
+    return value or 1
+
+
+def _stamp(stat):
+    return dict(mtime=stat.st_mtime, size=stat.st_size)
+
+
+def is_exact(key):
+    '''True if key is an exact host:port or host key, which can be looked up directly'''
+    import sshfdpass.common.rules
+    return sshfdpass.common.rules.describe(str(key)) in ('exact host', 'exact host:port')
+
+
+def build(conffile, config, stat):
+    '''
+    Write the rule store of conffile from the parsed config
+
+    Parameters
+    ----------
+    conffile: str
+        path of the config file
+    config: dict
+        the parsed config
+    stat: os.stat_result
+        stat of the config file the config was parsed from
+
+    Returns
+    -------
+    str
+        path of the rule store
+    '''
+    rules = config.get('rules') if isinstance(config.get('rules'), dict) else dict()
+    import sshfdpass.common.rules
+    # foo:22-22 is stored as foo:22, together with the rules of foo:22 itself,
+    # the original key of each rule is kept, if there is one which differs from the stored key
+    exact = dict()
+    keys = dict()
+    for key, value in rules.items():
+        if is_exact(key):
+            canonical = sshfdpass.common.rules.canonical_key(str(key))
+            exact.setdefault(canonical, []).extend(value or [])
+            keys.setdefault(canonical, []).extend([ str(key) ] * len(value or []))
+    exact = [ [ key, value ] + ([ keys[key] ] if any(original != key for original in keys[key]) else [])
+            for key, value in exact.items() ]
+    meta = dict(config)
+    meta['rules'] = dict((key, value) for key, value in rules.items() if not is_exact(key))
+    records = [ [ META_KEY, dict(stamp=_stamp(stat), config=meta) ] ] + exact
+    # Serialized before anything is written: a config which is not valid JSON raises here
+    records = [ (record[0], json.dumps(record, separators=(',', ':')).encode('utf-8')) for record in records ]
+    nbuckets = 1
+    while nbuckets < len(records) * 2:
+        nbuckets *= 2
+    table = [ None ] * nbuckets
+    path = store_path(conffile)
+    tmpfile = '%s.%d.tmp'%(path, os.getpid())
+    with open(tmpfile, 'wb') as storefd:
+        storefd.write(_HEADER.pack(MAGIC, STORE_VERSION, 0, nbuckets, 0))
+        storefd.write(b'\0' * (_BUCKET.size * nbuckets))
+        offset = _HEADER.size + _BUCKET.size * nbuckets
+        for key, data in records:
+            storefd.write(data)
+            keyhash = _hash(key)
+            i = keyhash & (nbuckets - 1)
+            while table[i] is not None:
+                i = (i + 1) & (nbuckets - 1)
+            table[i] = (keyhash, offset, len(data))
+            offset += len(data)
+        storefd.seek(_HEADER.size)
+        storefd.write(b''.join(_BUCKET.pack(*(bucket or (0, 0, 0))) for bucket in table))
+    os.rename(tmpfile, path)
+    log.debug('rule store with %d exact keys written to %s', len(exact), path)
+    return path
+
+
+class RuleStore():
+    '''
+    Read access to a rule store
+
+    It behaves like a read-only mapping of the exact rule keys, so it can be given to
+    sshfdpass.common.rules.RuleIndex as its exact parameter.
+
+    Parameters
+    ----------
+    path: str
+        path of the rule store
+
+    Attributes
+    ----------
+    meta: dict
+        The stamp of the source and the config without the exact rules
+
+    Methods
+    -------
+    get(self, key, default=None):
+        The rules of key, or default.
+    close(self):
+        Unmap the store.
+    '''
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as storefd:
+            self._map = mmap.mmap(storefd.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, reserved, self._nbuckets, reserved = _HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != STORE_VERSION:
+            self.close()
+            raise(ValueError('not a rule store of this version'))
+        self.meta = self.get(META_KEY)
+        if not isinstance(self.meta, dict):
+            self.close()
+            raise(ValueError('rule store without config'))
+
+    def get(self, key, default=None):
+        keyhash = _hash(key)
+        mask = self._nbuckets - 1
+        i = keyhash & mask
+        while True:
+            bucket, offset, length = _BUCKET.unpack_from(self._map, _HEADER.size + i * _BUCKET.size)
+            if offset == 0:
+                return default
+            if bucket == keyhash:
+                record = json.loads(self._map[offset:offset + length].decode('utf-8'))
+                if record[0] == key:
+                    if len(record) > 2:
+                        import sshfdpass.common.rules
+                        return [ sshfdpass.common.rules.RulePlan(rule, original) for rule, original in zip(record[1], record[2]) ]
+                    return record[1]
+            i = (i + 1) & mask
+
+    def __getitem__(self, key):
+        value = self.get(key, self)
+        if value is self:
+            raise(KeyError(key))
+        return value
+
+    def __contains__(self, key):
+        return self.get(key, self) is not self
+
+    def __len__(self):
+        return sum(1 for i in range(self._nbuckets)
+                if _BUCKET.unpack_from(self._map, _HEADER.size + i * _BUCKET.size)[1] != 0) - 1
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+
+def open_store(conffile, stat):
+    '''Open the rule store of conffile if it exists and it's up to date, otherwise return None'''
+    try:
+        store = RuleStore(store_path(conffile))
+    except (IOError, OSError):
+        return None
+    except Exception as exc:
+        log.warning('rule store %s is unreadable: %s', store_path(conffile), exc)
+        return None
+    if store.meta.get('stamp') != _stamp(stat):
+        store.close()
+        return None
+    return store
@@ -0,0 +1,189 @@
+'''
+sshfdpass.common.singleflight
+-----------------------------
+
+Coalescing the same work of concurrent invocations.
+
+When lots of ssh sessions are started at once (eg. by ansible), every sshfdpass process would evaluate the same
+tests and resolve the same names at the same moment. With single-flight, only the first one does the work:
+* a result missing from the shared cache (sshfdpass.common.testcache, sshfdpass.common.resolver) is computed
+  under an exclusive flock() of a lock file belonging to it
+* the others find the lock taken, wait for its release, and read the result the first one published
+  to the cache, instead of computing it again
+* if the result is still missing after the wait (the first one failed, eg. timed out, or it's stuck),
+  they compute it themselves, in parallel, so a failing computation doesn't make them queue up
+A lock is released by the kernel when its holder dies, and a stuck holder is not waited for more than
+stale seconds, so a lock can't block the others for long.
+Without fcntl (or if the lock directory is unusable), everything is computed right away.
+
+Settings
+--------
+    settings:
+        singleflight:
+            enabled: yes
+            dir: ~/.ssh/fdpass.flight  # default: $XDG_RUNTIME_DIR/sshfdpass.flight, if there is XDG_RUNTIME_DIR
+            stale: 5                    # seconds to wait for another invocation's result at most
+'''
+
+import os
+import time
+import errno
+import sshfdpass.common
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+log = sshfdpass.common.log
+
+DEFAULT_LOCKDIR = '~/.ssh/fdpass.flight'
+
+# Seconds between two attempts to get a taken lock, doubled up to POLL_MAX
+POLL_MIN = 0.002
+POLL_MAX = 0.05
+
+
+def default_dir():
+    '''The lock directory: under XDG_RUNTIME_DIR (usually a tmpfs), if there is one'''
+    rundir = os.environ.get('XDG_RUNTIME_DIR')
+    if rundir and os.path.isdir(rundir):
+        return os.path.join(rundir, 'sshfdpass.flight')
+    return DEFAULT_LOCKDIR
+
+
+class SingleFlight():
+    '''
+    SingleFlight
+    ------------
+
+    Methods
+    -------
+    configure(self, **settings):
+        Apply the singleflight settings, see the module's doc.
+    run(self, key, lookup, compute, wait=None):
+        The result of lookup(), or if it's None, the result of compute(), computed by only one invocation at a time.
+    first(self, key, compute):
+        compute(), unless another invocation is computing key right now, eg. for background refreshes.
+    '''
+    def __init__(self):
+        self.configure()
+
+    def configure(self, enabled=True, dir=None, stale=5, **kwargs):
+        self.enabled = sshfdpass.common.boolean(enabled) and fcntl is not None
+        self.dir = os.path.expanduser(dir or default_dir())
+        self.stale = float(stale)
+
+    def _path(self, key):
+        return os.path.join(self.dir, sshfdpass.common.digest(key.encode('utf-8')) + '.lock')
+
+    def _open(self, path):
+        try:
+            return os.open(path, os.O_WRONLY | os.O_CREAT, 0o600)
+        except OSError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+        try:
+            os.makedirs(self.dir, 0o700)
+        except OSError as exc:
+            # Created by another invocation meanwhile
+            if exc.errno != errno.EEXIST:
+                raise
+        return os.open(path, os.O_WRONLY | os.O_CREAT, 0o600)
+
+    @staticmethod
+    def _trylock(fd):
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except (IOError, OSError) as exc:
+            if exc.errno in (errno.EAGAIN, errno.EACCES, errno.EWOULDBLOCK):
+                return False
+            raise
+
+    def run(self, key, lookup, compute, wait=None):
+        '''
+        Parameters
+        ----------
+        key: str
+            identifies the result, eg. a cache key
+        lookup: callable
+            returns the published result, or None if there is none
+        compute: callable
+            computes the result and publishes it, so lookup() finds it
+        wait: float or None
+            seconds to wait for another invocation's result at most, the stale setting if None
+
+        Returns
+        -------
+            The result of lookup() or compute()
+        '''
+        if not self.enabled:
+            return compute()
+        path = self._path(key)
+        try:
+            fd = self._open(path)
+        except (IOError, OSError) as exc:
+            log.debug('single-flight lock %s is unusable: %s', path, exc)
+            return compute()
+        try:
+            if self._trylock(fd):
+                # The first one: computes, unless it was published since the caller's lookup
+                try:
+                    result = lookup()
+                    return compute() if result is None else result
+                finally:
+                    try:
+                        os.unlink(path)
+                    except OSError:
+                        pass
+            waited = self._wait(fd, self.stale if wait is None else min(self.stale, max(0, wait)))
+            log.debug('waited %.3f s for the result of %s', waited, key)
+        finally:
+            os.close(fd)
+        result = lookup()
+        return compute() if result is None else result
+
+    def first(self, key, compute):
+        '''compute(), unless another invocation is computing key right now. Returns its result, or None if it was skipped'''
+        if not self.enabled:
+            return compute()
+        path = self._path(key)
+        try:
+            fd = self._open(path)
+        except (IOError, OSError) as exc:
+            log.debug('single-flight lock %s is unusable: %s', path, exc)
+            return compute()
+        try:
+            if not self._trylock(fd):
+                log.debug('%s is being computed by another invocation', key)
+                return None
+            try:
+                return compute()
+            finally:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+        finally:
+            os.close(fd)
+
+    def _wait(self, fd, timeout):
+        '''Wait for the release of the lock on fd, at most timeout seconds'''
+        begin = time.time()
+        delay = POLL_MIN
+        while time.time() - begin < timeout:
+            time.sleep(min(delay, max(0, timeout - (time.time() - begin))))
+            if self._trylock(fd):
+                break
+            delay = min(delay * 2, POLL_MAX)
+        else:
+            log.info('gave up waiting for another invocation after %.1f s', timeout)
+        return time.time() - begin
+
+
+_flight = SingleFlight()
+
+configure = _flight.configure
+run = _flight.run
+first = _flight.first
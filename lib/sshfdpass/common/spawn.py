@@ -0,0 +1,207 @@
+'''
+sshfdpass.common.spawn
+----------------------
+
+Start child processes bound to a socket for the command-like actions.
+
+Forking a python process with a loaded config is slow, and every inheritable fd of the
+process would leak into the child. So the child is started with os.posix_spawn() where it's
+available, with explicit file actions: the socket is duplicated to stdin, stdout and stderr,
+and every other inheritable fd is closed in the child. Fds opened by python are not
+inheritable anyway (PEP 446).
+If posix_spawn is not available, it falls back to fork() and exec(), closing every fd above 2
+in the child.
+
+The child can optionally get its own session (setsid), or its own process group.
+SIGCHLD and SIGPIPE are reset to their defaults in the child: an ignored signal stays ignored across exec(),
+and python ignores SIGPIPE, so without this the child would run with different signal handling than from a shell.
+
+The spawned children are remembered until they are reaped. A long running process (the daemon) calls reap()
+when it gets a SIGCHLD: it reaps only these children with waitpid(), so the exit status of the other children
+(eg. the ones started by the subprocess module) is not stolen from their owners, like with SIGCHLD ignored.
+'''
+
+import os
+import sys
+import signal
+import threading
+import sshfdpass.common
+from sshfdpass.common.deadline import monotonic
+
+log = sshfdpass.common.log
+
+ENGINES = ('auto', 'posix_spawn', 'fork')
+
+# Signals with a default disposition in the children
+DEFAULT_SIGNALS = (signal.SIGCHLD, signal.SIGPIPE)
+
+# The spawned, not yet reaped children
+_children = set()
+_lock = threading.Lock()
+
+
+def inherited_fds():
+    '''List of the inheritable fds above 2'''
+    for fddir in ('/proc/self/fd', '/dev/fd'):
+        try:
+            fds = [ int(fd) for fd in os.listdir(fddir) ]
+            break
+        except (IOError, OSError):
+            continue
+    else:
+        return []
+    ret = []
+    for fd in fds:
+        if fd <= 2:
+            continue
+        try:
+            if os.get_inheritable(fd):
+                ret.append(fd)
+        except (IOError, OSError):
+            pass # The fd of the listdir itself is already closed
+    return ret
+
+
+def _posix_spawn(command, args, fd, setsid, setpgroup):
+    file_actions = [ (os.POSIX_SPAWN_DUP2, fd, 0), (os.POSIX_SPAWN_DUP2, fd, 1), (os.POSIX_SPAWN_DUP2, fd, 2) ]
+    for other in inherited_fds():
+        if other != fd:
+            file_actions.append((os.POSIX_SPAWN_CLOSE, other))
+    if fd > 2:
+        file_actions.append((os.POSIX_SPAWN_CLOSE, fd))
+    kwargs = dict(file_actions=file_actions, setsigdef=DEFAULT_SIGNALS)
+    if setsid:
+        kwargs['setsid'] = True
+    elif setpgroup:
+        kwargs['setpgroup'] = 0
+    return os.posix_spawnp(command, args, os.environ, **kwargs)
+
+
+def _fork(command, args, fd, setsid, setpgroup):
+    pid = os.fork()
+    if pid:
+        return pid
+    try:
+        if setsid:
+            os.setsid()
+        elif setpgroup:
+            os.setpgid(0, 0)
+        for signum in DEFAULT_SIGNALS:
+            signal.signal(signum, signal.SIG_DFL)
+        os.dup2(fd, 0)
+        os.dup2(fd, 1)
+        os.dup2(fd, 2)
+        try:
+            maxfd = os.sysconf('SC_OPEN_MAX')
+        except (ValueError, OSError):
+            maxfd = 1024
+        os.closerange(3, maxfd)
+        os.execvp(command, args)
+    finally:
+        os._exit(127)
+
+
+def spawn(command, args, fd, setsid=False, setpgroup=False, engine='auto'):
+    '''Start command with fd as its stdin, stdout and stderr
+
+    Parameters
+    ----------
+    command: str
+        The command to run, looked up in PATH
+    args: list
+        The argument list, including argv[0]
+    fd: int
+        The fd to bind to the child's stdio
+    setsid: bool
+        Start the child in a new session
+    setpgroup: bool
+        Start the child in a new process group
+    engine: str
+        auto, posix_spawn or fork
+
+    Returns
+    -------
+    int
+        pid of the child
+    '''
+    if engine is None:
+        engine = 'auto'
+    if engine not in ENGINES:
+        raise(ValueError('unknown spawn engine: %s'%(engine)))
+    if engine == 'auto':
+        engine = 'posix_spawn' if hasattr(os, 'posix_spawnp') else 'fork'
+    start = monotonic()
+    if engine == 'posix_spawn':
+        pid = _posix_spawn(command, args, fd, setsid, setpgroup)
+    else:
+        pid = _fork(command, args, fd, setsid, setpgroup)
+    with _lock:
+        _children.add(pid)
+    log.debug('spawned %s with %s as pid %d in %.3f ms', command, engine, pid, (monotonic() - start) * 1000)
+    return pid
+
+
+def reap():
+    '''Reap the spawned children which exited, without blocking. Returns the number of reaped children'''
+    reaped = 0
+    with _lock:
+        for pid in list(_children):
+            try:
+                done, status = os.waitpid(pid, os.WNOHANG)
+            except OSError:
+                done = pid # not our child anymore
+            if done:
+                _children.discard(pid)
+                reaped += 1
+    return reaped
+
+
+def wait(pid):
+    '''Wait for the spawned child pid to exit, and reap it'''
+    with _lock:
+        if pid not in _children:
+            return # already reaped
+        _children.discard(pid)
+    try:
+        os.waitpid(pid, 0)
+    except OSError:
+        pass
+
+
+class ChildSocket():
+    '''
+    Our end of the socket pair connected to a spawned child's stdio
+
+    It can be passed to ssh like a socket, and it knows the child process,
+    so it can be terminated if the connection is not needed.
+
+    Methods
+    -------
+    fileno(self):
+        fileno of the socket
+    close(self):
+        close the socket. The child will get an EOF.
+    terminate(self):
+        close the socket, kill the child (or its process group) and reap it
+    '''
+    def __init__(self, sock, pid, pgroup=False):
+        self.sock = sock
+        self.pid = pid
+        self.pgroup = pgroup
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def close(self):
+        self.sock.close()
+
+    def terminate(self):
+        self.close()
+        try:
+            if self.pgroup:
+                os.killpg(self.pid, signal.SIGTERM)
+            else:
+                os.kill(self.pid, signal.SIGTERM)
+        except (IOError, OSError):
+            pass # Already reaped
+        wait(self.pid)
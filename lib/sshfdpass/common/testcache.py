@@ -0,0 +1,142 @@
+'''
+sshfdpass.common.testcache
+--------------------------
+
+Persistent cache of the test results.
+
+A test remembers its result within the process (see sshfdpass.tests.AbstractTest.evaluate()), but every new
+ssh invocation evaluated its tests again, even if nothing changed since the previous one. The results are
+kept in a per-user cache file, shared by every invocation and the daemon:
+* an entry is keyed on the test's class and a digest of its settings (the target included),
+  so every user-defined test has its own entry
+* the whole cache is dropped when the network changes (see sshfdpass.common.netinfo.fingerprint()),
+  so after a Wi-Fi or VPN switch the tests are evaluated again right away
+* a result is reused for ttl seconds. It can be set per test with the test's cachettl setting,
+  0 turns the caching off for that test:
+    settings:
+        tests:
+            ipv4range:
+                cachettl: 300
+* only complete evaluations are stored: the result of a test which ran out of time,
+  or which was evaluated with overridden parameters, is not cached
+* concurrent invocations missing the same result evaluate the test only once,
+  the others wait for its result, see sshfdpass.common.singleflight
+
+The cache is off by default: a cached result is up to ttl seconds old, even if the network did not change
+in a way the fingerprint notices (eg. a host behind the same gateway went down). It has to be enabled:
+    settings:
+        testcache:
+            enabled: yes
+
+The cache file is compact JSON, read with a single read(), updated under a lock and replaced atomically
+with a rename, see sshfdpass.common.jsonfile.
+
+Settings
+--------
+    settings:
+        testcache:
+            enabled: no
+            file: ~/.ssh/fdpass.tests
+            ttl: 60
+'''
+
+import os
+import json
+import time
+import sshfdpass.common
+import sshfdpass.common.jsonfile
+import sshfdpass.common.netinfo
+import sshfdpass.common.singleflight
+
+log = sshfdpass.common.log
+
+DEFAULT_CACHEFILE = '~/.ssh/fdpass.tests'
+CACHE_VERSION = 2
+
+
+def test_key(test):
+    '''Key of a test instance in the cache: its class and the digest of its settings'''
+    import hashlib
+    content = json.dumps(test.settings, sort_keys=True, default=str)
+    return '%s.%s:%s'%(type(test).__module__, type(test).__name__, hashlib.sha1(content.encode('utf-8')).hexdigest()[:16])
+
+
+class TestCache():
+    '''
+    TestCache
+    ---------
+
+    Methods
+    -------
+    configure(self, **settings):
+        Apply the testcache settings, see the module's doc.
+    ttl(self, test):
+        Seconds to keep the result of test.
+    get(self, test):
+        The cached result of test, or None.
+    put(self, test, result):
+        Store the result of test.
+    evaluate(self, test, evaluate, wait=None):
+        The result of evaluate(), which is expected to put() it. If another invocation is evaluating
+        the same test, its result is awaited for at most wait seconds instead.
+    clear(self):
+        Forget every cached result.
+    '''
+    def __init__(self):
+        self._file = sshfdpass.common.jsonfile.JSONFile(None, CACHE_VERSION, 'test cache',
+                keyed=sshfdpass.common.netinfo.fingerprint)
+        self.configure()
+
+    def configure(self, enabled=False, file=DEFAULT_CACHEFILE, ttl=60, **kwargs):
+        self.enabled = sshfdpass.common.boolean(enabled) and bool(file)
+        path = os.path.expanduser(file) if file else None
+        if path != self._file.path:
+            self._file = sshfdpass.common.jsonfile.JSONFile(path, CACHE_VERSION, 'test cache',
+                    keyed=sshfdpass.common.netinfo.fingerprint)
+        self.path = path
+        self.default_ttl = float(ttl or 0)
+
+    def ttl(self, test):
+        ttl = test.settings.get('cachettl')
+        return self.default_ttl if ttl is None else float(ttl or 0)
+
+    def get(self, test):
+        if not self.enabled or self.ttl(test) <= 0:
+            return None
+        key = test_key(test)
+        entry = self._file.load().get('entries', {}).get(key)
+        if entry is None or entry[1] <= time.time():
+            return None
+        log.debug('result of test %s is cached', key)
+        return entry[0]
+
+    def put(self, test, result):
+        ttl = self.ttl(test)
+        if not self.enabled or ttl <= 0:
+            return
+        key = test_key(test)
+        def store(data):
+            now = time.time()
+            entries = data.setdefault('entries', {})
+            entries[key] = [ bool(result), now + ttl ]
+            for name, entry in list(entries.items()):
+                if entry[1] <= now:
+                    del entries[name]
+        self._file.update(store)
+
+    def evaluate(self, test, evaluate, wait=None):
+        if not self.enabled or self.ttl(test) <= 0:
+            return evaluate()
+        return sshfdpass.common.singleflight.run('test:' + test_key(test), lambda: self.get(test), evaluate, wait)
+
+    def clear(self):
+        self._file.update(lambda data: data.pop('entries', None))
+
+
+_cache = TestCache()
+
+configure = _cache.configure
+get = _cache.get
+put = _cache.put
+evaluate = _cache.evaluate
+clear = _cache.clear
@@ -0,0 +1,160 @@
+'''
+sshfdpass.common.trace
+----------------------
+
+Per-invocation latency tracing.
+
+A Trace records the monotonic timings of the phases of an invocation (loading the config, scanning the plugins,
+matching the rules, every evaluated test and every started action), relative to the start of the invocation.
+The trace being recorded is per thread, and the background tasks of sshfdpass.common.parallel inherit
+the trace of the thread which started them, so the concurrently evaluated tests end up in the right trace.
+Without an active trace, phase() costs a function call and a thread local lookup.
+
+When tracing is enabled, every invocation appends one JSON line to the trace file:
+    settings:
+        trace:
+            enabled: yes
+            file: ~/.ssh/fdpass.trace
+The SSHFDPASS_TRACE environment variable enables it as well (its value is the file, if it's not a boolean).
+`sshfdpass --explain host port` prints the same information in a human readable form.
+'''
+
+import os
+import threading
+from sshfdpass.common.deadline import monotonic
+
+DEFAULT_TRACEFILE = '~/.ssh/fdpass.trace'
+ENVIRONMENT = 'SSHFDPASS_TRACE'
+
+_local = threading.local()
+
+
+class _Phase():
+    '''Context manager recording one phase of a trace'''
+    def __init__(self, trace, name, info):
+        self.trace = trace
+        self.record = dict(phase=name)
+        self.record.update(info)
+
+    def __enter__(self):
+        self.begin = monotonic()
+        return self.record
+
+    def __exit__(self, exctype, exc, tb):
+        end = monotonic()
+        self.record['start'] = round((self.begin - self.trace.start) * 1000, 3)
+        self.record['ms'] = round((end - self.begin) * 1000, 3)
+        if exctype is not None:
+            self.record['error'] = '%s: %s'%(exctype.__name__, exc)
+        self.trace.add(self.record)
+        return False
+
+
+class _NoPhase():
+    '''Context manager used when there is no active trace'''
+    def __enter__(self):
+        return dict()
+
+    def __exit__(self, exctype, exc, tb):
+        return False
+
+_nophase = _NoPhase()
+
+
+class Trace():
+    '''
+    Trace of an invocation
+
+    Parameters
+    ----------
+    start: float or None
+        monotonic() time of the start of the invocation. Now, if not given.
+    info: kwargs
+        Initial values of the trace's info, eg. host and port
+
+    Methods
+    -------
+    phase(self, name, **info):
+        Context manager timing a phase. The dict it returns can be extended with more info in the block.
+    add(self, record):
+        Add a finished record
+    set(self, **info):
+        Set info about the whole invocation, like the selected rule
+    report(self):
+        The trace as a dict
+    write(self, path):
+        Append the trace as one JSON line to path
+    '''
+    def __init__(self, start=None, **info):
+        self.start = monotonic() if start is None else start
+        self.info = dict(pid=os.getpid())
+        self.info.update(info)
+        self.records = []
+        self._lock = threading.Lock()
+
+    def phase(self, name, **info):
+        return _Phase(self, name, info)
+
+    def add(self, record):
+        with self._lock:
+            self.records.append(record)
+
+    def set(self, **info):
+        self.info.update(info)
+
+    def report(self):
+        ret = dict(self.info)
+        ret['total'] = round((monotonic() - self.start) * 1000, 3)
+        with self._lock:
+            ret['phases'] = sorted(self.records, key=lambda record: record.get('start', 0))
+        return ret
+
+    def write(self, path):
+        import json
+        line = json.dumps(self.report(), sort_keys=True, default=str) + '\n'
+        fd = os.open(os.path.expanduser(path), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        try:
+            os.write(fd, line.encode('utf-8'))
+        finally:
+            os.close(fd)
+
+
+def current():
+    '''The active trace of this thread, or None'''
+    return getattr(_local, 'trace', None)
+
+
+def activate(trace):
+    '''Make trace the active trace of this thread. None deactivates the tracing.'''
+    _local.trace = trace
+    return trace
+
+
+def phase(name, **info):
+    '''Time a phase in the active trace, if there is any'''
+    trace = getattr(_local, 'trace', None)
+    if trace is None:
+        return _nophase
+    return trace.phase(name, **info)
+
+
+def annotate(**info):
+    '''Set info in the active trace, if there is any'''
+    trace = getattr(_local, 'trace', None)
+    if trace is not None:
+        trace.set(**info)
+
+
+def tracefile(settings):
+    '''The trace file to write, based on the environment and the trace settings, or None if tracing is disabled'''
+    import sshfdpass.common
+    env = os.environ.get(ENVIRONMENT)
+    if env:
+        if env.lower() in ('yes', 'true', 'on', '1'):
+            return (settings.get('file') if isinstance(settings, dict) else None) or DEFAULT_TRACEFILE
+        if env.lower() in ('no', 'false', 'off', '0'):
+            return None
+        return env
+    if isinstance(settings, dict) and sshfdpass.common.boolean(settings.get('enabled', False)):
+        return settings.get('file') or DEFAULT_TRACEFILE
+    return None
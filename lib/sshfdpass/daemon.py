@@ -0,0 +1,343 @@
+'''
+sshfdpass.daemon
+----------------
+
+An optional resident daemon: sshfdpassd.
+
+Every ssh invocation pays a python interpreter start, the config parsing, the plugin loading and
+the test probes before it could connect anywhere.
+The daemon keeps the parsed config, the instantiated tests and actions and the test results in memory,
+and listens on a per-user unix socket.
+The sshfdpass command first tries to connect to this socket. If the daemon is there, it sends the
+host and port, the daemon evaluates the rules, runs the action and passes the resulting fd back over
+SCM_RIGHTS. The client forwards that fd to ssh the same way as AbstractAction.execute() does.
+If the daemon is not running, does not answer in time, or answers with an error, sshfdpass does
+everything in-process as before.
+The client waits at most CONNECT_TIMEOUT seconds for the daemon to accept the request, and the
+rest of the invocation's deadline (CLIENT_TIMEOUT seconds, as the config is not loaded yet) for the fd.
+
+The socket is $SSHFDPASS_SOCKET if set, otherwise $XDG_RUNTIME_DIR/sshfdpass.sock, or ~/.ssh/fdpass.sock
+if there is no XDG_RUNTIME_DIR.
+
+The daemon checks the config file before every request, and reloads it if it changed.
+The reload is incremental, see sshfdpass.reload_config().
+Cached test results expire after `testttl` seconds, so a network change is noticed:
+    settings:
+        daemon:
+            testttl: 30
+After the expiry the results may still come from the persistent test cache, if it's enabled (see sshfdpass.common.testcache),
+which is dropped as soon as the network changes.
+
+Rules with a prewarm key are served from a pool of pre-warmed connections, see sshfdpass.common.pool.
+The pool counters can be queried with `sshfdpassd --stats`.
+
+The children of the command-like actions are reaped on SIGCHLD by a reaper thread, see sshfdpass.common.spawn.reap().
+SIGCHLD is not ignored, so the other children of the daemon (eg. the ssh control masters started by the jump action)
+still report their exit status.
+
+Protocol
+--------
+The client sends one json line: {"host": "...", "port": "..."}
+The daemon answers with one message: a single zero byte with the fd attached on success,
+or a json object with an error key and no fd attached.
+A {"command": "stats"} request is answered with a json object of the daemon's counters.
+'''
+
+import os
+import sys
+import json
+import time
+import socket
+import threading
+import sshfdpass.common
+import sshfdpass.common.deadline
+import sshfdpass.common.fdpass
+import sshfdpass.common.trace
+from sshfdpass.common.exceptions import *
+
+log = sshfdpass.common.log
+
+# Maximum length of a request line
+MAXREQUEST = 4096
+
+# Seconds between two reaps, even without a SIGCHLD
+REAP_INTERVAL = 5
+
+# Seconds the client waits for the daemon to accept a request
+CONNECT_TIMEOUT = 0.5
+
+# Seconds the client waits for the answer of the daemon, if the caller gives no deadline
+CLIENT_TIMEOUT = 30
+
+
+def socket_path():
+    '''Path of the daemon's unix socket'''
+    path = os.environ.get('SSHFDPASS_SOCKET')
+    if path:
+        return path
+    rundir = os.environ.get('XDG_RUNTIME_DIR')
+    if rundir and os.path.isdir(rundir):
+        return os.path.join(rundir, 'sshfdpass.sock')
+    return os.path.join(os.environ.get('HOME'), '.ssh/fdpass.sock')
+
+
+def client(host, port, path=None, deadline=None):
+    '''Ask the daemon to connect to host and port, and forward the fd to ssh
+
+    Parameters
+    ----------
+    deadline: sshfdpass.common.deadline.Deadline or None
+        The deadline of the invocation. Without one the answer is waited for CLIENT_TIMEOUT seconds.
+
+    Returns
+    -------
+    bool
+        True, if the fd were passed to ssh, False if the daemon is not available or did not answer in time.
+
+    Raises
+    ------
+    sshfdpassDaemonError
+        if the daemon is running, but could not provide a connection.
+    '''
+    if path is None:
+        path = socket_path()
+    remaining = None if deadline is None else deadline.remaining()
+    if remaining is None:
+        remaining = CLIENT_TIMEOUT
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.settimeout(min(CONNECT_TIMEOUT, remaining))
+        s.connect(path)
+    except (IOError, OSError) as exc:
+        s.close()
+        log.debug('no daemon on %s: %s', path, exc)
+        return False
+    try:
+        s.sendall(json.dumps(dict(host=host, port=port)).encode('utf-8') + b'\n')
+        if deadline is not None:
+            remaining = deadline.remaining()
+        s.settimeout(remaining)
+        msg, fd = sshfdpass.common.fdpass.recv_fd(s)
+    except socket.timeout:
+        log.warning('daemon did not answer in time')
+        return False
+    except (IOError, OSError) as exc:
+        log.warning('daemon communication failed: %s', exc)
+        return False
+    finally:
+        s.close()
+    if fd is None:
+        if not msg:
+            log.warning('daemon closed the connection without an answer')
+            return False
+        try:
+            error = json.loads(msg.decode('utf-8')).get('error')
+        except ValueError:
+            error = repr(msg)
+        log.error('daemon error: %s', error)
+        raise(sshfdpassDaemonError(error))
+    try:
+        sshfdpass.common.fdpass.send_fd(sshfdpass.common.fdpass.stdout_socket(), fd)
+    finally:
+        os.close(fd)
+    log.debug('fd received from the daemon passed to ssh')
+    return True
+
+
+class Daemon():
+    '''
+    The resident daemon
+
+    Attributes
+    ----------
+    path: str
+        Path of the listening unix socket
+    conffile: str
+        The config file to watch for changes
+
+    Methods
+    -------
+    serve(self):
+        Load the config, and serve requests forever.
+    handle(self, conn):
+        Serve one client connection. Runs in its own thread.
+    refresh(self):
+        Reload the config if it changed, and expire old test results.
+        The rule store of the old config is closed on a reload.
+    '''
+    def __init__(self, path=None, conffile=None):
+        import sshfdpass.common.config
+        self.path = path or socket_path()
+        self.conffile = conffile or sshfdpass.common.config.DEFAULT_CONFFILE
+        self.lock = threading.Lock()
+        self.stamp = None
+        self.lastreset = time.time()
+        self.pool = None
+
+    def _stamp(self):
+        try:
+            st = os.stat(self.conffile)
+        except (IOError, OSError):
+            return None
+        return (st.st_ino, st.st_mtime, st.st_size)
+
+    def refresh(self):
+        with self.lock:
+            stamp = self._stamp()
+            if stamp != self.stamp:
+                log.info('config changed, reloading')
+                oldstore = getattr(sshfdpass._rules, 'external', None)
+                sshfdpass.reload_config()
+                self.stamp = stamp
+                if oldstore is not None and oldstore is not getattr(sshfdpass._rules, 'external', None):
+                    oldstore.close()
+                # Pooled connections belong to the old rules and action instances
+                self.pool.clear()
+                self.pool.settings.update(sshfdpass._settings.get('pool',{}))
+            ttl = float(sshfdpass._settings.get('daemon',{}).get('testttl', 30))
+            if time.time() - self.lastreset >= ttl:
+                log.debug('expiring cached test results')
+                for test in list(sshfdpass._tests.values()):
+                    test.reset()
+                self.lastreset = time.time()
+
+    def handle(self, conn):
+        trace = None
+        try:
+            request = b''
+            while not request.endswith(b'\n') and len(request) < MAXREQUEST:
+                data = conn.recv(MAXREQUEST)
+                if not data:
+                    break
+                request += data
+            request = json.loads(request.decode('utf-8'))
+            if request.get('command') == 'stats':
+                conn.sendall(json.dumps(dict(pool=self.pool.report())).encode('utf-8'))
+                return
+            host = str(request['host'])
+            port = str(request['port'])
+            log.info('daemon request for host: %s, port: %s', host, port)
+            start = sshfdpass.common.deadline.monotonic()
+            trace = sshfdpass.common.trace.activate(sshfdpass.common.trace.Trace(start, host=host, port=port, daemon=True))
+            with sshfdpass.common.trace.phase('refresh'):
+                self.refresh()
+            retsocket = sshfdpass.connect(host, port, pool=self.pool, deadline=sshfdpass.new_deadline(start))
+            try:
+                with sshfdpass.common.trace.phase('sendfd'):
+                    sshfdpass.common.fdpass.send_fd(conn, retsocket.fileno())
+            finally:
+                retsocket.close()
+        except Exception as exc:
+            log.error('daemon request failed: %s: %s', type(exc).__name__, exc)
+            if trace is not None:
+                trace.set(error='%s: %s'%(type(exc).__name__, exc))
+            try:
+                conn.sendall(json.dumps(dict(error='%s: %s'%(type(exc).__name__, exc))).encode('utf-8'))
+            except (IOError, OSError):
+                pass
+        finally:
+            conn.close()
+            sshfdpass.flush_routes()
+            if trace is not None:
+                sshfdpass.common.trace.activate(None)
+                sshfdpass.write_trace(trace)
+
+    def _listen(self):
+        if os.path.exists(self.path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+            except (IOError, OSError):
+                log.info('removing stale socket %s', self.path)
+                os.unlink(self.path)
+            else:
+                raise(sshfdpassDaemonError('another daemon is listening on %s'%(self.path)))
+            finally:
+                probe.close()
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        oldmask = os.umask(0o077)
+        try:
+            listener.bind(self.path)
+        finally:
+            os.umask(oldmask)
+        listener.listen(128)
+        return listener
+
+    @staticmethod
+    def _reap(children):
+        while True:
+            children.wait(REAP_INTERVAL)
+            children.clear()
+            reaped = sshfdpass.common.spawn.reap()
+            if reaped:
+                log.debug('reaped %d children', reaped)
+
+    def serve(self):
+        # Only the daemon needs these, not the clients importing this module
+        import signal
+        import sshfdpass.common.pool
+        import sshfdpass.common.spawn
+        # Children of the command-like actions should not be left as zombies. The handler only wakes up the
+        # reaper thread, waitpid() is not called from the handler
+        children = threading.Event()
+        signal.signal(signal.SIGCHLD, lambda signum, frame: children.set())
+        reaper = threading.Thread(target=self._reap, args=(children,))
+        reaper.daemon = True
+        reaper.start()
+        # Clean up the socket on termination as well
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        sshfdpass.load_config()
+        self.stamp = self._stamp()
+        self.pool = sshfdpass.common.pool.Pool(**sshfdpass._settings.get('pool',{}))
+        maintainer = threading.Thread(target=self.pool.run)
+        maintainer.daemon = True
+        maintainer.start()
+        listener = self._listen()
+        log.info('sshfdpassd listening on %s', self.path)
+        try:
+            while True:
+                conn, addr = listener.accept()
+                worker = threading.Thread(target=self.handle, args=(conn,))
+                worker.daemon = True
+                worker.start()
+        finally:
+            listener.close()
+            os.unlink(self.path)
+
+
+def stats(path=None):
+    '''Query the counters of the running daemon'''
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(path or socket_path())
+        s.sendall(json.dumps(dict(command='stats')).encode('utf-8') + b'\n')
+        answer = b''
+        while True:
+            data = s.recv(4096)
+            if not data:
+                break
+            answer += data
+    finally:
+        s.close()
+    return json.loads(answer.decode('utf-8'))
+
+
+def main():
+    '''Entry point of sshfdpassd'''
+    import argparse
+    parser = argparse.ArgumentParser(description='Resident daemon for sshfdpass')
+    parser.add_argument('--socket', default=None, help='unix socket to listen on (default: %s)'%(socket_path()))
+    parser.add_argument('--stats', action='store_true', help='print the counters of the running daemon')
+    args = parser.parse_args()
+    if args.stats:
+        print(json.dumps(stats(args.socket), indent=2, sort_keys=True))
+        return 0
+    try:
+        Daemon(path=args.socket).serve()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -10,11 +10,21 @@ It provides an AbstractTest baseclass for your own testclasses.
 It also provides a parse_test() function to parse the tests defined in the config.
 '''
 
+import socket
+import threading
 import sshfdpass.common
+import sshfdpass.common.deadline
+import sshfdpass.common.trace
 from sshfdpass.common.exceptions import *
 
 log = sshfdpass.common.log
 
+# Seconds a test may run, unless its timeout setting says otherwise
+DEFAULT_TIMEOUT = 3
+
+# Result of an evaluation which ran out of time
+TIMEDOUT = object()
+
 class AbstractTest():
     '''
     A class ment to be the base class for all tests.
@@ -46,6 +56,8 @@ class AbstractTest():
         Provide cache for instances. Typical usage ipv4range evaluation: It's enough to find out my own ip once.
     settings: dict
         Settings of this test
+    deadline: sshfdpass.common.deadline.Deadline
+        The deadline of the current evaluation. Tests doing blocking operations should use deadline.timeout() as their timeout.
 
     Methods
     -------
@@ -53,12 +65,16 @@ class AbstractTest():
         class constructor
     settings(self):
         property getter
+    name(self):
+        property, the name of the test's module, like ipv4range
     _evaluate(self, **kwargs)
         This should be redefined in child classes. This is the actual method which gives back the verdict of the test
     _defaults(self)
         This should be redefined in child classes to return a dict with the objects' default settings in case we have to operate with default settings.
     evaluate(self, **kwargs)
         This should be not redefined. This is the wrapper to call _evaluate()
+    reset(self)
+        Forget the cached result, so the next evaluate() will do the actual evaluation again
     '''
     def __init__(self, *args, **kwargs):
         '''
@@ -71,6 +87,8 @@ class AbstractTest():
         '''
         self.result = None
         self.cache = dict()
+        self._lock = threading.Lock()
+        self.deadline = sshfdpass.common.deadline.Deadline()
         self._settings = self._defaults()
         for arg in args:
             if isinstance(self, type(arg)):
@@ -90,21 +108,76 @@ class AbstractTest():
     def _defaults(self):
         return dict()
 
-    def evaluate(self, **kwargs):
+    @property
+    def name(self):
+        '''Name of the test's module, like ipv4range'''
+        return type(self).__module__.rsplit('.', 1)[-1]
+
+    @property
+    def timeout(self):
+        '''The timeout setting of the test'''
+        timeout = self.settings.get('timeout', DEFAULT_TIMEOUT)
+        return None if timeout is None else float(timeout)
+
+    def _timed_evaluate(self, deadline, **kwargs):
+        self.deadline = (deadline or sshfdpass.common.deadline.Deadline()).sub(self.timeout)
+        try:
+            return self._evaluate(**kwargs)
+        except (sshfdpassTimeout, socket.timeout) as exc:
+            log.warning('test %s timed out, considered as false', type(self))
+            return TIMEDOUT
+
+    def evaluate(self, deadline=None, **kwargs):
         '''
         Wrapper to evaluate the test. You can override settings on-demand with kwargs.
         The actual evaluator function should be defined in child classes in the _evaluate() method.
+        The evaluation is limited by the given deadline, and by the test's timeout setting.
+        A test which runs out of time is false, but this result is not cached.
+        The results are also cached across the invocations, see sshfdpass.common.testcache.
         '''
-        log.message('evaluating test %s (%s, %s)'%(type(self), self.settings, kwargs))
-        if kwargs == {}:
-            # If no local override for evaluation and no cached result yet, we should do the actual evaluation
-            if self.result is None:
-                self.result = self._evaluate()
-        else:
-            # In case of casual parameters we won't cache the endresult
-            return self._evaluate(**kwargs)
-        log.message('returning cached value')
-        return self.result
+        from sshfdpass.common import testcache
+        log.debug('evaluating test %s (%s, %s)', type(self), self.settings, kwargs)
+        with sshfdpass.common.trace.phase('test', test=self.name, target=self.settings.get('target')) as record:
+            if kwargs == {}:
+                # If no local override for evaluation and no cached result yet, we should do the actual evaluation
+                # The lock makes parallel evaluations (eg. in the daemon) wait for the first one's result
+                with self._lock:
+                    record['cached'] = self.result is not None
+                    if self.result is None:
+                        self.result = testcache.get(self)
+                        record['persisted'] = self.result is not None
+                    if self.result is None:
+                        def evaluate():
+                            record['persisted'] = False
+                            result = self._timed_evaluate(deadline)
+                            if result is not TIMEDOUT:
+                                testcache.put(self, result)
+                            return result
+                        # Another invocation may be evaluating the same test right now, its result is awaited
+                        # for at most as long as this evaluation could take
+                        record['persisted'] = True
+                        result = testcache.evaluate(self, evaluate,
+                                (deadline or sshfdpass.common.deadline.Deadline()).sub(self.timeout).remaining())
+                        if result is TIMEDOUT:
+                            record['result'] = 'timeout'
+                            return False
+                        self.result = result
+            else:
+                # In case of casual parameters we won't cache the endresult
+                result = self._timed_evaluate(deadline, **kwargs)
+                record['result'] = 'timeout' if result is TIMEDOUT else bool(result)
+                return False if result is TIMEDOUT else result
+            log.debug('returning cached value')
+            record['result'] = bool(self.result)
+            return self.result
+
+    def reset(self):
+        '''
+        Forget the cached result and the instance cache
+        '''
+        with self._lock:
+            self.result = None
+            self.cache = dict()
 
 
 
@@ -147,7 +220,7 @@ def parse_test(testdef, alltests, **kwargs):
 
         A test object. An instance of one descendant of the AbstractTest class.
     '''
-    log.message('parsing test (%s, %s)'%(testdef, kwargs))
+    log.debug('parsing test (%s, %s)', testdef, kwargs)
     if isinstance(testdef, dict):
         if len(testdef.keys()) == 1:
             testname = list(testdef.keys())[0]
@@ -160,10 +233,10 @@ def parse_test(testdef, alltests, **kwargs):
                 else:
                     raise(sshfdpassTargetTypeUnkown)
             else:
-                log.message('debug', 'testname: %s'%(testname))
-                log.message('debug', 'target: %s'%(target))
-                log.message('debug', 'already defined tests: %s'%(alltests))
-                raise(sshfdPassTestUnkown)
+                log.debug('testname: %s', testname)
+                log.debug('target: %s', testvalue)
+                log.debug('already defined tests: %s', alltests)
+                raise(sshfdpassTestUnkown)
         else:
             raise(sshfdpassTestAmbigous)
     elif isinstance(testdef, str):
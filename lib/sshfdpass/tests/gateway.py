@@ -0,0 +1,27 @@
+
+'''
+sshfdpass.tests.gateway
+-----------------------
+
+This test checks if any of the default gateways is one of the targets.
+The targets can be addresses or networks in cidr notation. The routing table is read from the kernel, no packet is sent.
+    tests:
+        home:
+            gateway: 192.168.0.1
+'''
+
+import sshfdpass.tests
+import sshfdpass.common.iprange
+import sshfdpass.common.netinfo
+
+class Test(sshfdpass.tests.AbstractTest):
+    '''
+    gateway test class
+
+    About the purpose, see the module's doc.
+    '''
+    def _evaluate(self, **kwargs):
+        settings = dict()
+        settings.update(self.settings)
+        settings.update(**kwargs)
+        return sshfdpass.common.iprange.PrefixSet(settings.get('target', [])).match_any(sshfdpass.common.netinfo.gateways())
@@ -0,0 +1,36 @@
+
+'''
+sshfdpass.tests.ifaddr
+----------------------
+
+This test checks if any of the local interface addresses (IPv4 or IPv6) falls into the target networks.
+The addresses are read from the kernel, so unlike the probe of ipv4range, it sends no packet at all.
+The optional `interfaces` setting limits the check to the listed interfaces.
+    tests:
+        office:
+            ifaddr:
+                - 10.1.0.0/16
+                - 2001:db8:1::/48
+'''
+
+import sshfdpass.tests
+import sshfdpass.common.iprange
+import sshfdpass.common.netinfo
+
+class Test(sshfdpass.tests.AbstractTest):
+    '''
+    ifaddr test class
+
+    About the purpose, see the module's doc.
+    '''
+    def _defaults(self):
+        return dict(interfaces=None)
+
+    def _evaluate(self, **kwargs):
+        settings = dict()
+        settings.update(self.settings)
+        settings.update(**kwargs)
+        interfaces = settings.get('interfaces')
+        addresses = [ address.split('%')[0] for name, address in sshfdpass.common.netinfo.interfaces()
+                if not interfaces or name in interfaces ]
+        return sshfdpass.common.iprange.PrefixSet(settings.get('target', [])).match_any(addresses)
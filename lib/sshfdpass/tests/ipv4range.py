@@ -3,8 +3,18 @@ sshfdpass.tests.ipv4range
 -------------------------
 
 This specific test finds out if our local ip address is falls into one specific address range.
-Since portability was one of the most important objective during the development, I tried to not do any OS-specific solution here.
-The actual sulution: The test has two parameters: dsthost and dstport.
+How the local address is found, depends on the method setting:
+    probe: the original, most portable solution, see below.
+    route: the source address the kernel would use towards dsthost, found with a connected UDP socket. No packet is sent.
+    local: every local address of the family, read from the kernel (see sshfdpass.common.netinfo). No packet is sent.
+           Every address counts, not only the one used towards dsthost, including the loopback addresses.
+The default is probe, local has to be chosen explicitly:
+    settings:
+        tests:
+            ipv4range:
+                method: local
+
+The probe method: The test has two parameters: dsthost and dstport.
 It establishes a tcp socket connecting to the dsthost and dstport, than gets the local socket of the connection using the getsockname() method.
 The default to connect to is 8.8.8.8:53.
 If you don't want to reveal yourself with these attempts, you might want to override this in the settings, like this:
@@ -16,6 +26,8 @@ If you don't want to reveal yourself with these attempts, you might want to over
 Target of this test is a list if IPv4 networks in cidr notation.
 If the local ip is within any of the targets, then the test evaluates as true.
 Otherwise it evaluates as false.
+The targets are compiled once into sorted address intervals (see sshfdpass.common.iprange),
+so even thousands of target networks are checked with a binary search.
 
 Intended usage as a base test for tests, like this:
     tests:
@@ -28,14 +40,14 @@ Intended usage as a base test for tests, like this:
 import sshfdpass.common
 log = sshfdpass.common.log
 import sshfdpass.tests
+import sshfdpass.common.iprange
+import sshfdpass.common.netinfo
 import socket
 
-# Stackoverflow: https://stackoverflow.com/questions/819355/how-can-i-check-if-an-ip-is-in-a-network-in-python
-# Answer 9, addressInNetwork -> ip_in_range
 def ip_in_range(ip, net):
     '''Helper function to decide if an ip address is within a cidr-defined range or not.
 
-    This solution on stackoverflow seemed pretty portable and nice looking, so I imported here as a helper function
+    Kept for compatibility, the test itself matches against a compiled PrefixSet.
 
     Parameters
     ----------
@@ -49,12 +61,7 @@ def ip_in_range(ip, net):
     bool
         Returns a bool if the IP address is in the given net.
     '''
-    ipaddr = int(''.join([ '%02x' % int(x) for x in ip.split('.') ]), 16)
-    netstr, bits = net.split('/')
-    netaddr = int(''.join([ '%02x' % int(x) for x in netstr.split('.') ]), 16)
-    mask = (0xffffffff << (32 - int(bits))) & 0xffffffff
-    log.message('debug','ip_in_range check(%s, %s): %s'%(ip, net, str(bool((ipaddr & mask) == (netaddr & mask)))))
-    return (ipaddr & mask) == (netaddr & mask)
+    return ip in sshfdpass.common.iprange.PrefixSet([net])
 
 class Test(sshfdpass.tests.AbstractTest):
     '''
@@ -67,7 +74,8 @@ class Test(sshfdpass.tests.AbstractTest):
 
     Attributes
     ----------
-        nothing specific. Just the inherited ones
+    family:
+        The address family of the probe, AF_INET here
 
     Methods
     -------
@@ -77,33 +85,63 @@ class Test(sshfdpass.tests.AbstractTest):
         attribute to store the result.
         If the local address is found once, than it don't have to be guessed again
         upon re-evaluation.
+    localaddrs(self):
+        The list of local addresses to check against the targets. Empty if dsthost is unreachable.
+    targets(self, target):
+        The target networks compiled into a PrefixSet, cached.
     _defaults(self):
-        returns {'dsthost': '8.8.8.8', 'dstport': 53}
+        returns {'dsthost': '8.8.8.8', 'dstport': 53, 'method': 'probe'}
     _evaluate(self, **kwargs):
-        checks if myip() is inside any of the given targets.
+        checks if any of the local addresses is inside any of the given targets.
     '''
+    family = socket.AF_INET
+
     def _defaults(self):
-        return dict(dsthost='8.8.8.8', dstport=53)
+        return dict(dsthost='8.8.8.8', dstport=53, method='probe')
 
     @property
     def myip(self):
         '''simport property getter, detailed description in the Test class' methods'''
         if self.cache.get('myip') == None:
-            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM, 0)
-            s.connect((self.settings.get('dsthost'), self.settings.get('dstport')))
-            myip , myport = s.getsockname()
-            s.close()
+            s = socket.socket(self.family, socket.SOCK_STREAM, 0)
+            try:
+                s.settimeout(self.deadline.timeout())
+                s.connect((self.settings.get('dsthost'), self.settings.get('dstport')))
+                myip = s.getsockname()[0]
+            finally:
+                s.close()
             self.cache['myip'] = myip
             return myip
         else:
             return self.cache.get('myip')
 
+    def localaddrs(self):
+        method = self.settings.get('method')
+        if method == 'local':
+            return sshfdpass.common.netinfo.addresses(self.family)
+        if method == 'route':
+            address = sshfdpass.common.netinfo.route_source(self.settings.get('dsthost'), self.family, int(self.settings.get('dstport')))
+            return [ address ] if address else []
+        try:
+            return [ self.myip ]
+        except socket.timeout:
+            raise
+        except (IOError, OSError) as exc:
+            # eg. there is no route to dsthost, so we don't have an address in this family
+            log.info('no local address found: %s', exc)
+            return []
+
+    def targets(self, target):
+        key = tuple(target)
+        if self.cache.get('targets', (None,))[0] != key:
+            self.cache['targets'] = (key, sshfdpass.common.iprange.PrefixSet(target))
+        return self.cache['targets'][1]
+
     def _evaluate(self, **kwargs):
         settings=dict()
         settings.update(self.settings)
         settings.update(**kwargs)
-        myip = self.myip
-        for i in settings.get('target',[]):
-            if ip_in_range(myip, i):
-                return True
-        return False
+        targets = self.targets(settings.get('target',[]))
+        result = targets.match_any(self.localaddrs())
+        log.debug('local addresses in target: %s', result)
+        return result
@@ -0,0 +1,34 @@
+
+'''
+sshfdpass.tests.ipv6range
+-------------------------
+
+The IPv6 sibling of the ipv4range test.
+It finds out the local IPv6 addresses (with the same methods as ipv4range), and checks if any of them is inside any of the target networks.
+The default to connect to is [2001:4860:4860::8888]:53.
+    settings:
+        tests:
+            ipv6range:
+                dsthost: 2001:db8::1
+                dstport: 80
+
+Intended usage as a base test for tests, like this:
+    tests:
+        lan6:
+            ipv6range:
+                - 2001:db8:1::/48
+'''
+
+import socket
+import sshfdpass.tests.ipv4range
+
+class Test(sshfdpass.tests.ipv4range.Test):
+    '''
+    ipv6range test class
+
+    Everything is inherited from the ipv4range test, only the address family and the defaults differ.
+    '''
+    family = socket.AF_INET6
+
+    def _defaults(self):
+        return dict(dsthost='2001:4860:4860::8888', dstport=53, method='probe')
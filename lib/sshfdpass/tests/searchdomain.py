@@ -0,0 +1,33 @@
+
+'''
+sshfdpass.tests.searchdomain
+----------------------------
+
+This test checks if any of the dns search domains from /etc/resolv.conf matches any of the targets.
+Targets are domain names or glob patterns, compared case insensitively.
+    tests:
+        corp:
+            searchdomain:
+                - corp.example.com
+                - "*.vpn.example.com"
+'''
+
+import fnmatch
+import sshfdpass.tests
+import sshfdpass.common.netinfo
+
+class Test(sshfdpass.tests.AbstractTest):
+    '''
+    searchdomain test class
+
+    About the purpose, see the module's doc.
+    '''
+    def _evaluate(self, **kwargs):
+        settings = dict()
+        settings.update(self.settings)
+        settings.update(**kwargs)
+        for domain in sshfdpass.common.netinfo.searchdomains():
+            for target in settings.get('target', []):
+                if fnmatch.fnmatchcase(domain, str(target).rstrip('.').lower()):
+                    return True
+        return False
@@ -0,0 +1,78 @@
+'''
+sshfdpass.tests.tcpreach
+------------------------
+
+This test checks if the target tcp ports can be connected directly, right now.
+A target is host:port ([address]:port for IPv6 addresses), or a host alone, which means the port setting.
+Every address of every target is connected in parallel, with non-blocking connects in one selector loop
+(see sshfdpass.common.net.probe()), so probing several targets costs as much as probing the slowest one.
+    tests:
+        office:
+            tcpreach:
+                - 10.1.2.1:22
+                - '[2001:db8:1::1]:22'
+
+Settings
+--------
+mode: str
+    any: the test is true if any of the targets is reachable (the probes stop at the first one), all: if every one is.
+    Default: any
+port: int
+    Port of the targets without one. Default: 22
+probetimeout: float
+    Seconds to wait for the connections. An unanswered target is unreachable. Default: 1
+aforder: str
+    Comma separated list of the address families to probe. Default: 6,4
+keep: float
+    The connections of the reachable targets are stashed for this many seconds (0: closed right away),
+    so if the action of the rule connects to one of them (eg. tcp to 10.1.2.1 port 22),
+    it uses the probe's connection instead of connecting again. Default: 10
+cachettl: float
+    Seconds to keep the result in the test cache, if it's enabled (see sshfdpass.common.testcache).
+    A reachability is not worth much later, and a cached result has no stashed connection. Default: 0
+'''
+
+import sshfdpass.tests
+import sshfdpass.common
+import sshfdpass.common.net
+from sshfdpass.common.exceptions import *
+
+log = sshfdpass.common.log
+
+class Test(sshfdpass.tests.AbstractTest):
+    '''
+    tcpreach test class
+
+    About the purpose, see the module's doc.
+    '''
+    def _defaults(self):
+        return dict(mode='any', port=22, probetimeout=1, aforder='6,4', keep=10, cachettl=0)
+
+    def _evaluate(self, **kwargs):
+        settings = dict()
+        settings.update(self.settings)
+        settings.update(**kwargs)
+        mode = settings.get('mode')
+        if mode not in ('any', 'all'):
+            raise(sshfdpassException) # unknown mode
+        targets = [ sshfdpass.common.net.hostport(target, settings.get('port')) for target in settings.get('target', []) ]
+        if not targets:
+            return False
+        timeout = float(settings.get('probetimeout'))
+        remaining = self.deadline.timeout()
+        if remaining is not None:
+            timeout = min(timeout, remaining)
+        if mode == 'any':
+            stop = lambda results: any(results.values())
+        else:
+            stop = lambda results: any(result is False for result in results.values())
+        results = sshfdpass.common.net.probe(targets, sshfdpass.common.net.aflist(settings.get('aforder')), timeout, stop)
+        keep = float(settings.get('keep') or 0)
+        for (host, port), s in results.items():
+            log.debug('target %s:%s is %s', host, port, 'reachable' if s else 'undecided' if s is None else 'unreachable')
+            if s and keep > 0:
+                sshfdpass.common.net.stash(host, port, s, keep)
+            elif s:
+                s.close()
+        reachable = [ bool(s) for s in results.values() ]
+        return any(reachable) if mode == 'any' else all(reachable)
@@ -37,7 +37,8 @@ setup(
             ],
         entry_points={
             "console_scripts": [
-                "sshfdpass = sshfdpass:run"
+                "sshfdpass = sshfdpass:run",
+                "sshfdpassd = sshfdpass.daemon:main",
                 ]
             }
         )
@@ -0,0 +1,52 @@
+'''
+Unit tests of sshfdpass
+
+Run them from the root of the repository with:
+    python -m pytest test
+The package is imported from lib, so it doesn't have to be installed.
+
+The tests never touch the real ~/.ssh or the runtime directory of the user: HOME, XDG_RUNTIME_DIR
+and SSHFDPASS_SOCKET point into a temporary directory before sshfdpass is imported (some of its
+defaults are computed at import time), and every test gets a fresh one of its own.
+'''
+
+import os
+import sys
+import shutil
+import tempfile
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'lib'))
+
+_SESSION_HOME = tempfile.mkdtemp(prefix='sshfdpass-test-')
+
+
+def _isolate(setenv, home):
+    '''Point the environment at home, which gets an empty .ssh and a runtime directory'''
+    os.makedirs(os.path.join(home, '.ssh'), 0o700, exist_ok=True)
+    os.makedirs(os.path.join(home, 'run'), 0o700, exist_ok=True)
+    setenv('HOME', home)
+    setenv('XDG_RUNTIME_DIR', os.path.join(home, 'run'))
+    setenv('SSHFDPASS_SOCKET', os.path.join(home, 'run', 'sshfdpass.sock'))
+
+_isolate(os.environ.__setitem__, _SESSION_HOME)
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(_SESSION_HOME, ignore_errors=True)
+
+
+@pytest.fixture(autouse=True)
+def isolated_home(tmp_path, monkeypatch):
+    '''A HOME of the test's own, and the file backed caches moved into it'''
+    home = str(tmp_path / 'home')
+    _isolate(monkeypatch.setenv, home)
+    from sshfdpass.common import log, netinfo, resolver, routestats, singleflight, testcache
+    monkeypatch.setattr(log, 'path', None)
+    for module in (resolver, routestats, singleflight, testcache):
+        module.configure()
+    netinfo._cache.clear()
+    netinfo._fingerprints = None
+    yield home
+    for module in (resolver, routestats, singleflight, testcache):
+        module.configure()
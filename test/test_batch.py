@@ -0,0 +1,90 @@
+'''Tests of the batch mode (sshfdpass --batch)'''
+
+import os
+import sys
+import json
+import shutil
+import socket
+import tempfile
+import subprocess
+import unittest
+import sshfdpass
+
+LIB = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'lib')
+
+
+class TestPairs(unittest.TestCase):
+    def pairs(self, text):
+        return list(sshfdpass._batch_pairs(text.splitlines()))
+
+    def test_host_port(self):
+        self.assertEqual(self.pairs('foo 22\nbar 2222\n'), [ (1, 'foo', 22, None), (2, 'bar', 2222, None) ])
+
+    def test_hostport(self):
+        self.assertEqual(self.pairs('foo:2222\nbar\n[2001:db8::1]:22\n'),
+                [ (1, 'foo', 2222, None), (2, 'bar', 22, None), (3, '2001:db8::1', 22, None) ])
+
+    def test_comments(self):
+        self.assertEqual(self.pairs('# inventory\n\nfoo 22 # web\n  \n'), [ (3, 'foo', 22, None) ])
+
+    def test_invalid(self):
+        pairs = self.pairs('foo bar baz\nfoo notaport\nok 22\n')
+        self.assertEqual([ (lineno, host, port) for lineno, host, port, error in pairs ],
+                [ (1, 'foo bar baz', None), (2, 'foo notaport', None), (3, 'ok', 22) ])
+        self.assertTrue(pairs[0][3].startswith('invalid line'))
+        self.assertIsNone(pairs[2][3])
+
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self.home = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.home, '.ssh'))
+        config = dict(rules={
+            'good': [ { 'action': 'tcp4', 'tcp4.host': '127.0.0.1' } ],
+            'broken': [ { 'test': { 'tcpreach': [ 'host:notaport' ] }, 'action': 'tcp4' } ],
+            })
+        with open(os.path.join(self.home, '.ssh', 'fdpass.conf'), 'w') as conffd:
+            json.dump(config, conffd)
+
+    def tearDown(self):
+        shutil.rmtree(self.home)
+
+    def batch(self, text, *args):
+        env = dict(os.environ, HOME=self.home, PYTHONPATH=LIB, SSHFDPASS_SOCKET=os.path.join(self.home, 'none'))
+        proc = subprocess.Popen([ sys.executable, '-m', 'sshfdpass', '--batch' ] + list(args), env=env,
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout, stderr = proc.communicate(text.encode('utf-8'))
+        return proc.returncode, [ json.loads(line) for line in stdout.decode('utf-8').splitlines() ]
+
+    def test_order_and_errors(self):
+        status, records = self.batch('good 22\nbroken 22\nnot a pair\ngood 2222\n')
+        self.assertEqual(status, 1)
+        self.assertEqual([ record.get('host', record.get('input')) for record in records ], [ 'good', 'broken', 'not a pair', 'good' ])
+        self.assertEqual(records[0]['action'], 'tcp4')
+        self.assertEqual(records[0]['params'], dict(host='127.0.0.1'))
+        # A failing test is false, its line gets the fallback rule
+        self.assertNotIn('error', records[1])
+        self.assertEqual(records[1]['action'], 'tcp')
+        self.assertTrue(records[2]['error'].startswith('invalid line'))
+        self.assertEqual(records[3]['port'], 2222)
+
+
+    def test_verify(self):
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(16)
+        closed = socket.socket()
+        closed.bind(('127.0.0.1', 0))
+        refused = closed.getsockname()[1]
+        closed.close()
+        try:
+            port = listener.getsockname()[1]
+            status, records = self.batch('good %d\ngood %d\ngood %d\n'%(port, refused, port), '--verify', '-j', '2')
+        finally:
+            listener.close()
+        self.assertEqual(status, 1)
+        self.assertEqual([ record['verified'] for record in records ], [ True, False, True ])
+        self.assertIn('error', records[1])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+'''Tests of the end-to-end benchmark suite in benchmarks/bench.py'''
+
+import io
+import os
+import sys
+import json
+import unittest
+import subprocess
+
+BENCHMARKS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks')
+sys.path.insert(0, BENCHMARKS)
+import bench
+
+
+class TestBench(unittest.TestCase):
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(bench.percentile(values, 50), 50)
+        self.assertEqual(bench.percentile(values, 99), 99)
+        self.assertEqual(bench.percentile([ 7 ], 90), 7)
+        self.assertIsNone(bench.percentile([], 50))
+
+    def test_compare(self):
+        baseline = [ dict(scenario='tcp', rules=10, mode='cold', p50=10.0, p90=12.0, failed=0) ]
+        out = io.StringIO()
+        same = [ dict(baseline[0], p50=11.0) ]
+        self.assertEqual(bench.compare(same, baseline, 1.25, out), 0)
+        slower = [ dict(baseline[0], p50=20.0, failed=1) ]
+        self.assertEqual(bench.compare(slower, baseline, 1.25, out), 2)
+        self.assertIn('REGRESSION tcp/10/cold p50', out.getvalue())
+
+    def test_run(self):
+        # A real, but tiny run: the fds are received from sshfdpass started the way ssh does
+        output = subprocess.check_output([ sys.executable, os.path.join(BENCHMARKS, 'bench.py'), '--rules', '10',
+            '--scenarios', 'tcp,command', '--modes', 'cold', '-n', '2', '--json' ], timeout=60)
+        results = json.loads(output.decode('utf-8'))
+        self.assertEqual([ result['scenario'] for result in results ], [ 'tcp', 'command' ])
+        for result in results:
+            self.assertEqual((result['count'], result['failed']), (2, 0), result.get('error'))
+            self.assertIn('rules', result['phases'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+'''Tests of sshfdpass.bundle: the archive is built, and run like ssh runs it'''
+
+import os
+import sys
+import json
+import socket
+import shutil
+import zipfile
+import tempfile
+import unittest
+import subprocess
+from sshfdpass import bundle
+from sshfdpass.common import fdpass
+
+
+class TestBundle(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.dir = tempfile.mkdtemp()
+        cls.archive = os.path.join(cls.dir, 'sshfdpass.pyz')
+        cls.modules = bundle.build(cls.archive, interpreter=sys.executable)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.dir)
+
+    def setUp(self):
+        self.listener = socket.socket()
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(4)
+        self.listener.settimeout(5)
+        self.port = self.listener.getsockname()[1]
+        self.home = tempfile.mkdtemp(dir=self.dir)
+        os.mkdir(os.path.join(self.home, '.ssh'))
+        with open(os.path.join(self.home, '.ssh', 'fdpass.conf'), 'w') as conffd:
+            json.dump(dict(rules={ 'target.invalid': [ dict(action='tcp4', **{ 'tcp4.host': '127.0.0.1' }) ] }), conffd)
+
+    def tearDown(self):
+        self.listener.close()
+
+    def test_content(self):
+        with zipfile.ZipFile(self.archive) as archive:
+            names = archive.namelist()
+            self.assertTrue(all(info.compress_type == zipfile.ZIP_STORED for info in archive.infolist()))
+        self.assertIn('__main__.py', names)
+        self.assertIn('sshfdpass/_bundled.py', names)
+        self.assertIn('sshfdpass/actions/tcp4.pyc', names)
+        self.assertEqual(len([ name for name in names if name.endswith('.py') ]), self.modules)
+
+    def test_run(self):
+        # Only the archive is on the path, the fd of the connection is passed on stdout
+        env = dict(os.environ, HOME=self.home, SSHFDPASS_SOCKET=os.path.join(self.home, 'nodaemon.sock'))
+        env.pop('PYTHONPATH', None)
+        ours, theirs = socket.socketpair()
+        try:
+            status = subprocess.call([ self.archive, 'target.invalid', str(self.port) ], stdout=theirs, env=env, timeout=30)
+            theirs.close()
+            self.assertEqual(status, 0)
+            msg, fd = fdpass.recv_fd(ours)
+        finally:
+            ours.close()
+            theirs.close()
+        passed = socket.socket(fileno=fd)
+        accepted, address = self.listener.accept()
+        try:
+            passed.sendall(b'hello')
+            self.assertEqual(accepted.recv(5), b'hello')
+        finally:
+            passed.close()
+            accepted.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+'''Tests of sshfdpass.common.config'''
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from sshfdpass.common import config
+
+
+class TestConfig(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.conffile = os.path.join(self.dir, 'fdpass.conf')
+        self.write(dict(settings=dict(a=1), rules={'host': [ dict(action='tcp4') ]}))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, data):
+        with open(self.conffile, 'w') as fd:
+            json.dump(data, fd)
+
+    def test_not_compiled(self):
+        # Without compiling, there is no rule store, and none is written
+        loaded = config.load_config_file(self.conffile)
+        self.assertEqual(loaded['settings'], dict(a=1))
+        self.assertNotIn('rulestore', loaded)
+        self.assertEqual(os.listdir(self.dir), [ 'fdpass.conf' ])
+
+    def test_normalized(self):
+        self.write(dict(settings=[], rules=None))
+        loaded = config.load_config_file(self.conffile, force=True)
+        self.assertEqual((loaded['settings'], loaded['rules']), ({}, {}))
+        loaded = config.read_config(self.conffile, settings={}, rules={})
+        loaded['rulestore'].close()
+        self.assertEqual((loaded['settings'], loaded['rules']), ({}, {}))
+
+    def test_missing(self):
+        settings = dict()
+        config.read_config(os.path.join(self.dir, 'missing'), settings=settings, rules={})
+        self.assertEqual(settings, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
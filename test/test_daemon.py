@@ -0,0 +1,169 @@
+'''Tests of sshfdpass.daemon: a real daemon, and a real client with a socketpair as its stdout, like ssh runs it'''
+
+import os
+import sys
+import json
+import time
+import socket
+import shutil
+import tempfile
+import unittest
+import threading
+import subprocess
+import sshfdpass
+from sshfdpass import daemon
+import sshfdpass.common.pool
+from sshfdpass.common import config, deadline, fdpass
+
+LIB = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'lib')
+
+
+class TestDaemon(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.listener = socket.socket()
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(4)
+        self.listener.settimeout(5)
+        self.port = self.listener.getsockname()[1]
+        self.socket = os.path.join(self.dir, 'sshfdpass.sock')
+        # Only the daemon knows the route: the client's own config is empty
+        self.daemonhome = self.home('daemon', rules={ 'target.invalid': [ dict(action='tcp4', **{ 'tcp4.host': '127.0.0.1' }) ] })
+        self.clienthome = self.home('client')
+        self.daemon = None
+
+    def tearDown(self):
+        if self.daemon is not None:
+            self.daemon.terminate()
+            self.daemon.wait()
+        self.listener.close()
+        shutil.rmtree(self.dir)
+
+    def home(self, name, **config):
+        home = os.path.join(self.dir, name)
+        os.makedirs(os.path.join(home, '.ssh'))
+        with open(os.path.join(home, '.ssh', 'fdpass.conf'), 'w') as conffd:
+            json.dump(config, conffd)
+        return home
+
+    def env(self, home):
+        env = dict(os.environ, HOME=home, SSHFDPASS_SOCKET=self.socket, PYTHONPATH=LIB)
+        env.pop('XDG_RUNTIME_DIR', None)
+        return env
+
+    def start(self):
+        self.daemon = subprocess.Popen([ sys.executable, '-c', 'import sshfdpass.daemon; sshfdpass.daemon.main()' ],
+                env=self.env(self.daemonhome))
+        for attempt in range(100):
+            if os.path.exists(self.socket):
+                return
+            time.sleep(0.05)
+        self.fail('the daemon did not start')
+
+    def invoke(self, host):
+        '''Run sshfdpass like ssh does, returns its exit status and the socket it passed'''
+        ours, theirs = socket.socketpair()
+        try:
+            status = subprocess.call([ sys.executable, '-c', 'import sshfdpass; sshfdpass.run()', host, str(self.port) ],
+                    stdout=theirs, env=self.env(self.clienthome), timeout=30)
+            theirs.close()
+            ours.settimeout(1)
+            try:
+                msg, fd = fdpass.recv_fd(ours)
+            except socket.timeout:
+                fd = None
+            return status, None if fd is None else socket.socket(fileno=fd)
+        finally:
+            ours.close()
+            theirs.close()
+
+    def test_fdpass(self):
+        self.start()
+        status, passed = self.invoke('target.invalid')
+        self.assertEqual(status, 0)
+        self.assertIsNotNone(passed)
+        conn, addr = self.listener.accept()
+        try:
+            passed.sendall(b'SSH-2.0-test\r\n')
+            self.assertEqual(conn.recv(64), b'SSH-2.0-test\r\n')
+        finally:
+            conn.close()
+            passed.close()
+
+    def test_no_daemon(self):
+        self.assertFalse(daemon.client('target.invalid', self.port, path=self.socket))
+
+    def fake_daemon(self, answer=None):
+        '''A daemon accepting one request, and answering it with answer, or never'''
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.socket)
+        listener.listen(1)
+        self.addCleanup(listener.close)
+        def serve():
+            conn, addr = listener.accept()
+            self.addCleanup(conn.close)
+            conn.recv(4096)
+            if answer is not None:
+                conn.sendall(answer)
+                conn.close()
+        server = threading.Thread(target=serve)
+        server.daemon = True
+        server.start()
+
+    def test_hung_daemon(self):
+        self.fake_daemon()
+        begin = time.time()
+        self.assertFalse(daemon.client('target.invalid', self.port, path=self.socket, deadline=deadline.Deadline(0.2)))
+        self.assertLess(time.time() - begin, 5)
+
+    def test_daemon_error(self):
+        self.fake_daemon(json.dumps(dict(error='broken')).encode('utf-8'))
+        self.assertRaises(sshfdpass.sshfdpassDaemonError, daemon.client, 'target.invalid', self.port, path=self.socket)
+
+    def test_daemon_error_falls_back(self):
+        # The client's own config knows the route, the daemon fails
+        self.clienthome = self.daemonhome
+        self.fake_daemon(json.dumps(dict(error='broken')).encode('utf-8'))
+        status, passed = self.invoke('target.invalid')
+        self.assertEqual(status, 0)
+        self.assertIsNotNone(passed)
+        conn, addr = self.listener.accept()
+        conn.close()
+        passed.close()
+
+
+class TestRefresh(unittest.TestCase):
+    def setUp(self):
+        # load_config() reads the default config file of the session's HOME
+        self.conffile = config.DEFAULT_CONFFILE
+        self.write('a')
+        config.load_config_file(self.conffile, force=True)
+        sshfdpass.load_config()
+        self.daemon = daemon.Daemon(path=os.path.join(os.environ['HOME'], 'sshfdpass.sock'), conffile=self.conffile)
+        self.daemon.stamp = self.daemon._stamp()
+        self.daemon.pool = sshfdpass.common.pool.Pool()
+
+    def tearDown(self):
+        store = getattr(sshfdpass._rules, 'external', None)
+        if store is not None:
+            store.close()
+        for path in (self.conffile, config.store_path(self.conffile)):
+            if os.path.exists(path):
+                os.unlink(path)
+
+    def write(self, host):
+        with open(self.conffile, 'w') as conffd:
+            json.dump(dict(rules={ host: [ dict(action='tcp') ] }), conffd)
+
+    def test_old_store_is_closed(self):
+        oldstore = sshfdpass._rules.external
+        self.write('bb')
+        config.load_config_file(self.conffile, force=True)
+        self.daemon.refresh()
+        self.assertIsNone(oldstore._map)
+        self.assertIsNot(sshfdpass._rules.external, oldstore)
+        self.assertIn('bb', sshfdpass._rules.external)
+
+
+if __name__ == '__main__':
+    unittest.main()
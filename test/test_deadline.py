@@ -0,0 +1,38 @@
+'''Tests of sshfdpass.common.deadline'''
+
+import unittest
+from sshfdpass.common import deadline
+from sshfdpass.common.exceptions import sshfdpassTimeout
+
+
+class TestDeadline(unittest.TestCase):
+    def test_unlimited(self):
+        unlimited = deadline.Deadline()
+        self.assertIsNone(unlimited.remaining())
+        self.assertIsNone(unlimited.timeout())
+        self.assertFalse(unlimited.expired())
+
+    def test_remaining(self):
+        limited = deadline.Deadline(10)
+        self.assertTrue(9 < limited.remaining() <= 10)
+        self.assertFalse(limited.expired())
+        self.assertTrue(9 < limited.timeout() <= 10)
+
+    def test_expired(self):
+        expired = deadline.Deadline(1, start=deadline.monotonic() - 2)
+        self.assertEqual(expired.remaining(), 0)
+        self.assertTrue(expired.expired())
+        self.assertRaises(sshfdpassTimeout, expired.timeout)
+
+    def test_sub(self):
+        # A sub-deadline ends by its own timeout, but never later than its parent
+        parent = deadline.Deadline(5)
+        self.assertTrue(parent.sub(1).remaining() <= 1)
+        self.assertTrue(4 < parent.sub(60).remaining() <= 5)
+        self.assertTrue(4 < parent.sub(None).remaining() <= 5)
+        self.assertTrue(0 < deadline.Deadline().sub(1).remaining() <= 1)
+        self.assertIsNone(deadline.Deadline().sub(None).remaining())
+
+
+if __name__ == '__main__':
+    unittest.main()
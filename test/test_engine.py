@@ -0,0 +1,154 @@
+'''Tests of the rule evaluation of sshfdpass, with stand-in tests'''
+
+import time
+import unittest
+import sshfdpass
+import sshfdpass.tests
+import sshfdpass.actions
+from sshfdpass.common.exceptions import sshfdpassActionError
+
+
+class FakeTest(sshfdpass.tests.AbstractTest):
+    '''Answers the result setting after delay seconds, if its deadline lets it, or raises if result is raise'''
+    def _defaults(self):
+        return dict(result=False, delay=0, timeout=5)
+
+    def _evaluate(self, **kwargs):
+        remaining = self.deadline.remaining()
+        if remaining is not None and remaining < self.settings['delay']:
+            time.sleep(remaining)
+            self.deadline.timeout()
+        time.sleep(self.settings['delay'])
+        if self.settings['result'] == 'raise':
+            raise(ValueError('broken test'))
+        return self.settings['result']
+
+
+class FakeAction(sshfdpass.actions.AbstractAction):
+    '''Returns a connection named by the name setting, or fails, if fails is set'''
+    def _keywords(self):
+        return [ 'name', 'fails', 'delay' ]
+
+    def _execute(self, host, port, actionarg=None, kwargs={}):
+        time.sleep(float(kwargs.get('delay', 0)))
+        if kwargs.get('fails'):
+            raise(sshfdpassActionError('%s failed'%(kwargs.get('name'))))
+        return FakeConn(kwargs.get('name'))
+
+
+class FakeConn():
+    def __init__(self, name):
+        self.name = name
+
+    def fileno(self):
+        return 0
+
+    def close(self):
+        pass
+
+
+class EngineTestCase(unittest.TestCase):
+    def setUp(self):
+        self.saved = (sshfdpass._settings, sshfdpass._rules, dict(sshfdpass._tests), dict(sshfdpass._actions))
+        sshfdpass._settings = dict()
+        sshfdpass._actions['fake'] = FakeAction()
+
+    def tearDown(self):
+        sshfdpass._settings, sshfdpass._rules, tests, actions = self.saved
+        sshfdpass._tests.clear()
+        sshfdpass._tests.update(tests)
+        sshfdpass._actions.clear()
+        sshfdpass._actions.update(actions)
+
+    def rules(self, *tests, **settings):
+        '''One rule for every (name, result, delay) test, and a fallback rule without a test'''
+        rules = []
+        for name, result, delay in tests:
+            sshfdpass._tests[name] = FakeTest(result=result, delay=delay, **settings)
+            rules.append({ 'test': name, 'action': 'tcp', 'tcp.host': name })
+        rules.append({ 'action': 'tcp', 'tcp.host': 'fallback' })
+        sshfdpass._rules = { 'host': rules }
+
+    def selected(self, deadline=None):
+        rule, action, actionargs, actionparams = sshfdpass.select_rule('host', 22, deadline)
+        return rule.get('tcp.host')
+
+
+class TestSelect(EngineTestCase):
+    def test_concurrent(self):
+        self.rules(('a', False, 0.3), ('b', False, 0.3), ('c', True, 0.3))
+        start = time.time()
+        self.assertEqual(self.selected(), 'c')
+        self.assertLess(time.time() - start, 0.6)
+
+    def test_priority(self):
+        # A faster test of a lower priority rule doesn't win
+        self.rules(('a', True, 0.2), ('b', True, 0))
+        self.assertEqual(self.selected(), 'a')
+
+    def test_fallback(self):
+        self.rules(('a', False, 0), ('b', False, 0))
+        self.assertEqual(self.selected(), 'fallback')
+
+    def test_sequential(self):
+        sshfdpass._settings = dict(engine=dict(concurrent=False))
+        self.rules(('a', False, 0.2), ('b', True, 0.2))
+        start = time.time()
+        self.assertEqual(self.selected(), 'b')
+        self.assertGreaterEqual(time.time() - start, 0.4)
+
+    def test_broken_test(self):
+        # A test raising an exception is false, the next rules are still evaluated
+        for concurrent in (True, False):
+            sshfdpass._settings = dict(engine=dict(concurrent=concurrent))
+            self.rules(('a', 'raise', 0), ('b', True, 0.1))
+            self.assertEqual(self.selected(), 'b')
+
+
+class TestTimeouts(EngineTestCase):
+    def test_test_timeout(self):
+        # A test running out of its timeout is false, whether it runs in the background or not
+        for concurrent in (True, False):
+            sshfdpass._settings = dict(engine=dict(concurrent=concurrent))
+            self.rules(('a', True, 1), ('b', False, 0), timeout=0.2)
+            start = time.time()
+            self.assertEqual(self.selected(), 'fallback')
+            self.assertLess(time.time() - start, 0.8)
+
+    def test_deadline(self):
+        self.rules(('a', True, 1), ('b', True, 1))
+        start = time.time()
+        self.assertEqual(self.selected(sshfdpass.common.deadline.Deadline(0.2)), 'fallback')
+        self.assertLess(time.time() - start, 0.8)
+
+
+class TestConnect(EngineTestCase):
+    def actions(self, *actions):
+        '''One unconditional rule for every (name, fails, delay) fake action'''
+        sshfdpass._rules = { 'host': [ { 'action': 'fake', 'fake.name': name, 'fake.fails': fails, 'fake.delay': delay }
+            for name, fails, delay in actions ] }
+
+    def test_fall_through(self):
+        # Rules after the first unconditional one are tried, if its action fails
+        self.actions(('a', True, 0), ('b', False, 0))
+        self.assertEqual(sshfdpass.connect('host', 22).name, 'b')
+
+    def test_failed(self):
+        self.actions(('a', True, 0), ('b', True, 0))
+        self.assertRaises(sshfdpassActionError, sshfdpass.connect, 'host', 22)
+
+    def test_race(self):
+        sshfdpass._settings = dict(engine=dict(strategy='race', racecount=2, stagger=0.05))
+        self.actions(('a', False, 0.5), ('b', False, 0))
+        start = time.time()
+        self.assertEqual(sshfdpass.connect('host', 22).name, 'b')
+        self.assertLess(time.time() - start, 0.4)
+
+    def test_race_per_host(self):
+        sshfdpass._settings = dict(engine=dict(hosts=dict(other=dict(strategy='race'))))
+        self.actions(('a', False, 0.3), ('b', False, 0))
+        self.assertEqual(sshfdpass.connect('host', 22).name, 'a')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+'''The modules an invocation served by the daemon, or doing the work itself, imports'''
+
+import os
+import sys
+import json
+import subprocess
+import unittest
+
+LIB = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'lib')
+
+# What run() needs until the daemon answers, see sshfdpass._import_engine()
+ALLOWED = {
+    'sshfdpass', 'sshfdpass.daemon', 'sshfdpass.actions', 'sshfdpass.tests',
+    'sshfdpass.common', 'sshfdpass.common.exceptions', 'sshfdpass.common.logging', 'sshfdpass.common.deadline',
+    'sshfdpass.common.fdpass', 'sshfdpass.common.registry', 'sshfdpass.common.trace',
+}
+
+
+class TestDaemonPath(unittest.TestCase):
+    def test_imports(self):
+        code = 'import sys, json, sshfdpass, sshfdpass.daemon; print(json.dumps(sorted(sys.modules)))'
+        env = dict(os.environ, PYTHONPATH=LIB)
+        modules = set(json.loads(subprocess.check_output([ sys.executable, '-c', code ], env=env).decode('utf-8')))
+        self.assertEqual(set(module for module in modules if module.startswith('sshfdpass')) - ALLOWED, set())
+        for module in ('ctypes', 'hashlib', 'mmap', 'pickle', 'yaml'):
+            self.assertNotIn(module, modules)
+
+
+class TestEnginePath(unittest.TestCase):
+    def test_no_hashlib(self):
+        # The fingerprint, the lock files and the rule store are read without hashlib and pickle
+        code = ('import sys, json, sshfdpass; sshfdpass._import_engine(); '
+                'from sshfdpass.common import netinfo, rulestore, singleflight; '
+                'netinfo._quickstate(); singleflight._flight._path("key"); rulestore._hash("host"); '
+                'print(json.dumps(sorted(sys.modules)))')
+        env = dict(os.environ, PYTHONPATH=LIB)
+        modules = set(json.loads(subprocess.check_output([ sys.executable, '-c', code ], env=env).decode('utf-8')))
+        for module in ('hashlib', '_hashlib', 'pickle'):
+            self.assertNotIn(module, modules)
+
+
+if __name__ == '__main__':
+    unittest.main()
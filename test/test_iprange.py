@@ -0,0 +1,52 @@
+'''Tests of sshfdpass.common.iprange'''
+
+import socket
+import unittest
+from sshfdpass.common import iprange
+
+
+class TestParse(unittest.TestCase):
+    def test_parse_ip(self):
+        self.assertEqual(iprange.parse_ip('10.0.0.1'), (socket.AF_INET, 0x0a000001))
+        self.assertEqual(iprange.parse_ip('::1'), (socket.AF_INET6, 1))
+        self.assertIsNone(iprange.parse_ip('example.com'))
+        self.assertIsNone(iprange.parse_ip('10.0.0.256'))
+
+    def test_parse_network(self):
+        # The host bits are masked
+        self.assertEqual(iprange.parse_network('10.1.2.3/8'), (socket.AF_INET, 8, 0x0a000000))
+        self.assertEqual(iprange.parse_network('2001:db8::1/32'), (socket.AF_INET6, 32, 0x20010db8 << 96))
+        for invalid in ('10.0.0.0', '10.0.0.0/33', '10.0.0.0/x', '10.0.0.0/8/8', 'host/8', '::/129'):
+            self.assertIsNone(iprange.parse_network(invalid), invalid)
+
+
+class TestPrefixSet(unittest.TestCase):
+    def test_contains(self):
+        prefixes = iprange.PrefixSet([ '192.168.0.0/24', '10.0.0.0/8', '2001:db8::/32', '172.16.0.1' ])
+        for address in ('192.168.0.0', '192.168.0.255', '10.255.255.255', '2001:db8:ffff::1', '172.16.0.1'):
+            self.assertIn(address, prefixes)
+        for address in ('192.168.1.0', '11.0.0.0', '9.255.255.255', '2001:db9::', '172.16.0.2', '::ffff:10.0.0.1', 'host'):
+            self.assertNotIn(address, prefixes)
+        self.assertIn((socket.AF_INET, 0x0a000001), prefixes)
+
+    def test_merged(self):
+        # Overlapping and adjacent networks are merged into one interval
+        prefixes = iprange.PrefixSet([ '10.0.1.0/24', '10.0.0.0/24', '10.0.0.128/25', '10.0.3.0/24' ])
+        self.assertEqual(len(prefixes.starts[socket.AF_INET]), 2)
+        self.assertIn('10.0.1.255', prefixes)
+        self.assertNotIn('10.0.2.0', prefixes)
+        self.assertIn('10.0.3.0', prefixes)
+
+    def test_invalid(self):
+        prefixes = iprange.PrefixSet([ 'nonsense', '10.0.0.0/40', '10.0.0.0/8' ])
+        self.assertIn('10.1.1.1', prefixes)
+        self.assertFalse(iprange.PrefixSet([]).match_any([ '10.1.1.1' ]))
+
+    def test_match_any(self):
+        prefixes = iprange.PrefixSet([ '10.0.0.0/8' ])
+        self.assertTrue(prefixes.match_any([ '192.168.0.1', '10.0.0.1' ]))
+        self.assertFalse(prefixes.match_any([ '192.168.0.1', 'fe80::1' ]))
+
+
+if __name__ == '__main__':
+    unittest.main()
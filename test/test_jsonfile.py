@@ -0,0 +1,78 @@
+'''Tests of sshfdpass.common.jsonfile'''
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from sshfdpass.common import jsonfile
+
+
+class TestJSONFile(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'cache')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_missing(self):
+        self.assertEqual(jsonfile.JSONFile(self.path, 1).load(), {})
+
+    def test_update(self):
+        first = jsonfile.JSONFile(self.path, 1)
+        self.assertEqual(first.update(lambda data: data.setdefault('a', 1)), 1)
+        with open(self.path) as fd:
+            self.assertEqual(json.load(fd), dict(version=1, data=dict(a=1)))
+        second = jsonfile.JSONFile(self.path, 1)
+        second.update(lambda data: data.update(b=2))
+        # The first instance sees the change of the other one, and doesn't lose it on its next update
+        self.assertEqual(first.load(), dict(a=1, b=2))
+        first.update(lambda data: data.update(c=3))
+        self.assertEqual(second.load(), dict(a=1, b=2, c=3))
+
+    def test_other_version(self):
+        jsonfile.JSONFile(self.path, 1).update(lambda data: data.update(a=1))
+        self.assertEqual(jsonfile.JSONFile(self.path, 2).load(), {})
+
+    def test_unreadable(self):
+        with open(self.path, 'w') as fd:
+            fd.write('{not json')
+        self.assertEqual(jsonfile.JSONFile(self.path, 1).load(), {})
+
+    def test_keyed(self):
+        state = [ 'home' ]
+        cache = jsonfile.JSONFile(self.path, 1, keyed=lambda: state[0])
+        cache.update(lambda data: data.update(a=1))
+        self.assertEqual(cache.load().get('a'), 1)
+        state[0] = 'office'
+        self.assertNotIn('a', cache.load())
+        self.assertEqual(jsonfile.JSONFile(self.path, 1, keyed=lambda: state[0]).load(), dict(state='office'))
+
+    def test_memory(self):
+        cache = jsonfile.JSONFile(None, 1)
+        cache.update(lambda data: data.update(a=1))
+        self.assertEqual(cache.load(), dict(a=1))
+        self.assertEqual(os.listdir(self.dir), [])
+
+    def test_concurrent_updates(self):
+        '''Concurrent processes don't lose each other's updates'''
+        cache = jsonfile.JSONFile(self.path, 1)
+        pids = []
+        for worker in range(4):
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    child = jsonfile.JSONFile(self.path, 1)
+                    for i in range(25):
+                        child.update(lambda data: data.update({ '%d.%d'%(worker, i): True }))
+                finally:
+                    os._exit(0)
+            pids.append(pid)
+        for pid in pids:
+            os.waitpid(pid, 0)
+        self.assertEqual(len(cache.load()), 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
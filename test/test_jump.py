@@ -0,0 +1,97 @@
+'''Tests of the control master handling of sshfdpass.actions.jump, with a stand-in for ssh'''
+
+import os
+import shutil
+import tempfile
+import unittest
+from sshfdpass.actions import jump
+
+# Logs its arguments, and exits with the status in the file named by FAKESSH_STATUS (or sleeps, if it's "hang")
+FAKESSH = '''#!/bin/sh
+echo "$@" >> "$FAKESSH_LOG"
+status=$(cat "$FAKESSH_STATUS")
+[ "$status" = hang ] && exec sleep 30
+exit $status
+'''
+
+
+class TestControlMaster(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        bindir = os.path.join(self.dir, 'bin')
+        os.mkdir(bindir)
+        with open(os.path.join(bindir, 'ssh'), 'w') as sshfd:
+            sshfd.write(FAKESSH)
+        os.chmod(os.path.join(bindir, 'ssh'), 0o755)
+        self.log = os.path.join(self.dir, 'log')
+        self.status = os.path.join(self.dir, 'status')
+        self.saved = dict((name, os.environ.get(name)) for name in ('PATH', 'FAKESSH_LOG', 'FAKESSH_STATUS'))
+        os.environ.update(PATH=bindir + os.pathsep + os.environ['PATH'], FAKESSH_LOG=self.log, FAKESSH_STATUS=self.status)
+        self.action = jump.Action(controldir=self.dir)
+        self.controlpath = self.action._controlpath([ 'jumphost' ], {})
+
+    def tearDown(self):
+        for name, value in self.saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        shutil.rmtree(self.dir)
+
+    def answer(self, status):
+        with open(self.status, 'w') as statusfd:
+            statusfd.write(str(status))
+        # The control socket only has to exist, the stand-in answers for the master
+        open(self.controlpath, 'w').close()
+
+    def calls(self):
+        if not os.path.exists(self.log):
+            return []
+        with open(self.log) as logfd:
+            return logfd.read().splitlines()
+
+    def test_controlpath(self):
+        self.assertNotEqual(self.controlpath, self.action._controlpath([ 'other' ], {}))
+        self.assertEqual(os.path.dirname(self.controlpath), self.dir)
+
+    def test_missing(self):
+        self.assertFalse(self.action._master_alive(self.controlpath, {}))
+        self.assertEqual(self.calls(), [])
+
+    def test_alive(self):
+        self.answer(0)
+        self.assertTrue(self.action._master_alive(self.controlpath, {}))
+        self.assertEqual(self.calls(), [ '-o ControlPath=%s -O check fdpass-cm'%(self.controlpath) ])
+
+    def test_dead(self):
+        self.answer(255)
+        self.assertFalse(self.action._master_alive(self.controlpath, {}))
+        self.assertFalse(os.path.exists(self.controlpath))
+        self.assertEqual(len(self.calls()), 1)
+
+    def test_hung(self):
+        self.answer('hang')
+        self.assertFalse(self.action._master_alive(self.controlpath, dict(timeout=0.2)))
+        self.assertFalse(os.path.exists(self.controlpath))
+        # The stuck master is told to exit before its socket is removed
+        self.assertEqual([ call.split()[3] for call in self.calls() ], [ 'check', 'exit' ])
+
+    def test_too_old(self):
+        self.answer(0)
+        os.utime(self.controlpath, (0, 0))
+        self.assertFalse(self.action._master_alive(self.controlpath, dict(controlmaxage=60)))
+        self.assertEqual([ call.split()[3] for call in self.calls() ], [ 'check', 'stop' ])
+
+
+    def test_start(self):
+        with open(self.status, 'w') as statusfd:
+            statusfd.write('0')
+        self.action._ensure_master(self.controlpath, [ 'first', 'jumphost' ], {})
+        call = self.calls()[0].split()
+        self.assertEqual(call[:2], [ '-f', '-N' ])
+        self.assertIn('ControlPath=%s'%(self.controlpath), call)
+        self.assertEqual(call[-3:], [ '-J', 'first', 'jumphost' ])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+'''Tests of sshfdpass.common.logging'''
+
+import os
+import shutil
+import tempfile
+import unittest
+import sshfdpass.common
+from sshfdpass.common import logging
+
+
+class TestLogger(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'fdpass.log')
+        self.saved = os.environ.pop(logging.ENVIRONMENT, None)
+        self.logger = logging.Logger()
+
+    def tearDown(self):
+        self.logger._close()
+        if self.saved is not None:
+            os.environ[logging.ENVIRONMENT] = self.saved
+        shutil.rmtree(self.dir)
+
+    def lines(self, path=None):
+        with open(path or self.path) as logfd:
+            return [ line.split(' ', 3)[3] for line in logfd.read().splitlines() ]
+
+    def test_level(self):
+        self.logger.configure(level='warning', file=self.path)
+        self.logger.debug('debug %s', 1)
+        self.logger.info('info')
+        self.logger.warning('warning %s', 2)
+        self.logger.error('error')
+        self.assertEqual(self.lines(), [ 'warning: warning 2', 'error: error' ])
+
+    def test_not_formatted(self):
+        # Disabled levels don't even format their arguments
+        self.logger.configure(level='info', file=self.path)
+        self.logger.debug('%s %s', 'too few')
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_environment(self):
+        os.environ[logging.ENVIRONMENT] = 'debug'
+        self.logger.configure(level='error', file=self.path)
+        self.assertTrue(self.logger.enabled('debug'))
+
+    def test_message(self):
+        self.logger.configure(level='debug', file=self.path)
+        self.logger.message('info', 'first', 'second')
+        self.logger.message('single')
+        self.assertEqual(self.lines(), [ 'info: first', 'info: second', 'debug: single' ])
+
+    def test_rotate(self):
+        self.logger.configure(level='info', file=self.path, maxsize=100, backups=2)
+        for i in range(10):
+            self.logger.info('record number %d of the rotation test', i)
+        self.assertTrue(os.path.exists(self.path + '.1'))
+        self.assertTrue(os.path.exists(self.path + '.2'))
+        self.assertFalse(os.path.exists(self.path + '.3'))
+        self.assertLessEqual(os.path.getsize(self.path + '.1'), 200)
+        # The last record might have rotated the logfile itself
+        current = self.lines() if os.path.exists(self.path) else self.lines(self.path + '.1')
+        self.assertEqual(current[-1], 'info: record number 9 of the rotation test')
+
+    def test_journald_field(self):
+        self.assertEqual(logging.journald_field('MESSAGE', 'hello'), b'MESSAGE=hello\n')
+        self.assertEqual(logging.journald_field('MESSAGE', 'a\nb'), b'MESSAGE\n\x03\x00\x00\x00\x00\x00\x00\x00a\nb\n')
+
+
+class TestRedact(unittest.TestCase):
+    def test_redact(self):
+        rule = { 'action': 'socks5', 'socks5.password': 'secret', 'headers': { 'Proxy-Authorization': 'Basic x' },
+                'test': [ { 'token': 't' } ] }
+        self.assertEqual(sshfdpass.common.redact(rule), { 'action': 'socks5', 'socks5.password': '***',
+                'headers': { 'Proxy-Authorization': '***' }, 'test': [ { 'token': '***' } ] })
+        self.assertEqual(str(sshfdpass.common.Redacted(dict(password='secret'))), "{'password': '***'}")
+        self.assertEqual(sshfdpass.common.redact('plain'), 'plain')
+
+
+if __name__ == '__main__':
+    unittest.main()
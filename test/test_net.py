@@ -0,0 +1,152 @@
+'''Tests of sshfdpass.common.net'''
+
+import time
+import socket
+import threading
+import unittest
+from sshfdpass.common import net, resolver
+from sshfdpass.actions import tcp
+from sshfdpass.common.exceptions import sshfdpassException, sshfdpassActionError
+
+
+def addrinfo(port, host='127.0.0.1'):
+    return (socket.AF_INET, socket.SOCK_STREAM, 6, '', (host, port))
+
+
+class TestRace(unittest.TestCase):
+    def setUp(self):
+        self.listener = socket.socket()
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(4)
+        self.port = self.listener.getsockname()[1]
+        # A port nobody listens on: connecting to it is refused right away
+        closed = socket.socket()
+        closed.bind(('127.0.0.1', 0))
+        self.refused = closed.getsockname()[1]
+        closed.close()
+
+    def tearDown(self):
+        self.listener.close()
+
+    def test_interleave(self):
+        self.assertEqual(net.interleave([ [ 'a1', 'a2', 'a3' ], [], [ 'b1' ] ]), [ 'a1', 'b1', 'a2', 'a3' ])
+
+    def test_race(self):
+        # A refused attempt starts the next one right away, without waiting for the attempt delay
+        s = net.race([ addrinfo(self.refused), addrinfo(self.port) ], delay=5, timeout=2)
+        self.assertIsNotNone(s)
+        self.assertEqual(s.getpeername(), ('127.0.0.1', self.port))
+        self.assertTrue(s.getblocking())
+        s.close()
+
+    def test_race_failed(self):
+        self.assertIsNone(net.race([ addrinfo(self.refused) ], delay=0.1, timeout=2))
+
+    def test_happyeyeballs(self):
+        s = tcp.Action(happyeyeballs=True, aforder='6,4')._execute('localhost', self.port)
+        self.assertEqual(s.getpeername()[1], self.port)
+        s.close()
+
+
+class TestSequential(unittest.TestCase):
+    '''The tcp action without happyeyeballs tries the addresses one by one'''
+    def setUp(self):
+        self.listener = socket.socket()
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(4)
+        self.port = self.listener.getsockname()[1]
+        # A listener with a full backlog: the SYNs are dropped, connecting to it times out
+        self.hung = socket.socket()
+        self.hung.bind(('127.0.0.1', 0))
+        self.hung.listen(0)
+        self.fillers = []
+        for i in range(3):
+            filler = socket.socket()
+            filler.setblocking(False)
+            filler.connect_ex(self.hung.getsockname())
+            self.fillers.append(filler)
+        time.sleep(0.05)
+        self.saved = resolver.getaddrinfo
+        self.addrinfos = []
+        resolver.getaddrinfo = lambda host, port, family, socktype: list(self.addrinfos)
+
+    def tearDown(self):
+        resolver.getaddrinfo = self.saved
+        for filler in self.fillers:
+            filler.close()
+        self.hung.close()
+        self.listener.close()
+
+    def test_timeout_continues(self):
+        self.addrinfos = [ addrinfo(self.hung.getsockname()[1]), addrinfo(self.port) ]
+        start = time.time()
+        s = tcp.Action(aforder='4')._execute('example.invalid', self.port, kwargs=dict(timeout=1))
+        try:
+            self.assertEqual(s.getpeername(), ('127.0.0.1', self.port))
+            # The first attempt only got its share of the budget
+            self.assertLess(time.time() - start, 0.9)
+        finally:
+            s.close()
+
+    def test_all_timed_out(self):
+        self.addrinfos = [ addrinfo(self.hung.getsockname()[1]) ] * 2
+        start = time.time()
+        self.assertRaises(socket.timeout, tcp.Action(aforder='4')._execute, 'example.invalid', self.port, kwargs=dict(timeout=0.4))
+        self.assertLess(time.time() - start, 1)
+
+
+class TestHostPort(unittest.TestCase):
+    def test_hostport(self):
+        self.assertEqual(net.hostport('host:2222'), ('host', 2222))
+        self.assertEqual(net.hostport(' host ', 22), ('host', 22))
+        self.assertEqual(net.hostport('[2001:db8::1]:2222', 22), ('2001:db8::1', 2222))
+        self.assertEqual(net.hostport('[2001:db8::1]', 22), ('2001:db8::1', 22))
+        self.assertEqual(net.hostport('2001:db8::1', 22), ('2001:db8::1', 22))
+        self.assertRaises(sshfdpassException, net.hostport, 'host')
+        self.assertRaises(ValueError, net.hostport, 'host:ssh')
+
+
+class TestRecv(unittest.TestCase):
+    def setUp(self):
+        self.ours, self.theirs = socket.socketpair()
+        self.ours.settimeout(5)
+
+    def tearDown(self):
+        self.ours.close()
+        self.theirs.close()
+
+    def test_recvexact(self):
+        self.theirs.sendall(b'abcdef')
+        self.assertEqual(net.recvexact(self.ours, 4), b'abcd')
+        self.assertEqual(net.recvexact(self.ours, 2), b'ef')
+        self.theirs.sendall(b'gh')
+        self.theirs.shutdown(socket.SHUT_WR)
+        self.assertRaises(sshfdpassActionError, net.recvexact, self.ours, 3)
+
+    def test_recvuntil(self):
+        # The data after the delimiter is left in the socket
+        self.theirs.sendall(b'HTTP/1.1 200 OK\r\n\r\nSSH-2.0-banner\r\n')
+        self.assertEqual(net.recvuntil(self.ours, b'\r\n\r\n'), b'HTTP/1.1 200 OK\r\n\r\n')
+        self.assertEqual(net.recvexact(self.ours, 7), b'SSH-2.0')
+
+    def test_recvuntil_split(self):
+        # The delimiter arrives in pieces, its first part is read as data before the rest arrives
+        self.theirs.sendall(b'header\r\n\r')
+        later = threading.Timer(0.1, self.theirs.sendall, (b'\nrest',))
+        later.start()
+        self.assertEqual(net.recvuntil(self.ours, b'\r\n\r\n'), b'header\r\n\r\n')
+        later.join()
+        self.assertEqual(self.ours.recv(10), b'rest')
+
+    def test_recvuntil_limit(self):
+        self.theirs.sendall(b'x' * 100)
+        self.assertRaises(sshfdpassActionError, net.recvuntil, self.ours, b'\r\n\r\n', 64)
+
+    def test_recvuntil_closed(self):
+        self.theirs.sendall(b'partial\r\n')
+        self.theirs.shutdown(socket.SHUT_WR)
+        self.assertRaises(sshfdpassActionError, net.recvuntil, self.ours, b'\r\n\r\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
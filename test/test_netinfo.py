@@ -0,0 +1,142 @@
+'''Tests of sshfdpass.common.netinfo, its shared fingerprint, and the tests based on it'''
+
+import os
+import time
+import socket
+import shutil
+import tempfile
+import unittest
+from sshfdpass.common import netinfo
+from sshfdpass.tests import gateway, ipv4range, searchdomain
+
+
+class TestDiscovery(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.saved = netinfo.RESOLV_CONF
+        netinfo.RESOLV_CONF = os.path.join(self.dir, 'resolv.conf')
+        with open(netinfo.RESOLV_CONF, 'w') as resolvfd:
+            resolvfd.write('nameserver 192.0.2.53\nsearch Corp.Example.com. lab.example.com\n')
+        netinfo._cache.clear()
+
+    def tearDown(self):
+        netinfo.RESOLV_CONF = self.saved
+        netinfo._cache.clear()
+        shutil.rmtree(self.dir)
+
+    def test_addresses(self):
+        self.assertIn('127.0.0.1', netinfo.addresses(socket.AF_INET))
+        self.assertFalse([ address for address in netinfo.addresses(socket.AF_INET) if ':' in address ])
+
+    def test_route_source(self):
+        self.assertEqual(netinfo.route_source('127.0.0.1'), '127.0.0.1')
+
+    def test_searchdomains(self):
+        self.assertEqual(netinfo.searchdomains(), [ 'corp.example.com', 'lab.example.com' ])
+        self.assertEqual(netinfo.nameservers(), [ '192.0.2.53' ])
+        self.assertTrue(searchdomain.Test(target=[ '*.EXAMPLE.com' ]).evaluate())
+        self.assertFalse(searchdomain.Test(target=[ 'example.org' ]).evaluate())
+
+    def test_cached(self):
+        netinfo.searchdomains()
+        os.unlink(netinfo.RESOLV_CONF)
+        self.assertEqual(len(netinfo.searchdomains()), 2)
+        netinfo._cache['resolvconf'] = (time.time() - netinfo.CACHE_TTL, None)
+        self.assertEqual(netinfo.searchdomains(), [])
+
+    def test_gateway(self):
+        netinfo._cache['gateways'] = (time.time(), [ '192.0.2.1', 'fe80::1' ])
+        self.assertTrue(gateway.Test(target=[ '192.0.2.0/24' ]).evaluate())
+        self.assertTrue(gateway.Test(target=[ 'fe80::1' ]).evaluate())
+        self.assertFalse(gateway.Test(target=[ '198.51.100.1' ]).evaluate())
+
+    def test_fingerprint(self):
+        # A different dns server is a different network
+        first = netinfo._discover_fingerprint()
+        self.assertEqual(len(first), 16)
+        netinfo._cache['resolvconf'] = (time.time(), dict(search=[], nameserver=[ '198.51.100.53' ]))
+        self.assertNotEqual(netinfo._discover_fingerprint(), first)
+
+
+class TestRange(unittest.TestCase):
+    def test_default_probe(self):
+        self.assertEqual(ipv4range.Test(target=[]).settings['method'], 'probe')
+        listener = socket.socket()
+        try:
+            listener.bind(('127.0.0.1', 0))
+            listener.listen(1)
+            test = ipv4range.Test(target=[ '127.0.0.0/8' ], dsthost='127.0.0.1', dstport=listener.getsockname()[1])
+            self.assertEqual(test.localaddrs(), [ '127.0.0.1' ])
+            self.assertTrue(test.evaluate())
+        finally:
+            listener.close()
+
+    def test_local(self):
+        test = ipv4range.Test(target=[ '127.0.0.0/8' ], method='local')
+        self.assertIn('127.0.0.1', test.localaddrs())
+        self.assertTrue(test.evaluate())
+
+
+class TestFingerprint(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.state = os.path.join(self.dir, 'route')
+        with open(self.state, 'w') as statefd:
+            statefd.write('default via 192.0.2.1\n')
+        self.saved = (netinfo.FINGERPRINT_FILE, netinfo.STATE_FILES, netinfo._discover_fingerprint)
+        netinfo.FINGERPRINT_FILE = os.path.join(self.dir, 'net')
+        netinfo.STATE_FILES = (self.state,)
+        self.discovered = 0
+        def discover():
+            self.discovered += 1
+            return 'fp%d'%(self.discovered)
+        netinfo._discover_fingerprint = discover
+
+    def tearDown(self):
+        netinfo.FINGERPRINT_FILE, netinfo.STATE_FILES, netinfo._discover_fingerprint = self.saved
+        netinfo._fingerprints = None
+        shutil.rmtree(self.dir)
+
+    def test_shared(self):
+        self.assertEqual(netinfo._shared_fingerprint(), 'fp1')
+        # Another invocation reuses it from the file
+        netinfo._fingerprints = None
+        self.assertEqual(netinfo._shared_fingerprint(), 'fp1')
+        self.assertEqual(self.discovered, 1)
+
+    def test_state_changed(self):
+        netinfo._shared_fingerprint()
+        with open(self.state, 'w') as statefd:
+            statefd.write('default via 198.51.100.1\n')
+        self.assertEqual(netinfo._shared_fingerprint(), 'fp2')
+
+    def test_expired(self):
+        netinfo._shared_fingerprint()
+        netinfo._fingerprints.update(lambda data: data.update(time=data['time'] - netinfo.FINGERPRINT_TTL))
+        self.assertEqual(netinfo._shared_fingerprint(), 'fp2')
+
+    def test_volatile_columns(self):
+        # The reference and use counters of a route change with the traffic
+        route = '%s 40 %s 00 %s 00000100 %%s %%s 00000001 eth0\n'%('fd00' + '0' * 28, '0' * 32, '0' * 32)
+        with open(self.state, 'w') as statefd:
+            statefd.write(route%('00000001', '00000000'))
+        saved = netinfo.VOLATILE_COLUMNS
+        netinfo.VOLATILE_COLUMNS = { self.state: (6, 7) }
+        try:
+            quick = netinfo._quickstate()
+            with open(self.state, 'w') as statefd:
+                statefd.write(route%('00000003', '00000102'))
+            self.assertEqual(netinfo._quickstate(), quick)
+            with open(self.state, 'w') as statefd:
+                statefd.write(route.replace('eth0', 'eth1')%('00000003', '00000102'))
+            self.assertNotEqual(netinfo._quickstate(), quick)
+        finally:
+            netinfo.VOLATILE_COLUMNS = saved
+
+    def test_real(self):
+        netinfo._discover_fingerprint = self.saved[2]
+        self.assertEqual(len(netinfo._shared_fingerprint()), 16)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+'''Tests of sshfdpass.common.pool'''
+
+import os
+import socket
+import functools
+import unittest
+from sshfdpass.actions import command
+from sshfdpass.common import pool, spawn
+
+
+class TestPool(unittest.TestCase):
+    def setUp(self):
+        self.pool = pool.Pool(size=2, maxidle=60)
+        self.calls = []
+        self.peers = []
+
+    def tearDown(self):
+        self.pool.clear()
+        for peer in self.peers:
+            peer.close()
+
+    def factory(self, deadline=None):
+        self.calls.append(deadline)
+        ours, theirs = socket.socketpair()
+        self.peers.append(theirs)
+        return ours
+
+    def test_miss_gets_the_deadline(self):
+        deadline = object()
+        sock = self.pool.get('key', 'host', self.factory, 2, deadline)
+        sock.close()
+        self.assertEqual(self.calls, [ deadline ])
+        self.assertEqual(self.pool.report()['miss'], 1)
+
+    def test_refill_and_hit(self):
+        self.pool.get('key', 'host', self.factory, 2).close()
+        self.pool.refill()
+        # The background connections are made without a deadline
+        self.assertEqual(self.calls, [ None, None, None ])
+        self.assertEqual(self.pool.report()['pooled'], 2)
+        self.pool.get('key', 'host', self.factory, 2).close()
+        self.assertEqual(self.pool.report()['hit'], 1)
+        self.assertEqual(len(self.calls), 3)
+
+    def test_dead_sockets_are_dropped(self):
+        self.pool.get('key', 'host', self.factory, 1).close()
+        self.pool.refill()
+        for peer in self.peers:
+            peer.close()
+        self.pool.get('key', 'host', self.factory, 1).close()
+        report = self.pool.report()
+        self.assertEqual((report['hit'], report['expired']), (0, 1))
+
+    def test_perhost(self):
+        self.pool.settings['perhost'] = 3
+        self.pool.get('a', 'host', self.factory, 2).close()
+        self.pool.get('b', 'host', self.factory, 2).close()
+        self.pool.refill()
+        self.assertEqual(self.pool.report()['pooled'], 3)
+
+
+class TestCommandPool(unittest.TestCase):
+    '''A prewarm rule of the command action pools spawn.ChildSockets'''
+    def setUp(self):
+        self.pool = pool.Pool(size=1, maxidle=60)
+        self.factory = functools.partial(command.Action().connect, 'host', 22, [ 'cat' ], {})
+
+    def tearDown(self):
+        self.pool.clear()
+
+    def test_hit(self):
+        self.pool.get('key', 'host', self.factory, 1).terminate()
+        self.pool.refill()
+        self.pool.refill() # Checking the pooled ChildSocket doesn't kill the maintenance
+        conn = self.pool.get('key', 'host', self.factory, 1)
+        try:
+            self.assertIsInstance(conn, spawn.ChildSocket)
+            self.assertEqual(self.pool.report()['hit'], 1)
+            conn.sock.sendall(b'hello')
+            self.assertEqual(conn.sock.recv(5), b'hello')
+        finally:
+            conn.terminate()
+
+    def test_expired_child_is_terminated(self):
+        self.pool.get('key', 'host', self.factory, 1).terminate()
+        self.pool.refill()
+        pooled = self.pool.entries['key'][0][0]
+        self.pool.wanted['key']['options']['maxidle'] = 0
+        self.pool.refill()
+        self.assertEqual(self.pool.report()['expired'], 1)
+        self.assertNotIn(pooled.pid, spawn._children)
+        self.assertRaises(OSError, os.kill, pooled.pid, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
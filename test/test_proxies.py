@@ -0,0 +1,255 @@
+'''Tests of the handshakes of sshfdpass.actions.socks5 and sshfdpass.actions.httpconnect, with a socketpair as the proxy'''
+
+import os
+import base64
+import select
+import shutil
+import tempfile
+import socket
+import struct
+import threading
+import unittest
+from sshfdpass.actions import socks5, httpconnect
+import sshfdpass.common
+from sshfdpass.common import net
+from sshfdpass.common.exceptions import sshfdpassActionError
+
+
+class ProxyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.ours, self.proxy = socket.socketpair()
+        self.ours.settimeout(5)
+        self.proxy.settimeout(5)
+
+    def tearDown(self):
+        self.ours.close()
+        self.proxy.close()
+
+
+class TestSocks5(ProxyTestCase):
+    def test_address(self):
+        self.assertEqual(socks5.Action._address('192.0.2.1', 22), b'\x01\xc0\x00\x02\x01\x00\x16')
+        self.assertEqual(socks5.Action._address('2001:db8::1', 22)[:1], b'\x04')
+        self.assertEqual(len(socks5.Action._address('2001:db8::1', 22)), 1 + 16 + 2)
+        self.assertEqual(socks5.Action._address('host', 22), b'\x03\x04host\x00\x16')
+        self.assertRaises(sshfdpassActionError, socks5.Action._address, 'a' * 256, 22)
+
+    def test_method(self):
+        self.proxy.sendall(b'\x05\x02')
+        self.assertEqual(socks5.Action._method(self.ours, [ socks5.METHOD_USERPASS ]), socks5.METHOD_USERPASS)
+        self.proxy.sendall(b'\x05\xff')
+        self.assertRaises(sshfdpassActionError, socks5.Action._method, self.ours, [ socks5.METHOD_NONE ])
+        self.proxy.sendall(b'\x05\x02')
+        self.assertRaises(sshfdpassActionError, socks5.Action._method, self.ours, [ socks5.METHOD_NONE ])
+        self.proxy.sendall(b'\x04\x00')
+        self.assertRaises(sshfdpassActionError, socks5.Action._method, self.ours, [ socks5.METHOD_NONE ])
+
+    def test_connected(self):
+        # The bound address is read, the data after it is left for ssh
+        for bound in (b'\x01' + b'\x00' * 6, b'\x04' + b'\x00' * 18, b'\x03\x04host\x00\x16'):
+            self.proxy.sendall(b'\x05\x00\x00' + bound + b'SSH')
+            socks5.Action._connected(self.ours)
+            self.assertEqual(self.ours.recv(3), b'SSH')
+
+    def test_refused(self):
+        self.proxy.sendall(b'\x05\x05\x00\x01' + b'\x00' * 6)
+        with self.assertRaises(sshfdpassActionError) as raised:
+            socks5.Action._connected(self.ours)
+        self.assertIn('connection refused', str(raised.exception))
+        self.proxy.sendall(b'\x05\x00\x00\x07')
+        self.assertRaises(sshfdpassActionError, socks5.Action._connected, self.ours)
+
+    def test_pipelined_handshake(self):
+        # Every reply is sent upfront: the pipelined handshake sends everything before reading any of them
+        self.proxy.sendall(b'\x05\x02' + b'\x01\x00' + b'\x05\x00\x00\x01' + b'\x00' * 6)
+        socks5.Action(username='alice', password='secret', pipeline=True)._handshake(self.ours, 'host', 22, {})
+        sent = self.proxy.recv(100)
+        self.assertEqual(sent, b'\x05\x01\x02' + b'\x01\x05alice\x06secret' + b'\x05\x01\x00\x03\x04host\x00\x16')
+
+    def test_not_pipelined_by_default(self):
+        # Only the greeting is sent, before the proxy chose the authentication method
+        self.proxy.sendall(b'\x05\x00' + b'\x05\x00\x00\x01' + b'\x00' * 6)
+        socks5.Action()._handshake(self.ours, 'host', 22, {})
+        self.assertEqual(self.proxy.recv(3), b'\x05\x01\x00')
+
+
+class TestHTTPConnect(ProxyTestCase):
+    def test_request(self):
+        request = httpconnect.Action(username='alice', password='secret', headers={ 'User-Agent': 'test' })._request('2001:db8::1', 22, {})
+        self.assertEqual(request, b'CONNECT [2001:db8::1]:22 HTTP/1.1\r\nHost: [2001:db8::1]:22\r\n'
+                b'Proxy-Authorization: Basic YWxpY2U6c2VjcmV0\r\nUser-Agent: test\r\n\r\n')
+
+    def test_response(self):
+        # The response is read up to its end, the banner after it is left for ssh
+        self.proxy.sendall(b'HTTP/1.1 200 Connection established\r\nVia: proxy\r\n\r\nSSH-2.0')
+        self.assertEqual(httpconnect.Action._response(self.ours), (200, 'Connection established'))
+        self.assertEqual(self.ours.recv(7), b'SSH-2.0')
+        self.proxy.sendall(b'HTTP/1.0 407\r\n\r\n')
+        self.assertEqual(httpconnect.Action._response(self.ours), (407, ''))
+
+    def test_not_http(self):
+        self.proxy.sendall(b'SSH-2.0-OpenSSH\r\n\r\n')
+        self.assertRaises(sshfdpassActionError, httpconnect.Action._response, self.ours)
+
+
+class Proxy():
+    '''A real socks5 or http proxy on a local port, serving one client, which relays to the listener of the test case'''
+    def __init__(self, kind, target, credentials=None):
+        self.kind = kind
+        self.target = target
+        self.credentials = credentials
+        self.requests = []
+        self.listener = socket.socket()
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(1)
+        self.listener.settimeout(5)
+        self.port = self.listener.getsockname()[1]
+        self.thread = threading.Thread(target=self.serve)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def serve(self):
+        try:
+            client, address = self.listener.accept()
+        except socket.timeout:
+            return
+        client.settimeout(5)
+        try:
+            upstream = getattr(self, self.kind)(client)
+            if upstream is not None:
+                self.relay(client, upstream)
+        finally:
+            client.close()
+
+    def socks5(self, client):
+        version, count = struct.unpack('!BB', net.recvexact(client, 2))
+        methods = bytearray(net.recvexact(client, count))
+        method = socks5.METHOD_USERPASS if self.credentials else socks5.METHOD_NONE
+        if method not in methods:
+            client.sendall(b'\x05\xff')
+            return None
+        client.sendall(struct.pack('!BB', 5, method))
+        if method == socks5.METHOD_USERPASS:
+            version, length = struct.unpack('!BB', net.recvexact(client, 2))
+            username = net.recvexact(client, length).decode('utf-8')
+            password = net.recvexact(client, ord(net.recvexact(client, 1))).decode('utf-8')
+            if (username, password) != self.credentials:
+                client.sendall(b'\x01\x01')
+                return None
+            client.sendall(b'\x01\x00')
+        version, command, reserved, atyp = struct.unpack('!BBBB', net.recvexact(client, 4))
+        if atyp == 1:
+            host = socket.inet_ntoa(net.recvexact(client, 4))
+        else:
+            host = net.recvexact(client, ord(net.recvexact(client, 1))).decode('ascii')
+        port = struct.unpack('!H', net.recvexact(client, 2))[0]
+        self.requests.append((host, port))
+        client.sendall(b'\x05\x00\x00\x01' + b'\x00' * 6)
+        return socket.create_connection(self.target)
+
+    def http(self, client):
+        header = net.recvuntil(client, b'\r\n\r\n').decode('latin-1')
+        self.requests.append(header)
+        if self.credentials:
+            expected = base64.b64encode(('%s:%s'%self.credentials).encode('utf-8')).decode('ascii')
+            if 'Proxy-Authorization: Basic %s\r\n'%(expected) not in header:
+                client.sendall(b'HTTP/1.1 407 Proxy Authentication Required\r\n\r\n')
+                return None
+        client.sendall(b'HTTP/1.1 200 Connection established\r\n\r\n')
+        return socket.create_connection(self.target)
+
+    @staticmethod
+    def relay(client, upstream):
+        try:
+            while True:
+                for s in select.select([ client, upstream ], [], [], 5)[0]:
+                    data = s.recv(65536)
+                    if not data:
+                        return
+                    (upstream if s is client else client).sendall(data)
+        finally:
+            upstream.close()
+
+    def close(self):
+        self.listener.close()
+        self.thread.join(5)
+
+
+class TestLiveProxy(unittest.TestCase):
+    '''The actions connect to a real proxy, and the session reaches the destination through it'''
+    def setUp(self):
+        self.target = socket.socket()
+        self.target.bind(('127.0.0.1', 0))
+        self.target.listen(4)
+        self.target.settimeout(5)
+        self.proxy = None
+
+    def tearDown(self):
+        if self.proxy is not None:
+            self.proxy.close()
+        self.target.close()
+
+    def start(self, kind, credentials=None):
+        self.proxy = Proxy(kind, self.target.getsockname(), credentials)
+        return '127.0.0.1:%d'%(self.proxy.port)
+
+    def session(self, conn):
+        '''The banner of the destination arrives through the proxy, and the client's data reaches the destination'''
+        try:
+            accepted, address = self.target.accept()
+            try:
+                accepted.sendall(b'SSH-2.0-test\r\n')
+                conn.settimeout(5)
+                self.assertEqual(net.recvexact(conn, 14), b'SSH-2.0-test\r\n')
+                conn.sendall(b'SSH-2.0-client\r\n')
+                self.assertEqual(net.recvexact(accepted, 16), b'SSH-2.0-client\r\n')
+            finally:
+                accepted.close()
+        finally:
+            conn.close()
+
+    def test_socks5(self):
+        for pipeline in (True, False):
+            proxy = self.start('socks5', ('alice', 'secret'))
+            self.session(socks5.Action(username='alice', password='secret', pipeline=pipeline)._execute('target.invalid', 22, proxy))
+            self.assertEqual(self.proxy.requests, [ ('target.invalid', 22) ])
+            self.proxy.close()
+
+    def test_socks5_localdns(self):
+        proxy = self.start('socks5')
+        self.session(socks5.Action(remotedns=False, aforder='4')._execute('localhost', 22, proxy))
+        self.assertEqual(self.proxy.requests, [ ('127.0.0.1', 22) ])
+
+    def test_socks5_auth_failed(self):
+        proxy = self.start('socks5', ('alice', 'secret'))
+        self.assertRaises(sshfdpassActionError, socks5.Action(username='alice', password='wrong')._execute, 'target.invalid', 22, proxy)
+
+    def test_httpconnect(self):
+        proxy = self.start('http', ('alice', 'secret'))
+        self.session(httpconnect.Action(username='alice', password='secret')._execute('target.invalid', 22, proxy))
+        self.assertTrue(self.proxy.requests[0].startswith('CONNECT target.invalid:22 HTTP/1.1\r\n'))
+
+    def test_credentials_not_logged(self):
+        logdir = tempfile.mkdtemp()
+        logfile = os.path.join(logdir, 'fdpass.log')
+        try:
+            sshfdpass.common.log.configure(level='debug', file=logfile)
+            proxy = self.start('socks5', ('alice', 'secret'))
+            self.session(socks5.Action(username='alice').connect('target.invalid', 22, proxy, dict(password='secret')))
+            with open(logfile) as logfd:
+                logged = logfd.read()
+            self.assertIn("'password': '***'", logged)
+            self.assertNotIn('secret', logged)
+        finally:
+            sshfdpass.common.log.configure(file=None)
+            shutil.rmtree(logdir)
+
+    def test_httpconnect_refused(self):
+        proxy = self.start('http', ('alice', 'secret'))
+        with self.assertRaises(sshfdpassActionError) as raised:
+            httpconnect.Action()._execute('target.invalid', 22, proxy)
+        self.assertIn('407', str(raised.exception))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+'''Tests of sshfdpass.common.race, with stand-in actions'''
+
+import time
+import threading
+import unittest
+from sshfdpass.common import race
+from sshfdpass.common.deadline import Deadline
+from sshfdpass.common.exceptions import sshfdpassActionError, sshfdpassTimeout
+
+
+class FakeConn():
+    def __init__(self, name):
+        self.name = name
+        self.closed = threading.Event()
+
+    def close(self):
+        self.closed.set()
+
+
+class TestRace(unittest.TestCase):
+    def setUp(self):
+        self.started = []
+        self.conns = dict()
+        # name -> (delay, fails)
+        self.actions = dict()
+
+    def connect(self, name):
+        self.started.append(name)
+        delay, fails = self.actions.get(name, (0, False))
+        time.sleep(delay)
+        if fails:
+            raise(sshfdpassActionError('%s failed'%(name)))
+        self.conns[name] = FakeConn(name)
+        return self.conns[name]
+
+    def eligible(self, *names, **kwargs):
+        '''Yields names, after the delay of the tests'''
+        time.sleep(kwargs.get('delay', 0))
+        for name in names:
+            yield name
+
+    def test_fall_through(self):
+        self.actions = dict(a=(0, True), b=(0, True))
+        self.assertEqual(race.race(self.eligible('a', 'b', 'c'), self.connect).name, 'c')
+        self.assertEqual(self.started, [ 'a', 'b', 'c' ])
+
+    def test_sequential_waits(self):
+        # The next one is not started, while the previous one may still work
+        self.actions = dict(a=(0.3, False))
+        self.assertEqual(race.race(self.eligible('a', 'b'), self.connect).name, 'a')
+        self.assertEqual(self.started, [ 'a' ])
+
+    def test_race(self):
+        self.actions = dict(a=(0.5, False), b=(0, False))
+        start = time.time()
+        self.assertEqual(race.race(self.eligible('a', 'b'), self.connect, racecount=2, stagger=0.05).name, 'b')
+        self.assertLess(time.time() - start, 0.4)
+        # The loser is torn down when it finishes
+        self.assertTrue(self.conns_closed('a'))
+
+    def conns_closed(self, name):
+        for attempt in range(100):
+            if name in self.conns:
+                return self.conns[name].closed.wait(1)
+            time.sleep(0.01)
+        return False
+
+    def test_speculative(self):
+        # The fallback connects while the tests run, but it's used only when it's reached in order
+        self.actions = dict(fallback=(0.2, False))
+        start = time.time()
+        winner = race.race(self.eligible('fallback', delay=0.3), self.connect, fallback='fallback')
+        self.assertEqual(winner.name, 'fallback')
+        self.assertEqual(self.started, [ 'fallback' ])
+        self.assertLess(time.time() - start, 0.45)
+
+    def test_speculative_unused(self):
+        winner = race.race(self.eligible('a', 'fallback', delay=0.1), self.connect, fallback='fallback')
+        self.assertEqual(winner.name, 'a')
+        self.assertTrue(self.conns_closed('fallback'))
+
+    def test_all_failed(self):
+        self.actions = dict(a=(0, True), b=(0, True))
+        with self.assertRaises(sshfdpassActionError) as raised:
+            race.race(self.eligible('a', 'b'), self.connect)
+        self.assertEqual(str(raised.exception), 'b failed')
+
+    def test_deadline(self):
+        self.actions = dict(a=(1, False))
+        start = time.time()
+        self.assertRaises(sshfdpassTimeout, race.race, self.eligible('a'), self.connect, deadline=Deadline(0.2))
+        self.assertLess(time.time() - start, 0.6)
+        self.assertTrue(self.conns_closed('a'))
+
+
+if __name__ == '__main__':
+    unittest.main()
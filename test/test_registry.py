@@ -0,0 +1,62 @@
+'''Tests of sshfdpass.common.registry'''
+
+import unittest
+import sshfdpass.actions
+import sshfdpass.tests
+from sshfdpass.common import registry
+from sshfdpass.common.exceptions import sshfdpassTestUnkown
+
+
+class TestRegistry(unittest.TestCase):
+    def setUp(self):
+        self.settings = dict(tcp4=dict(aforder='4'))
+        self.registry = registry.Registry(sshfdpass.actions, 'Action', lambda name: self.settings.get(name, {}))
+
+    def test_builtins(self):
+        # Known without importing them, instantiated on first access with their settings
+        self.assertIn('tcp4', self.registry.names())
+        self.assertIn('tcp4', self.registry)
+        self.assertEqual(len(self.registry), 0)
+        action = self.registry['tcp4']
+        self.assertEqual(type(action).__module__, 'sshfdpass.actions.tcp4')
+        self.assertEqual(action.settings.get('aforder'), '4')
+        self.assertIs(self.registry['tcp4'], action)
+
+    def test_reset(self):
+        action = self.registry['tcp4']
+        self.settings['tcp4'] = dict(aforder='6')
+        self.registry.reset()
+        self.assertIsNot(self.registry['tcp4'], action)
+        self.assertEqual(self.registry['tcp4'].settings.get('aforder'), '6')
+
+    def test_register(self):
+        calls = []
+        self.registry.register('mine', lambda **kwargs: calls.append(kwargs) or 'instance')
+        self.assertIn('mine', self.registry)
+        self.assertEqual(calls, [])
+        self.assertEqual(self.registry['mine'], 'instance')
+        self.assertEqual(calls, [ {} ])
+
+    def test_unknown(self):
+        self.assertNotIn('nonexistent', self.registry)
+        self.assertRaises(KeyError, self.registry.__getitem__, 'nonexistent')
+        self.assertIsNone(self.registry.get('nonexistent'))
+
+
+class TestParseTest(unittest.TestCase):
+    '''User defined tests are based on the tests of a registry'''
+    def setUp(self):
+        self.registry = registry.Registry(sshfdpass.tests, 'Test', lambda name: {})
+
+    def test_based_on(self):
+        test = sshfdpass.tests.parse_test({ 'ipv4range': '10.0.0.0/8' }, self.registry)
+        self.assertEqual(type(test).__module__, 'sshfdpass.tests.ipv4range')
+        self.assertEqual(test.settings.get('target'), [ '10.0.0.0/8' ])
+
+    def test_unknown(self):
+        self.assertRaises(sshfdpassTestUnkown, sshfdpass.tests.parse_test, { 'nonexistent': [ 'a' ] }, self.registry)
+        self.assertRaises(sshfdpassTestUnkown, sshfdpass.tests.parse_test, 'nonexistent', self.registry)
+
+
+if __name__ == '__main__':
+    unittest.main()
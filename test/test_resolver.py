@@ -0,0 +1,105 @@
+'''Tests of sshfdpass.common.resolver'''
+
+import os
+import socket
+import shutil
+import tempfile
+import unittest
+from sshfdpass.common import resolver, singleflight
+
+ADDRINFO = (socket.AF_INET, socket.SOCK_STREAM, 6, '', ('192.0.2.1', 0))
+
+
+class TestResolver(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        singleflight.configure(dir=os.path.join(self.dir, 'flight'))
+        self.resolver = resolver.Resolver()
+        self.resolver.configure(file=os.path.join(self.dir, 'dns'), ttl=60, negttl=30, maxstale=600, refresh=0)
+        self.resolver._file.keyed = lambda: 'home'
+        self.lookups = []
+        self.answer = [ ADDRINFO ]
+        self.getaddrinfo = socket.getaddrinfo
+        socket.getaddrinfo = self.fake
+
+    def tearDown(self):
+        socket.getaddrinfo = self.getaddrinfo
+        singleflight.configure()
+        shutil.rmtree(self.dir)
+
+    def fake(self, host, port, family=0, socktype=0):
+        self.lookups.append(host)
+        if isinstance(self.answer, Exception):
+            raise(self.answer)
+        return [ addrinfo[:4] + ((addrinfo[4][0], port),) for addrinfo in self.answer ]
+
+    def age(self, seconds):
+        '''Make every cache entry older by seconds'''
+        def age(data):
+            for entry in data.get('entries', {}).values():
+                entry['resolved'] -= seconds
+                entry['expires'] -= seconds
+        self.resolver._file.update(age)
+
+    def test_cached(self):
+        self.assertEqual(self.resolver.getaddrinfo('Host.example', 22)[0][4], ('192.0.2.1', 22))
+        # The cached addresses get the requested port, the name is case insensitive
+        self.assertEqual(self.resolver.getaddrinfo('host.example', 2222)[0][4], ('192.0.2.1', 2222))
+        self.assertEqual(len(self.lookups), 1)
+        # Another instance reads the same file
+        other = resolver.Resolver()
+        other.configure(file=self.resolver.path)
+        other._file.keyed = lambda: 'home'
+        other.getaddrinfo('host.example', 22)
+        self.assertEqual(len(self.lookups), 1)
+
+    def test_address(self):
+        self.resolver.getaddrinfo('192.0.2.7', 22)
+        self.resolver.getaddrinfo('192.0.2.7', 22)
+        self.assertEqual(len(self.lookups), 2)
+        self.assertNotIn('entries', self.resolver._file.load())
+
+    def test_expiry(self):
+        self.resolver.getaddrinfo('host.example', 22)
+        self.age(61)
+        self.resolver.getaddrinfo('host.example', 22)
+        self.assertEqual(len(self.lookups), 2)
+
+    def test_negative(self):
+        self.answer = socket.gaierror(socket.EAI_NONAME, 'Name or service not known')
+        for attempt in range(2):
+            self.assertRaises(socket.gaierror, self.resolver.getaddrinfo, 'missing.example', 22)
+        self.assertEqual(len(self.lookups), 1)
+        self.age(31)
+        self.assertRaises(socket.gaierror, self.resolver.getaddrinfo, 'missing.example', 22)
+        self.assertEqual(len(self.lookups), 2)
+
+    def test_temporary_failure(self):
+        # Temporary failures are not cached, but an expired entry is served instead of them, up to maxstale
+        self.answer = socket.gaierror(socket.EAI_AGAIN, 'Temporary failure in name resolution')
+        self.assertRaises(socket.gaierror, self.resolver.getaddrinfo, 'host.example', 22)
+        self.assertRaises(socket.gaierror, self.resolver.getaddrinfo, 'host.example', 22)
+        self.assertEqual(len(self.lookups), 2)
+        self.answer = [ ADDRINFO ]
+        self.resolver.getaddrinfo('host.example', 22)
+        self.age(120)
+        self.answer = socket.gaierror(socket.EAI_AGAIN, 'Temporary failure in name resolution')
+        self.assertEqual(self.resolver.getaddrinfo('host.example', 22)[0][4], ('192.0.2.1', 22))
+        self.age(600)
+        self.assertRaises(socket.gaierror, self.resolver.getaddrinfo, 'host.example', 22)
+
+    def test_network_change(self):
+        self.resolver.getaddrinfo('host.example', 22)
+        self.resolver._file.keyed = lambda: 'vpn'
+        self.resolver.getaddrinfo('host.example', 22)
+        self.assertEqual(len(self.lookups), 2)
+
+    def test_clear(self):
+        self.resolver.getaddrinfo('host.example', 22)
+        self.resolver.clear()
+        self.resolver.getaddrinfo('host.example', 22)
+        self.assertEqual(len(self.lookups), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
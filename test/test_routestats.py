@@ -0,0 +1,94 @@
+'''Tests of sshfdpass.common.routestats'''
+
+import os
+import shutil
+import tempfile
+import unittest
+from sshfdpass.common import routestats
+
+
+class Rule(dict):
+    '''A rule, with the key it was found under'''
+    def __init__(self, key, **rule):
+        dict.__init__(self, **rule)
+        self.key = key
+
+
+class TestRouteStats(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.stats = routestats.RouteStats()
+        self.stats.configure(enabled=True, file=os.path.join(self.dir, 'routes'), failures=2, cooldown=60)
+        self.rule = Rule('foo', action='tcp')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_disabled_by_default(self):
+        stats = routestats.RouteStats()
+        self.assertFalse(stats.enabled)
+        stats.record('foo', 22, self.rule, latency=0.01)
+        stats.flush()
+        self.assertIsNone(stats.get('foo', 22, self.rule))
+
+    def test_flush(self):
+        self.stats.record('foo', 22, self.rule, latency=0.01)
+        # Nothing is written before the flush
+        self.assertFalse(os.path.exists(self.stats.path))
+        self.stats.flush()
+        route = self.stats.get('foo', 22, self.rule)
+        self.assertEqual(route['ok'], 1)
+        self.assertAlmostEqual(route['ewma'], 10)
+        # Another instance reads the same file
+        other = routestats.RouteStats()
+        other.configure(enabled=True, file=self.stats.path)
+        self.assertEqual(other.get('foo', 22, self.rule)['ok'], 1)
+
+    def test_circuit(self):
+        self.stats.record('foo', 22, self.rule, error=OSError('refused'))
+        self.stats.flush()
+        self.assertFalse(self.stats.is_open('foo', 22, self.rule))
+        self.stats.record('foo', 22, self.rule, error=OSError('refused'))
+        self.stats.flush()
+        self.assertTrue(self.stats.is_open('foo', 22, self.rule))
+        # Other destinations of the same rule are not affected
+        self.assertFalse(self.stats.is_open('bar', 22, self.rule))
+        self.stats.record('foo', 22, self.rule, latency=0.01)
+        self.stats.flush()
+        self.assertFalse(self.stats.is_open('foo', 22, self.rule))
+
+    def test_order(self):
+        fast, slow, new = Rule('fast'), Rule('slow'), Rule('new')
+        self.stats.record('foo', 22, fast, latency=0.01)
+        self.stats.record('foo', 22, slow, latency=0.5)
+        self.stats.flush()
+        items = [ (slow, 'a'), (fast, 'b'), (new, 'c') ]
+        self.assertEqual([ item[1] for item in self.stats.order('foo', 22, items) ], [ 'c', 'b', 'a' ])
+
+    def test_maxroutes(self):
+        self.stats.configure(enabled=True, file=self.stats.path, maxroutes=3)
+        for i in range(5):
+            self.stats.record('host%d'%(i), 22, self.rule, latency=0.01)
+            self.stats.flush()
+        self.assertEqual(len(self.stats._file.load()['routes']), 3)
+        # The least recently used ones are forgotten
+        self.assertIsNone(self.stats.get('host0', 22, self.rule))
+        self.assertIsNotNone(self.stats.get('host4', 22, self.rule))
+
+
+    def test_maxage(self):
+        self.stats.configure(enabled=True, file=self.stats.path, maxage=60)
+        self.stats.record('old', 22, self.rule, latency=0.01)
+        self.stats.flush()
+        def age(data):
+            data['routes'][routestats.route_id('old', 22, self.rule)]['used'] -= 120
+        self.stats._file.update(age)
+        self.stats.record('new', 22, self.rule, latency=0.01)
+        self.stats.flush()
+        # The routes unused for maxage are forgotten
+        self.assertIsNone(self.stats.get('old', 22, self.rule))
+        self.assertIsNotNone(self.stats.get('new', 22, self.rule))
+
+
+if __name__ == '__main__':
+    unittest.main()
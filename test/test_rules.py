@@ -0,0 +1,175 @@
+'''Tests of sshfdpass.common.rules: the rule keys and their order of precedence'''
+
+import unittest
+from sshfdpass.common import rules
+
+
+def keys(index, host, port):
+    return [ plan.key for plan in index.match(host, port) ]
+
+
+class TestSplitKey(unittest.TestCase):
+    def test_host_port(self):
+        self.assertEqual(rules.split_key('foo:22'), ('foo', '22'))
+        self.assertEqual(rules.split_key('foo:2200-2299'), ('foo', '2200-2299'))
+        self.assertEqual(rules.split_key('foo'), ('foo', None))
+
+    def test_ipv6(self):
+        self.assertEqual(rules.split_key('[2001:db8::/32]:22'), ('2001:db8::/32', '22'))
+        self.assertEqual(rules.split_key('2001:db8::/32'), ('2001:db8::/32', None))
+
+    def test_portspec(self):
+        self.assertEqual(rules.parse_portspec('22'), (22, 22))
+        self.assertEqual(rules.parse_portspec('1-2'), (1, 2))
+        self.assertEqual(rules.parse_portspec('*'), None)
+        self.assertIs(rules.parse_portspec('x'), False)
+
+    def test_canonical_key(self):
+        self.assertEqual(rules.canonical_key('foo:22-22'), 'foo:22')
+        self.assertEqual(rules.canonical_key('foo:022'), 'foo:22')
+        self.assertEqual(rules.canonical_key('[2001:db8::1]:22-22'), '[2001:db8::1]:22')
+        for key in ('foo:22', 'foo', 'foo:22-23', '*.foo:22-22', '10.0.0.0/8:22-22', '~foo:22-22'):
+            self.assertEqual(rules.canonical_key(key), key)
+
+
+class TestPrecedence(unittest.TestCase):
+    def setUp(self):
+        # Deliberately not in the order of precedence
+        self.index = rules.RuleIndex({
+            '~^web[0-9]+\\.prod\\.example\\.com$': [ dict(action='tcp') ],
+            '*.example.com': [ dict(action='tcp') ],
+            'web?.prod.example.com': [ dict(action='tcp') ],
+            '*.prod.example.com': [ dict(action='tcp') ],
+            'web1.prod.example.com': [ dict(action='tcp') ],
+            'web1.prod.example.com:2200-2299': [ dict(action='tcp') ],
+            'web1.prod.example.com:2222': [ dict(action='tcp') ],
+            'other:22': [ dict(action='tcp') ],
+            })
+
+    def test_order(self):
+        self.assertEqual(keys(self.index, 'web1.prod.example.com', 2222), [
+            'web1.prod.example.com:2222',
+            'web1.prod.example.com:2200-2299',
+            'web1.prod.example.com',
+            '*.prod.example.com',
+            '*.example.com',
+            'web?.prod.example.com',
+            '~^web[0-9]+\\.prod\\.example\\.com$',
+            None,
+            ])
+
+    def test_port_range_and_exact_port(self):
+        self.assertEqual(keys(self.index, 'web1.prod.example.com', 22)[:2], [ 'web1.prod.example.com', '*.prod.example.com' ])
+
+    def test_default_only(self):
+        self.assertEqual(keys(self.index, 'unknown', 22), [ None ])
+        self.assertEqual(keys(self.index, 'other', 2222), [ None ])
+
+    def test_domain_glob_needs_a_label(self):
+        self.assertEqual(keys(self.index, 'example.com', 22), [ None ])
+
+
+class TestNetworks(unittest.TestCase):
+    def setUp(self):
+        self.index = rules.RuleIndex({
+            '10.0.0.0/8': [ dict(action='tcp') ],
+            '10.1.0.0/16': [ dict(action='tcp') ],
+            '10.1.0.0/16:22': [ dict(action='tcp') ],
+            '10.1.2.3': [ dict(action='tcp') ],
+            '[2001:db8::/32]:22': [ dict(action='tcp') ],
+            '*': [ dict(action='tcp') ],
+            })
+
+    def test_longest_prefix_first(self):
+        self.assertEqual(keys(self.index, '10.1.2.3', 22), [ '10.1.2.3', '10.1.0.0/16:22', '10.1.0.0/16', '10.0.0.0/8', '*', None ])
+
+    def test_port_restriction(self):
+        self.assertEqual(keys(self.index, '10.1.9.9', 2222), [ '10.1.0.0/16', '10.0.0.0/8', '*', None ])
+
+    def test_ipv6(self):
+        self.assertEqual(keys(self.index, '2001:db8::1', 22), [ '[2001:db8::/32]:22', '*', None ])
+        self.assertEqual(keys(self.index, '2001:db8::1', 23), [ '*', None ])
+
+    def test_names_dont_match_networks(self):
+        self.assertEqual(keys(self.index, 'host', 22), [ '*', None ])
+
+
+class TestRegexes(unittest.TestCase):
+    def test_inline_flags(self):
+        index = rules.RuleIndex({ '~(?i)^web.*': [ dict(action='tcp') ], '~(?i)^db.*': [ dict(action='tcp') ] })
+        self.assertEqual(keys(index, 'WEB1', 22), [ '~(?i)^web.*', None ])
+        self.assertEqual(keys(index, 'Db2', 22), [ '~(?i)^db.*', None ])
+
+    def test_named_groups(self):
+        index = rules.RuleIndex({ '~(?P<n>web)[0-9]+': [ dict(action='tcp') ], '~(?P<n>db)[0-9]+': [ dict(action='tcp') ] })
+        self.assertEqual(keys(index, 'db1', 22), [ '~(?P<n>db)[0-9]+', None ])
+
+    def test_backreferences(self):
+        index = rules.RuleIndex({ '~^(y)(z)$': [ dict(action='tcp') ], '~^(x)\\1$': [ dict(action='tcp') ] })
+        self.assertEqual(keys(index, 'xx', 22), [ '~^(x)\\1$', None ])
+        self.assertEqual(keys(index, 'yz', 22), [ '~^(y)(z)$', None ])
+
+    def test_combined(self):
+        index = rules.RuleIndex({ '~web[0-9]+': [ dict(action='tcp') ], '~db[0-9]+:5432': [ dict(action='tcp') ] })
+        self.assertIsNotNone(index._regexfilter)
+        self.assertEqual(keys(index, 'web1', 22), [ '~web[0-9]+', None ])
+        self.assertEqual(keys(index, 'db1', 5432), [ '~db[0-9]+:5432', None ])
+        self.assertEqual(keys(index, 'db1', 22), [ None ])
+
+    def test_config_order(self):
+        index = rules.RuleIndex({ '~.*': [ dict(action='tcp') ], '~(?i)A': [ dict(action='tcp') ] })
+        self.assertEqual(keys(index, 'a', 22), [ '~.*', '~(?i)A', None ])
+
+    def test_invalid_is_skipped(self):
+        index = rules.RuleIndex({ '~(': [ dict(action='tcp') ], '~a': [ dict(action='tcp') ] })
+        self.assertEqual(keys(index, 'a', 22), [ '~a', None ])
+
+
+class TestSinglePortRange(unittest.TestCase):
+    def test_match(self):
+        # A range of one port is the same as the port itself, it's not lost as an exact key
+        index = rules.RuleIndex({ 'foo:22-22': [ dict(action='tcp') ], 'foo:22': [ dict(action='tcp4') ] })
+        self.assertEqual(keys(index, 'foo', 22), [ 'foo:22-22', 'foo:22', None ])
+        self.assertEqual(keys(index, 'foo', 2222), [ None ])
+        self.assertEqual(keys(rules.RuleIndex({ 'foo:0022': [ dict(action='tcp') ] }), 'foo', 22), [ 'foo:0022', None ])
+
+    def test_describe(self):
+        self.assertEqual(rules.describe('foo:22-22'), 'exact host:port')
+
+
+class TestCache(unittest.TestCase):
+    def setUp(self):
+        rules.invalidate()
+
+    def test_index(self):
+        ruleset = { 'a': [ dict(action='tcp') ] }
+        self.assertIs(rules.index(ruleset), rules.index(ruleset))
+        self.assertIs(rules.index(rules.index(ruleset)), rules.index(ruleset))
+
+    def test_new_rules(self):
+        first = rules.index({ 'a': [ dict(action='tcp') ] })
+        # The same size, but different rules
+        self.assertEqual(keys(rules.index({ 'b': [ dict(action='tcp') ] }), 'b', 22), [ 'b', None ])
+        self.assertIsNot(rules.index({ 'a': [ dict(action='tcp') ] }), first)
+
+    def test_invalidate(self):
+        ruleset = { 'a': [ dict(action='tcp') ] }
+        first = rules.index(ruleset)
+        rules.invalidate()
+        self.assertIsNot(rules.index(ruleset), first)
+
+
+class TestDescribe(unittest.TestCase):
+    def test_kinds(self):
+        self.assertEqual(rules.describe(None), 'default rule')
+        self.assertEqual(rules.describe('~x'), 'regular expression')
+        self.assertEqual(rules.describe('10.0.0.0/8'), 'network')
+        self.assertEqual(rules.describe('*.example.com'), 'domain glob')
+        self.assertEqual(rules.describe('web?'), 'glob')
+        self.assertEqual(rules.describe('foo:1-2'), 'port range')
+        self.assertEqual(rules.describe('foo:22'), 'exact host:port')
+        self.assertEqual(rules.describe('foo'), 'exact host')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+'''Tests of sshfdpass.common.rulestore'''
+
+import os
+import json
+import datetime
+import shutil
+import tempfile
+import unittest
+from sshfdpass.common import config, rules, rulestore
+
+
+class TestRuleStore(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.conffile = os.path.join(self.dir, 'fdpass.conf')
+        self.rules = dict(('host%d'%(i), [ dict(action='tcp', key='host%d'%(i)) ]) for i in range(100))
+        self.rules.update({
+            'host7:2222': [ dict(action='tcp', key='host7:2222') ],
+            'host8:2222-2222': [ dict(action='tcp', key='host8:2222-2222') ],
+            '*.example.com': [ dict(action='tcp', key='*.example.com') ],
+            '192.0.2.0/24': [ dict(action='tcp', key='192.0.2.0/24') ],
+        })
+        self.write(dict(settings=dict(a=1), rules=self.rules))
+        self.stores = []
+
+    def tearDown(self):
+        for store in self.stores:
+            store.close()
+        shutil.rmtree(self.dir)
+
+    def write(self, data):
+        with open(self.conffile, 'w') as fd:
+            json.dump(data, fd)
+
+    def open(self):
+        store = rulestore.open_store(self.conffile, os.stat(self.conffile))
+        if store is not None:
+            self.stores.append(store)
+        return store
+
+    def test_is_exact(self):
+        self.assertTrue(rulestore.is_exact('host'))
+        self.assertTrue(rulestore.is_exact('host:22'))
+        self.assertFalse(rulestore.is_exact('*.example.com'))
+        self.assertFalse(rulestore.is_exact('192.0.2.0/24'))
+        self.assertFalse(rulestore.is_exact('~^host'))
+
+    def test_lookup(self):
+        config.load_config_file(self.conffile, force=True)
+        store = self.open()
+        self.assertEqual(len(store), 102)
+        # A range of one port is stored under host:port
+        self.assertEqual(store['host8:2222'], self.rules['host8:2222-2222'])
+        self.assertEqual(store['host42'], self.rules['host42'])
+        self.assertEqual(store.get('host7:2222'), self.rules['host7:2222'])
+        self.assertNotIn('missing', store)
+        self.assertRaises(KeyError, store.__getitem__, '*.example.com')
+        # Only the patterns are loaded on every invocation
+        self.assertEqual(sorted(store.meta['config']['rules']), [ '*.example.com', '192.0.2.0/24' ])
+        self.assertEqual(store.meta['config']['settings'], dict(a=1))
+
+    def test_records(self):
+        # The records are JSON, the store is read without pickle or hashlib
+        config.load_config_file(self.conffile, force=True)
+        with open(rulestore.store_path(self.conffile), 'rb') as storefd:
+            data = storefd.read()
+        self.assertIn(b'["host42",[{"action":"tcp","key":"host42"}]]', data)
+        self.assertNotEqual(rulestore._hash('host42'), rulestore._hash('host24'))
+        self.assertEqual(rulestore._hash(''), rulestore._FNV_OFFSET)
+        # The rules merged from a range of one port remember their own key
+        store = self.open()
+        self.assertEqual([ plan.key for plan in store['host8:2222'] ], [ 'host8:2222-2222' ])
+
+    def test_not_json(self):
+        # A yaml config may have values which JSON can't hold, it's used without a store
+        parse = config.parse_config
+        config.parse_config = lambda data: dict(parse(data), settings=dict(since=datetime.date(2020, 1, 1)))
+        try:
+            loaded = config.load_config_file(self.conffile, force=True)
+        finally:
+            config.parse_config = parse
+        self.assertEqual(loaded['settings'], dict(since=datetime.date(2020, 1, 1)))
+        self.assertEqual(sorted(os.listdir(self.dir)), [ 'fdpass.conf' ])
+
+    def test_not_compiled(self):
+        config.load_config_file(self.conffile)
+        self.assertIsNone(self.open())
+
+    def test_outdated(self):
+        config.load_config_file(self.conffile, force=True)
+        self.write(dict(settings=dict(a=2), rules={}))
+        self.assertIsNone(self.open())
+        # The next load refreshes it
+        config.load_config_file(self.conffile)
+        self.assertEqual(self.open().meta['config']['settings'], dict(a=2))
+
+    def test_corrupt(self):
+        with open(rulestore.store_path(self.conffile), 'wb') as storefd:
+            storefd.write(b'garbage' * 10)
+        self.assertIsNone(self.open())
+
+    def test_index(self):
+        # Matching through the store gives the same plans as matching the whole config
+        config.load_config_file(self.conffile, force=True)
+        loaded = config.load_config_file(self.conffile)
+        self.stores.append(loaded['rulestore'])
+        indexed = rules.RuleIndex(loaded['rules'], exact=loaded['rulestore'])
+        fresh = rules.RuleIndex(self.rules)
+        for host, port in (('host7', 2222), ('host7', 22), ('host8', 2222), ('www.example.com', 22), ('192.0.2.9', 22), ('other', 22)):
+            self.assertEqual([ plan.key for plan in indexed.match(host, port) ], [ plan.key for plan in fresh.match(host, port) ])
+
+
+if __name__ == '__main__':
+    unittest.main()
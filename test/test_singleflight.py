@@ -0,0 +1,87 @@
+'''Tests of sshfdpass.common.singleflight
+
+flock() locks belong to the open file, so two threads of the test take the place of two invocations.
+'''
+
+import os
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+from sshfdpass.common import singleflight
+
+
+class TestSingleFlight(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.flight = singleflight.SingleFlight()
+        self.flight.configure(dir=os.path.join(self.dir, 'flight'), stale=5)
+        self.published = dict()
+        self.computed = []
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def compute(self, key, value, delay=0):
+        def compute():
+            time.sleep(delay)
+            self.computed.append(key)
+            self.published[key] = value
+            return value
+        return compute
+
+    def test_run(self):
+        self.assertEqual(self.flight.run('key', lambda: self.published.get('key'), self.compute('key', 1)), 1)
+        # Published meanwhile, it's not computed again
+        self.assertEqual(self.flight.run('key', lambda: self.published.get('key'), self.compute('key', 2)), 1)
+        self.assertEqual(self.computed, [ 'key' ])
+        self.assertEqual(os.listdir(self.flight.dir), [])
+
+    def test_disabled(self):
+        self.flight.configure(enabled=False, dir=self.flight.dir)
+        self.published['key'] = 1
+        self.assertEqual(self.flight.run('key', lambda: self.published.get('key'), self.compute('key', 2)), 2)
+
+    def test_coalesced(self):
+        # The second one waits for the result of the first one, instead of computing it
+        results = []
+        first = threading.Thread(target=lambda: results.append(
+            self.flight.run('key', lambda: self.published.get('key'), self.compute('key', 1, 0.2))))
+        first.start()
+        time.sleep(0.05)
+        results.append(self.flight.run('key', lambda: self.published.get('key'), self.compute('key', 2)))
+        first.join()
+        self.assertEqual(results, [ 1, 1 ])
+        self.assertEqual(self.computed, [ 'key' ])
+
+    def test_stale(self):
+        # A holder slower than stale is not waited for, the waiter computes by itself
+        self.flight.configure(dir=self.flight.dir, stale=0.1)
+        first = threading.Thread(target=self.flight.run, args=('key', lambda: None, self.compute('slow', 1, 0.5)))
+        first.start()
+        time.sleep(0.05)
+        begin = time.time()
+        self.assertEqual(self.flight.run('key', lambda: None, self.compute('fast', 2)), 2)
+        self.assertLess(time.time() - begin, 0.4)
+        first.join()
+
+    def test_first(self):
+        skipped = []
+        first = threading.Thread(target=self.flight.first, args=('key', self.compute('key', 1, 0.2)))
+        first.start()
+        time.sleep(0.05)
+        skipped.append(self.flight.first('key', self.compute('other', 2)))
+        first.join()
+        self.assertEqual(skipped, [ None ])
+        self.assertEqual(self.flight.first('key', self.compute('key', 3)), 3)
+
+    def test_unusable_dir(self):
+        path = os.path.join(self.dir, 'file')
+        open(path, 'w').close()
+        self.flight.configure(dir=os.path.join(path, 'flight'))
+        self.assertEqual(self.flight.run('key', lambda: None, self.compute('key', 1)), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
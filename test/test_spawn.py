@@ -0,0 +1,96 @@
+'''Tests of sshfdpass.common.spawn'''
+
+import os
+import time
+import socket
+import signal
+import unittest
+from sshfdpass.common import spawn
+
+ENGINES = [ engine for engine in ('posix_spawn', 'fork') if engine != 'posix_spawn' or hasattr(os, 'posix_spawnp') ]
+
+
+def run(command, engine):
+    '''Spawn command, and return its output and its ChildSocket'''
+    ours, theirs = socket.socketpair()
+    try:
+        pid = spawn.spawn(command[0], command, theirs.fileno(), engine=engine)
+    finally:
+        theirs.close()
+    output = b''
+    while True:
+        data = ours.recv(65536)
+        if not data:
+            break
+        output += data
+    return output.decode('utf-8', 'replace'), spawn.ChildSocket(ours, pid)
+
+
+class TestSpawn(unittest.TestCase):
+    def test_stdio(self):
+        for engine in ENGINES:
+            output, child = run([ 'sh', '-c', 'echo out; echo err >&2' ], engine)
+            child.terminate()
+            self.assertEqual(output.split(), [ 'out', 'err' ], engine)
+
+    @unittest.skipUnless(os.path.isdir('/proc/self/fd'), 'needs /proc')
+    def test_no_leaked_fds(self):
+        leak = os.open(os.devnull, os.O_RDONLY)
+        os.set_inheritable(leak, True)
+        try:
+            for engine in ENGINES:
+                output, child = run([ 'ls', '/proc/self/fd' ], engine)
+                child.terminate()
+                # Only the stdio, and the directory ls has open itself
+                self.assertLessEqual(len(set(output.split()) - set([ '0', '1', '2' ])), 1, engine)
+        finally:
+            os.close(leak)
+
+    def test_terminate(self):
+        ours, theirs = socket.socketpair()
+        pid = spawn.spawn('sleep', [ 'sleep', '60' ], theirs.fileno())
+        theirs.close()
+        spawn.ChildSocket(ours, pid).terminate()
+        self.assertRaises(OSError, os.waitpid, pid, os.WNOHANG)
+        self.assertNotIn(pid, spawn._children)
+        self.assertEqual(spawn.reap(), 0)
+
+    def test_unknown_engine(self):
+        self.assertRaises(ValueError, spawn.spawn, 'true', [ 'true' ], 0, engine='vfork')
+
+
+
+@unittest.skipUnless(os.path.exists('/proc/self/status'), 'needs /proc')
+class TestSignals(unittest.TestCase):
+    def setUp(self):
+        self.saved = signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+
+    def tearDown(self):
+        signal.signal(signal.SIGCHLD, self.saved)
+
+    def test_default_dispositions(self):
+        for engine in ENGINES:
+            output, child = run([ 'cat', '/proc/self/status' ], engine)
+            child.terminate()
+            ignored = [ int(line.split()[1], 16) for line in output.splitlines() if line.startswith('SigIgn:') ][0]
+            for signum in (signal.SIGCHLD, signal.SIGPIPE):
+                self.assertFalse(ignored & (1 << (signum - 1)), '%s ignored with %s'%(signum, engine))
+
+
+class TestReap(unittest.TestCase):
+    def test_reap(self):
+        for engine in ENGINES:
+            output, child = run([ 'true' ], engine)
+            child.close()
+            self.assertIn(child.pid, spawn._children)
+            # The output is over, but the child may not have exited yet
+            for i in range(500):
+                if spawn.reap():
+                    break
+                time.sleep(0.01)
+            self.assertNotIn(child.pid, spawn._children)
+            self.assertRaises(OSError, os.waitpid, child.pid, os.WNOHANG)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+'''Tests of the tcpreach test, and of the probes and the stash of sshfdpass.common.net'''
+
+import time
+import socket
+import unittest
+from sshfdpass.actions import tcp
+from sshfdpass.common import net
+from sshfdpass.tests import tcpreach
+
+
+class TestTcpReach(unittest.TestCase):
+    def setUp(self):
+        self.listener = socket.socket()
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(4)
+        self.listener.settimeout(5)
+        self.port = self.listener.getsockname()[1]
+        # Nothing listens on it, so connecting to it is refused right away
+        closed = socket.socket()
+        closed.bind(('127.0.0.1', 0))
+        self.refused = closed.getsockname()[1]
+        closed.close()
+        self.reachable = '127.0.0.1:%d'%(self.port)
+        self.unreachable = '127.0.0.1:%d'%(self.refused)
+
+    def tearDown(self):
+        net._stash.clear()
+        self.listener.close()
+
+    def evaluate(self, *targets, **settings):
+        settings.setdefault('keep', 0)
+        return tcpreach.Test(target=list(targets), aforder='4', **settings).evaluate()
+
+    def test_any(self):
+        self.assertTrue(self.evaluate(self.unreachable, self.reachable))
+        self.assertFalse(self.evaluate(self.unreachable))
+        self.assertFalse(self.evaluate())
+
+    def test_all(self):
+        self.assertFalse(self.evaluate(self.reachable, self.unreachable, mode='all'))
+        self.assertTrue(self.evaluate(self.reachable, self.reachable.replace('127.0.0.1', 'localhost'), mode='all'))
+
+    def test_not_cached(self):
+        # Even with the test cache enabled, a reachability is probed on every invocation
+        self.assertEqual(tcpreach.Test(target=[]).settings['cachettl'], 0)
+
+    def test_probe(self):
+        targets = [ ('127.0.0.1', self.port), ('127.0.0.1', self.refused) ]
+        results = net.probe(targets, net.aflist('4'), timeout=5)
+        try:
+            self.assertFalse(results[('127.0.0.1', self.refused)])
+            self.assertTrue(results[('127.0.0.1', self.port)].getblocking())
+        finally:
+            results[('127.0.0.1', self.port)].close()
+
+    def test_stashed(self):
+        # The connection of the probe is used by the action, there is no second handshake
+        self.assertTrue(self.evaluate(self.reachable, keep=5))
+        probed, address = self.listener.accept()
+        try:
+            conn = tcp.Action(aforder='4')._execute('127.0.0.1', self.port)
+            try:
+                conn.sendall(b'hello')
+                self.assertEqual(probed.recv(5), b'hello')
+            finally:
+                conn.close()
+            self.listener.settimeout(0.1)
+            self.assertRaises(socket.timeout, self.listener.accept)
+        finally:
+            probed.close()
+
+    def test_stash_expiry(self):
+        s = socket.create_connection(('127.0.0.1', self.port))
+        net.stash('127.0.0.1', self.port, s, 0.05)
+        self.assertIsNone(net.take('127.0.0.1', self.port, [ socket.AF_INET6 ]))
+        time.sleep(0.1)
+        self.assertIsNone(net.take('127.0.0.1', self.port))
+        self.assertEqual(s.fileno(), -1)
+
+
+if __name__ == '__main__':
+    unittest.main()
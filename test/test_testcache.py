@@ -0,0 +1,89 @@
+'''Tests of sshfdpass.common.testcache'''
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+from sshfdpass.common import testcache
+
+
+class FakeTest():
+    '''Stands for a test instance, the cache needs only its settings'''
+    def __init__(self, **settings):
+        self.settings = settings
+
+
+class TestTestCache(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.cache = testcache.TestCache()
+        self.cache.configure(enabled=True, file=os.path.join(self.dir, 'tests'), ttl=60)
+        self.network = 'home'
+        self.cache._file.keyed = lambda: self.network
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_off_by_default(self):
+        cache = testcache.TestCache()
+        cache.configure(file=self.cache.path)
+        cache.put(FakeTest(target=[ 'a' ]), True)
+        self.assertIsNone(cache.get(FakeTest(target=[ 'a' ])))
+        self.assertFalse(os.path.exists(self.cache.path))
+
+    def test_key(self):
+        self.assertEqual(testcache.test_key(FakeTest(target=[ 'a' ])), testcache.test_key(FakeTest(target=[ 'a' ])))
+        self.assertNotEqual(testcache.test_key(FakeTest(target=[ 'a' ])), testcache.test_key(FakeTest(target=[ 'b' ])))
+
+    def test_put_get(self):
+        test = FakeTest(target=[ '10.0.0.0/8' ])
+        self.assertIsNone(self.cache.get(test))
+        self.cache.put(test, False)
+        self.assertIs(self.cache.get(test), False)
+        self.cache.put(test, True)
+        self.assertIs(self.cache.get(test), True)
+
+    def test_expiry(self):
+        test = FakeTest(target=[ 'a' ], cachettl=0.05)
+        self.cache.put(test, True)
+        self.assertIs(self.cache.get(test), True)
+        time.sleep(0.1)
+        self.assertIsNone(self.cache.get(test))
+        # The expired entries are dropped on the next put
+        self.cache.put(FakeTest(target=[ 'b' ]), True)
+        self.assertEqual(len(self.cache._file.load()['entries']), 1)
+
+    def test_disabled(self):
+        test = FakeTest(target=[ 'a' ], cachettl=0)
+        self.cache.put(test, True)
+        self.assertIsNone(self.cache.get(test))
+        self.cache.configure(enabled=False, file=self.cache.path)
+        self.cache.put(FakeTest(target=[ 'b' ]), True)
+        self.assertIsNone(self.cache.get(FakeTest(target=[ 'b' ])))
+
+    def test_network_change(self):
+        test = FakeTest(target=[ 'a' ])
+        self.cache.put(test, True)
+        self.network = 'office'
+        self.assertIsNone(self.cache.get(test))
+
+    def test_clear(self):
+        test = FakeTest(target=[ 'a' ])
+        self.cache.put(test, True)
+        self.cache.clear()
+        self.assertIsNone(self.cache.get(test))
+
+    def test_shared(self):
+        '''Invocations sharing the file don't lose each other's results'''
+        other = testcache.TestCache()
+        other.configure(enabled=True, file=self.cache.path)
+        other._file.keyed = lambda: self.network
+        self.cache.put(FakeTest(target=[ 'a' ]), True)
+        other.put(FakeTest(target=[ 'b' ]), False)
+        self.assertIs(self.cache.get(FakeTest(target=[ 'a' ])), True)
+        self.assertIs(self.cache.get(FakeTest(target=[ 'b' ])), False)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+'''Tests of sshfdpass.common.trace and sshfdpass --explain'''
+
+import os
+import io
+import json
+import time
+import shutil
+import tempfile
+import unittest
+import sshfdpass
+from sshfdpass.common import trace, parallel
+
+
+class TestTrace(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.saved = os.environ.pop(trace.ENVIRONMENT, None)
+
+    def tearDown(self):
+        trace.activate(None)
+        if self.saved is not None:
+            os.environ[trace.ENVIRONMENT] = self.saved
+        shutil.rmtree(self.dir)
+
+    def test_phases(self):
+        current = trace.activate(trace.Trace(host='host'))
+        with trace.phase('first', detail=1) as record:
+            time.sleep(0.01)
+            record['more'] = 2
+        self.assertRaises(ValueError, self.failing)
+        report = current.report()
+        self.assertEqual(report['host'], 'host')
+        self.assertEqual([ record['phase'] for record in report['phases'] ], [ 'first', 'failing' ])
+        first, failing = report['phases']
+        self.assertGreaterEqual(first['ms'], 10)
+        self.assertEqual((first['detail'], first['more']), (1, 2))
+        self.assertEqual(failing['error'], 'ValueError: failed')
+
+    def failing(self):
+        with trace.phase('failing'):
+            raise(ValueError('failed'))
+
+    def test_inactive(self):
+        with trace.phase('nothing') as record:
+            record['ignored'] = True
+        self.assertIsNone(trace.current())
+
+    def test_inherited(self):
+        current = trace.activate(trace.Trace())
+        def work():
+            with trace.phase('background'):
+                return trace.current()
+        self.assertIs(parallel.Task(work).result(), current)
+        self.assertEqual([ record['phase'] for record in current.report()['phases'] ], [ 'background' ])
+
+    def test_write(self):
+        path = os.path.join(self.dir, 'trace')
+        for i in range(2):
+            trace.Trace(run=i).write(path)
+        with open(path) as tracefd:
+            self.assertEqual([ json.loads(line)['run'] for line in tracefd ], [ 0, 1 ])
+
+    def test_tracefile(self):
+        self.assertIsNone(trace.tracefile(None))
+        self.assertEqual(trace.tracefile(dict(enabled=True)), trace.DEFAULT_TRACEFILE)
+        os.environ[trace.ENVIRONMENT] = 'yes'
+        self.assertEqual(trace.tracefile(dict(file='/tmp/other')), '/tmp/other')
+        os.environ[trace.ENVIRONMENT] = 'off'
+        self.assertIsNone(trace.tracefile(dict(enabled=True)))
+        os.environ[trace.ENVIRONMENT] = '/tmp/explicit'
+        self.assertEqual(trace.tracefile(None), '/tmp/explicit')
+
+
+class TestExplain(unittest.TestCase):
+    def setUp(self):
+        self.saved = (sshfdpass._settings, sshfdpass._rules, sshfdpass.load_config)
+        sshfdpass._settings = dict()
+        sshfdpass._rules = { 'host': [ { 'action': 'tcp', 'tcp.host': 'first' } ] }
+        sshfdpass.load_config = lambda *args, **kwargs: None
+
+    def tearDown(self):
+        sshfdpass._settings, sshfdpass._rules, sshfdpass.load_config = self.saved
+        trace.activate(None)
+
+    def test_explain(self):
+        out = io.StringIO()
+        self.assertTrue(sshfdpass.explain('host', 22, out=out))
+        output = out.getvalue()
+        self.assertIn('applies', output)
+        self.assertIn('selected: rule 1, action: tcp', output)
+        self.assertIn('dry run', output)
+
+    def test_default(self):
+        out = io.StringIO()
+        self.assertTrue(sshfdpass.explain('other', 22, out=out))
+        self.assertIn('(default rule), unconditional: applies', out.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()